@@ -0,0 +1,55 @@
+"""Options and fixtures for the benchmarks."""
+
+import tracemalloc
+
+import pytest
+
+
+def pytest_addoption(parser):
+    """Adds the option bounding the size of the inputs."""
+
+    parser.addoption(
+        "--max-size",
+        type=float,
+        default=1e5,
+        help="Skip benchmarks with a size or n_right parameter above this. "
+        "Defaults to 1e5; pass 1e7 for the full suite.",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skips the benchmarks with a size or n_right parameter above --max-size."""
+
+    max_size = config.getoption("--max-size")
+    skip = pytest.mark.skip(reason=f"size above --max-size={max_size:,.0f}")
+
+    for item in items:
+        callspec = getattr(item, "callspec", None)
+        if callspec is None:
+            continue
+
+        params = callspec.params
+        if max(params.get("size", 0), params.get("n_right", 0)) > max_size:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def measure(benchmark):
+    """Times a function with pytest-benchmark and records its peak memory.
+
+    The peak memory of one extra call, traced with tracemalloc, is saved as
+    "peak_memory_bytes" in the benchmark's extra_info, so it is in the JSON results.
+    """
+
+    def run(func, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["peak_memory_bytes"] = peak
+
+        return benchmark.pedantic(func, args=args, kwargs=kwargs, rounds=3)
+
+    return run
@@ -0,0 +1,139 @@
+"""Benchmarks haversine, distance_table and design_matrix.
+
+size is the number of pairs for haversine and distance_table,
+and the number of left rows for design_matrix.
+"""
+
+# pylint:disable=too-many-arguments
+import numpy as np
+import pandas as pd
+import pytest
+from georelate import design_matrix, distance_table, haversine
+from georelate.data import (
+    make_bounded_points,
+    make_clustered_points,
+    make_duplicate_points,
+    make_uniform_points,
+)
+
+
+def _polar_antimeridian_points(n, seed):
+    """Points near the poles and along the antimeridian, where lat/lon math breaks."""
+
+    return pd.concat(
+        [
+            make_bounded_points(n // 4, bounds=(85, 90, -180, 180), seed=seed),
+            make_bounded_points(n // 4, bounds=(-90, -85, -180, 180), seed=seed + 1),
+            make_bounded_points(n - n // 2, bounds=(-60, 60, 179, -179), seed=seed + 2),
+        ],
+        ignore_index=True,
+    )
+
+
+DISTRIBUTIONS = {
+    "uniform": make_uniform_points,
+    "clustered": make_clustered_points,
+    "polar_antimeridian": _polar_antimeridian_points,
+    "duplicates": make_duplicate_points,
+}
+
+
+def make_frames(distribution, n_left, n_right):
+    """Makes left and right DataFrames with points from a distribution."""
+
+    make_points = DISTRIBUTIONS[distribution]
+
+    left_df = make_points(n_left, seed=0).rename(columns={"id": "left_id"})
+    right_df = make_points(n_right, seed=10).rename(columns={"id": "right_id"})
+    right_df["value"] = np.arange(n_right, dtype=float)
+
+    return left_df, right_df
+
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("distribution", DISTRIBUTIONS)
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_haversine(measure, size, distribution, dtype):
+    """Distances between size pairs of points."""
+
+    left_df, right_df = make_frames(distribution, n_left=size, n_right=size)
+
+    measure(
+        haversine,
+        left_df["lat"].to_numpy(),
+        left_df["lon"].to_numpy(),
+        right_df["lat"].to_numpy(),
+        right_df["lon"].to_numpy(),
+        dtype=dtype,
+    )
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("distribution", DISTRIBUTIONS)
+def test_distance_table(measure, size, distribution):
+    """The distance table between size // 1,000 left rows and 1,000 right rows."""
+
+    left_df, right_df = make_frames(distribution, n_left=size // 1_000, n_right=1_000)
+
+    measure(
+        distance_table,
+        left_df,
+        right_df,
+        left_id="left_id",
+        right_id="right_id",
+        chunk_size=1_000,
+    )
+
+
+# (engine, number of right rows), the cross engine computes every pair
+ENGINE_RIGHT_SIZES = [
+    ("cross", 1_000),
+    ("kdtree", 1_000),
+    ("kdtree", 1_000_000),
+    ("grid", 1_000),
+    ("grid", 1_000_000),
+]
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("distribution", DISTRIBUTIONS)
+@pytest.mark.parametrize("engine, n_right", ENGINE_RIGHT_SIZES)
+@pytest.mark.parametrize("k_closest", [1, 10])
+def test_design_matrix(measure, size, distribution, engine, n_right, k_closest):
+    """The design matrix of size left rows with the k closest right rows."""
+
+    left_df, right_df = make_frames(distribution, n_left=size, n_right=n_right)
+
+    measure(
+        design_matrix,
+        left_df,
+        right_df,
+        left_id="left_id",
+        right_id="right_id",
+        k_closest=k_closest,
+        engine=engine,
+        chunk_size=10_000,
+    )
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("distribution", DISTRIBUTIONS)
+@pytest.mark.parametrize("engine", ["cross", "kdtree", "grid"])
+def test_design_matrix_radius(measure, size, distribution, engine):
+    """The design matrix of size left rows with the right rows within 50 kms."""
+
+    left_df, right_df = make_frames(distribution, n_left=size, n_right=10_000)
+
+    measure(
+        design_matrix,
+        left_df,
+        right_df,
+        left_id="left_id",
+        right_id="right_id",
+        radius_km=50,
+        engine=engine,
+        chunk_size=10_000,
+    )
@@ -1,2 +1,17 @@
 """Import things to modify namespace"""
-from georelate._distance import haversine, distance_table, design_matrix
+
+from georelate._arrays import distance_matrix, knn_arrays, radius_arrays
+from georelate._distance import (
+    haversine,
+    distance_table,
+    distance_table_iter,
+    design_matrix,
+)
+from georelate._cache import ResultCache
+from georelate._index import GeoIndex
+from georelate._metrics import equirectangular, vincenty
+from georelate._profile import ProfileReport, StageRecord, profile
+from georelate._self_join import self_design_matrix
+from georelate._server import GeoServer
+from georelate._sparse import neighbour_matrix
+from georelate._update import update_design_matrix
@@ -0,0 +1,179 @@
+"""Finds the closest points with NumPy arrays, without DataFrames."""
+
+# pylint:disable=too-many-arguments
+import numpy as np
+
+from georelate._haversine import haversine_prepared, prepare_points
+from georelate._search import _check_radius, get_engine, knn_blocked, radius_blocked
+
+
+def _coordinates(lat, lon, dtype, side):
+    """Converts a pair of coordinate arrays to the computation's floating point type.
+
+    Args:
+        lat (ArrayLike[Number]): The latitudes.
+        lon (ArrayLike[Number]): The longitudes.
+        dtype (DTypeLike): The floating point type.
+        side (str): "left" or "right", for the error message.
+
+    Raises:
+        ValueError: If the arrays aren't one dimensional or have different lengths.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The latitudes and longitudes.
+    """
+
+    lat = np.asarray(lat, dtype=dtype)
+    lon = np.asarray(lon, dtype=dtype)
+
+    if lat.ndim != 1 or lat.shape != lon.shape:
+        raise ValueError(
+            f"{side}_lat and {side}_lon must be one dimensional with the same length, "
+            f"got shapes {lat.shape} and {lon.shape}."
+        )
+
+    return lat, lon
+
+
+def knn_arrays(
+    left_lat,
+    left_lon,
+    right_lat,
+    right_lon,
+    k,
+    engine="cross",
+    chunk_size=None,
+    n_jobs=None,
+    dtype=None,
+):
+    """Finds the k closest right points for each left point.
+
+    The search behind `design_matrix`'s k_closest, for callers that already have arrays.
+
+    Args:
+        left_lat (ArrayLike[Number]): Latitudes of the left points, shape (n,).
+        left_lon (ArrayLike[Number]): Longitudes of the left points, shape (n,).
+        right_lat (ArrayLike[Number]): Latitudes of the right points, shape (m,).
+        right_lon (ArrayLike[Number]): Longitudes of the right points, shape (m,).
+        k (int): The number of neighbours to find, from 1 to m.
+        engine (str | Callable, optional): How to find the closest points,
+            see `design_matrix`.
+            Defaults to "cross".
+        chunk_size (int, optional): The number of left points to process at a time.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads to use. Defaults to None.
+        dtype (DTypeLike, optional): The floating point type to compute distances in.
+            If None is passed, uses float64.
+            Defaults to None.
+
+    Raises:
+        ValueError: If k is out of range or the coordinates don't have matching shapes.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (indices, distances), both of shape (n, k),
+            with the positions of the closest right points and their distances in kms,
+            closest first.
+    """
+
+    dtype = np.float64 if dtype is None else dtype
+    left_lat, left_lon = _coordinates(left_lat, left_lon, dtype, "left")
+    right_lat, right_lon = _coordinates(right_lat, right_lon, dtype, "right")
+
+    if not 1 <= k <= len(right_lat):
+        raise ValueError(
+            f"k must be between 1 and the {len(right_lat)} right points, got {k}."
+        )
+
+    return knn_blocked(
+        get_engine(engine, right_lat=right_lat, right_lon=right_lon),
+        left_lat=left_lat,
+        left_lon=left_lon,
+        k=k,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+    )
+
+
+def radius_arrays(
+    left_lat,
+    left_lon,
+    right_lat,
+    right_lon,
+    radius_km,
+    engine="cross",
+    chunk_size=None,
+    n_jobs=None,
+    dtype=None,
+):
+    """Finds the pairs of left and right points within a distance of each other.
+
+    The search behind `design_matrix`'s radius_km, for callers that already have arrays.
+
+    Args:
+        left_lat (ArrayLike[Number]): Latitudes of the left points, shape (n,).
+        left_lon (ArrayLike[Number]): Longitudes of the left points, shape (n,).
+        right_lat (ArrayLike[Number]): Latitudes of the right points, shape (m,).
+        right_lon (ArrayLike[Number]): Longitudes of the right points, shape (m,).
+        radius_km (float): The distance in kms.
+        engine (str | Callable, optional): How to find the points, see `design_matrix`.
+            Defaults to "cross".
+        chunk_size (int, optional): The number of left points to process at a time.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads to use. Defaults to None.
+        dtype (DTypeLike, optional): The floating point type to compute distances in.
+            If None is passed, uses float64.
+            Defaults to None.
+
+    Raises:
+        ValueError: If radius_km is negative or the coordinates don't have matching shapes.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]:
+            (left_positions, right_positions, distances) for each pair within radius_km,
+            sorted by left position, then distance.
+    """
+
+    _check_radius(radius_km)
+
+    dtype = np.float64 if dtype is None else dtype
+    left_lat, left_lon = _coordinates(left_lat, left_lon, dtype, "left")
+    right_lat, right_lon = _coordinates(right_lat, right_lon, dtype, "right")
+
+    return radius_blocked(
+        get_engine(engine, right_lat=right_lat, right_lon=right_lon),
+        left_lat=left_lat,
+        left_lon=left_lon,
+        radius_km=radius_km,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+    )
+
+
+def distance_matrix(left_lat, left_lon, right_lat, right_lon, dtype=None):
+    """Computes the distance between every left and right point.
+
+    The distances behind `distance_table`, as an (n, m) array instead of n * m rows.
+
+    Args:
+        left_lat (ArrayLike[Number]): Latitudes of the left points, shape (n,).
+        left_lon (ArrayLike[Number]): Longitudes of the left points, shape (n,).
+        right_lat (ArrayLike[Number]): Latitudes of the right points, shape (m,).
+        right_lon (ArrayLike[Number]): Longitudes of the right points, shape (m,).
+        dtype (DTypeLike, optional): The floating point type to compute distances in.
+            If None is passed, uses float64.
+            Defaults to None.
+
+    Raises:
+        ValueError: If the coordinates don't have matching shapes.
+
+    Returns:
+        np.ndarray: The distances in kms, shape (n, m).
+    """
+
+    dtype = np.float64 if dtype is None else dtype
+    left_points = prepare_points(*_coordinates(left_lat, left_lon, dtype, "left"))
+    right_points = prepare_points(*_coordinates(right_lat, right_lon, dtype, "right"))
+
+    return haversine_prepared(
+        left_points.take((slice(None), np.newaxis)), right_points.take(np.newaxis)
+    )
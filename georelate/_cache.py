@@ -0,0 +1,198 @@
+"""Caches results keyed on the content of the inputs."""
+
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# bump whenever results for the same inputs change, so older cache entries are ignored
+CACHE_VERSION = 1
+
+
+def _update_with_values(hasher, values):
+    """Adds the content of an index or column to a hash.
+
+    Numeric buffers are hashed as is, other values with pandas' hashing.
+
+    Args:
+        hasher (hashlib._Hash): The hash to update.
+        values (Index | Series): The values.
+    """
+
+    hasher.update(str(values.dtype).encode("utf-8"))
+
+    array = values.to_numpy()
+    if array.dtype.kind not in "biufcmM":
+        array = pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+    hasher.update(np.ascontiguousarray(array).data)
+
+
+def fingerprint(name, frames, params):
+    """Hashes the content of DataFrames and the parameters of a function call.
+
+    Args:
+        name (str): The name of the function.
+        frames (list[DataFrame]): The DataFrames the result depends on.
+        params (dict): The other arguments the result depends on.
+            Their repr must identify them.
+
+    Returns:
+        str: The hex digest.
+    """
+
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(repr((CACHE_VERSION, name, sorted(params.items()))).encode("utf-8"))
+
+    for frame in frames:
+        # the index name becomes the id column when no id column is passed
+        names = (list(frame.index.names), list(frame.columns.names))
+        hasher.update(repr((frame.shape, list(frame.columns), names)).encode("utf-8"))
+        _update_with_values(hasher, frame.index)
+        for _, column in frame.items():
+            _update_with_values(hasher, column)
+
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    """A cache of results for `distance_table` and `design_matrix`.
+
+    Pass it as their cache argument.
+    Results are keyed on a hash of the input DataFrames and the arguments that change
+    the result, so rerunning on unchanged inputs returns the stored result.
+    The least recently used results are evicted once the results in memory
+    exceed max_bytes, and the least recently used files once the files on disk
+    exceed max_disk_bytes.
+
+    Args:
+        max_bytes (int, optional): The memory the results kept in memory may use.
+            Defaults to 256 MiB.
+        directory (str | os.PathLike, optional): A directory to also store results in,
+            as Parquet files, so they are kept across runs.
+            Requires pyarrow, install it with `pip install georelate[parquet]`.
+            If None is passed, only keeps results in memory.
+            Defaults to None.
+        max_disk_bytes (int, optional): The size the files in directory may use.
+            If None is passed, files are never evicted.
+            Defaults to None.
+
+    Attributes:
+        hits (int): The number of results found in the cache.
+        misses (int): The number of results computed.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, directory=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.directory = None if directory is None else Path(directory)
+        self.max_disk_bytes = max_disk_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        self._results = OrderedDict()
+        self._n_bytes = 0
+
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def __len__(self):
+        return len(self._results)
+
+    @property
+    def n_bytes(self):
+        """int: The memory used by the results kept in memory."""
+        return self._n_bytes
+
+    def clear(self):
+        """Removes every result, from memory and from disk, and resets the counters."""
+
+        self._results.clear()
+        self._n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        if self.directory is not None:
+            for path in self.directory.glob("*.parquet"):
+                path.unlink()
+
+    def get_or_compute(self, name, frames, params, compute):
+        """Gets a result from the cache, computing and storing it if it is missing.
+
+        Args:
+            name (str): The name of the function.
+            frames (list[DataFrame]): The DataFrames the result depends on.
+            params (dict): The other arguments the result depends on.
+            compute (Callable[[], DataFrame]): Computes the result.
+
+        Returns:
+            DataFrame: A copy of the result.
+        """
+
+        key = fingerprint(name, frames, params)
+
+        result = self._get(key)
+        if result is not None:
+            self.hits += 1
+            return result.copy()
+
+        self.misses += 1
+        result = compute()
+        self._put_in_memory(key, result.copy())
+        if self.directory is not None:
+            self._put_on_disk(key, result)
+
+        return result
+
+    def _get(self, key):
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key][0]
+
+        if self.directory is None:
+            return None
+
+        path = self.directory / f"{key}.parquet"
+        try:
+            result = pd.read_parquet(path)
+        except FileNotFoundError:
+            return None
+
+        # marks the file as recently used for eviction
+        os.utime(path)
+        self._put_in_memory(key, result)
+
+        return result
+
+    def _put_in_memory(self, key, result):
+        n_bytes = int(result.memory_usage(index=True, deep=True).sum())
+        if n_bytes > self.max_bytes:
+            return
+
+        self._results[key] = (result, n_bytes)
+        self._n_bytes += n_bytes
+
+        while self._n_bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self._results.popitem(last=False)
+            self._n_bytes -= evicted_bytes
+
+    def _put_on_disk(self, key, result):
+        result.to_parquet(self.directory / f"{key}.parquet")
+
+        if self.max_disk_bytes is None:
+            return
+
+        files = [
+            (path.stat().st_mtime, path.stat().st_size, path)
+            for path in self.directory.glob("*.parquet")
+        ]
+        n_bytes = sum(size for _, size, _ in files)
+
+        for _, size, path in sorted(files):
+            if n_bytes <= self.max_disk_bytes:
+                break
+            path.unlink()
+            n_bytes -= size
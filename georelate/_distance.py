@@ -1,40 +1,35 @@
 """Computes distances."""
 
 # pylint:disable=too-many-arguments, too-many-locals
+from functools import partial
+
 import numpy as np
 import pandas as pd
 
-
-def haversine(p1_lat, p1_lon, p2_lat, p2_lon, radius=6367):
-    """Computes the distances between 2 list of points of the same length.
-
-    Note: The Earth is not perfectly spherical, so there isn't one right number for the radius.
-
-    Args:
-        p1_lat (ArrayLike[Number]): An array of latitudes form the first list of coordinates.
-        p1_lon (ArrayLike[Number]): An array of longitudes form the first list of coordinates.
-        p2_lat (ArrayLike[Number]): An array of latitudes form the second list of coordinates.
-        p2_lon (ArrayLike[Number]): An array of longitudes form the second list of coordinates.
-        radius (int, optional): Radius of the Earth. Defaults to 6367.
-
-    Returns:
-        ArrayLike[Number]: An array of distances between the points in kms.
-    """
-
-    p1_lon_r, p1_lat_r, p2_lon_r, p2_lat_r = map(
-        np.radians, [p1_lon, p1_lat, p2_lon, p2_lat]
-    )
-
-    d_lon_r = p2_lon_r - p1_lon_r
-    d_lat_r = p2_lat_r - p1_lat_r
-
-    partial = (
-        np.sin(d_lat_r / 2) ** 2
-        + np.cos(p1_lat_r) * np.cos(p2_lat_r) * np.sin(d_lon_r / 2) ** 2
-    )
-    d_r = 2 * np.arcsin(np.sqrt(partial))
-
-    return radius * d_r
+from georelate._haversine import (  # pylint:disable=unused-import
+    haversine,
+    haversine_prepared,
+    prepare_points,
+)
+from georelate._metrics import (
+    get_metric,
+    knn_metric_blocked,
+    radius_metric_blocked,
+)
+from georelate._partitions import is_path, iter_partitions, write_partitions
+from georelate._profile import stage
+from georelate._search import (
+    _check_radius,
+    chunks,
+    get_engine,
+    knn_blocked,
+    map_blocks,
+    radius_blocked,
+    radius_features,
+)
+
+# the default number of pairs in a chunk of distance_table_iter
+_CHUNK_PAIRS = 1_000_000
 
 
 def _get_id_keys(
@@ -95,6 +90,169 @@ def _get_id_keys_with_potential_suffix(left, right, left_id, right_id, suffixes)
     return left_id_key, right_id_key
 
 
+def _right_groups(right, by):
+    """Splits the rows of a right DataFrame into the groups sharing a key.
+
+    Args:
+        right (DataFrame): The right DataFrame.
+        by (list[str]): The key columns.
+
+    Returns:
+        tuple[MultiIndex, list[np.ndarray]]: The keys, in the order they first appear,
+            and the positions of the rows with each key.
+    """
+
+    codes, keys = pd.MultiIndex.from_frame(right[by]).factorize()
+    order = np.argsort(codes, kind="stable")
+    stops = np.cumsum(np.bincount(codes, minlength=len(keys)))
+
+    return keys, np.split(order, stops[:-1])
+
+
+def _left_groups(left, keys, by):
+    """Splits the rows of a left DataFrame into the groups sharing a key.
+
+    Args:
+        left (DataFrame): The left DataFrame.
+        keys (MultiIndex): The keys of the right DataFrame, see `_right_groups`.
+        by (list[str]): The key columns.
+
+    Returns:
+        list[tuple[int, np.ndarray]]: For each key, in the order they first appear,
+            its position in keys, or -1 if no right row has it,
+            and the positions of the left rows with it.
+    """
+
+    codes = keys.get_indexer(pd.MultiIndex.from_frame(left[by]))
+    order = np.argsort(codes, kind="stable")
+    present, firsts, counts = np.unique(codes, return_index=True, return_counts=True)
+    groups = np.split(order, np.cumsum(counts)[:-1])
+
+    return [
+        (int(present[group]), groups[group])
+        for group in np.argsort(firsts, kind="stable")
+    ]
+
+
+def _distance_blocks(
+    left,
+    right,
+    left_id,
+    right_id,
+    left_lat,
+    left_lon,
+    right_lat,
+    right_lon,
+    suffixes,
+    max_distance_km=None,
+    dtype=None,
+    right_points=None,
+    metric="haversine",
+):
+    """Prepares the computation of the distance table in blocks of left rows.
+
+    Args:
+        left (DataFrame): Left DataFrame. Assumes the index is an id.
+        right (DataFrame): Right DataFrame. Assumes the index is an id.
+        left_id (str | None): Column containing the id for the left DataFrame.
+        right_id (str | None): Column containing the id for the right DataFrame.
+        left_lat (str): Column containing the latitude in the left DataFrame.
+        left_lon (str): Column containing the longitude in the left DataFrame.
+        right_lat (str): Column containing the latitude in the right DataFrame.
+        right_lon (str): Column containing the longitude in the right DataFrame.
+        suffixes (tuple): The suffixes for overlapping column names.
+        max_distance_km (float, optional): Only keep pairs at most this far apart.
+            Defaults to None.
+        dtype (DTypeLike, optional): The floating point type to compute distances in.
+            Defaults to None.
+        right_points (PreparedPoints, optional): The right coordinates, already prepared.
+            Defaults to None.
+        metric (str, optional): The metric to compute distances with, see `get_metric`.
+            Defaults to "haversine".
+
+    Returns:
+        tuple[Callable, int]: A function that computes the distance table
+            for a slice of left rows, and the number of left rows.
+    """
+
+    left_id_key, right_id_key = _get_id_keys(
+        left=left,
+        right=right,
+        left_id=left_id,
+        right_id=right_id,
+    )
+
+    left_df = left.reset_index().loc[:, [left_id_key, left_lat, left_lon]]
+    right_df = right.reset_index().loc[:, [right_id_key, right_lat, right_lon]]
+
+    # merge the empty frames, to name the columns exactly like a cross merge
+    columns = pd.merge(
+        left=left_df.iloc[:0],
+        right=right_df.iloc[:0],
+        how="cross",
+        suffixes=suffixes,
+    ).columns
+
+    left_df.columns = columns[:3]
+    right_df.columns = columns[3:]
+
+    # the coordinates follow the ids, whatever suffixes they got
+    left_lat_key, left_lon_key = left_df.columns[1:]
+    right_lat_key, right_lon_key = right_df.columns[1:]
+
+    distance = get_metric(metric)
+
+    left_points = prepare_points(
+        left_df[left_lat_key].to_numpy(), left_df[left_lon_key].to_numpy(), dtype=dtype
+    )
+    if right_points is None:
+        right_points = prepare_points(
+            right_df[right_lat_key].to_numpy(),
+            right_df[right_lon_key].to_numpy(),
+            dtype=dtype,
+        )
+    right_points = right_points.take(np.newaxis)
+
+    n_right = len(right_df)
+
+    def make_block(block):
+        left_positions = np.arange(len(left_df))[block]
+
+        # computed as a (block, right) matrix,
+        # so each row's trigonometry is only computed once
+        if metric == "haversine":
+            distances = haversine_prepared(
+                left_points.take(block).take((slice(None), np.newaxis)), right_points
+            ).ravel()
+        else:
+            distances = distance(
+                left_df[left_lat_key].to_numpy()[block, np.newaxis],
+                left_df[left_lon_key].to_numpy()[block, np.newaxis],
+                right_df[right_lat_key].to_numpy(),
+                right_df[right_lon_key].to_numpy(),
+                dtype=np.float64 if dtype is None else dtype,
+            ).ravel()
+
+        left_take = np.repeat(left_positions, n_right)
+        right_take = np.tile(np.arange(n_right), len(left_positions))
+
+        if max_distance_km is not None:
+            within = distances <= max_distance_km
+            left_take = left_take[within]
+            right_take = right_take[within]
+            distances = distances[within]
+
+        return pd.concat(
+            [
+                left_df.take(left_take).reset_index(drop=True),
+                right_df.take(right_take).reset_index(drop=True),
+            ],
+            axis="columns",
+        ).assign(distance=distances)
+
+    return make_block, len(left_df)
+
+
 def distance_table(
     left,
     right,
@@ -105,6 +263,13 @@ def distance_table(
     right_lat="lat",
     right_lon="lon",
     suffixes=("_left", "_right"),
+    chunk_size=None,
+    n_jobs=None,
+    max_distance_km=None,
+    dtype=None,
+    cache=None,
+    by=None,
+    metric="haversine",
 ):
     """_summary_
 
@@ -131,67 +296,393 @@ def distance_table(
             left or right should be left as-is, with no suffix.
             At least one of the values must not be None.
             Defaults to ("_left", "_right").
+        chunk_size (int, optional): The number of rows from the left DataFrame
+            to compute distances for at a time.
+            Bounds the memory used for intermediate results,
+            but not the size of the output.
+            If None is passed, processes all rows at once.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads to compute distances with.
+            Rows from the left DataFrame are split into blocks across the threads
+            and the output keeps their order.
+            -1 uses all CPUs.
+            If None is passed, uses a single thread.
+            Defaults to None.
+        max_distance_km (float, optional): Only keep pairs of observations
+            at most this many kms apart.
+            If None is passed, keeps every pair.
+            Defaults to None.
+        dtype (DTypeLike, optional): The floating point type to compute distances in.
+            np.float32 halves the memory used, with errors of metres for most distances,
+            see `haversine`.
+            If None is passed, uses float64.
+            Defaults to None.
+        cache (ResultCache, optional): A cache to get the result from,
+            keyed on the ids and coordinates of both DataFrames and the arguments.
+            If None is passed, always computes the result.
+            Defaults to None.
+        by (str | list[str], optional): Columns of both DataFrames to match on.
+            Only pairs of observations with equal values in them are computed,
+            so the cost is the sum of each key's number of pairs,
+            instead of len(left) * len(right).
+            The pairs are grouped by key, in the order the keys first appear in left.
+            n_jobs then computes the keys in parallel.
+            If None is passed, pairs every observation.
+            Defaults to None.
+        metric (str, optional): The metric to compute distances with.
+            "haversine" is the great-circle distance on a sphere, see `haversine`.
+            "equirectangular" projects the points onto a plane, which is cheaper
+            and close to haversine for short distances, see `equirectangular`.
+            "vincenty" is the distance on the WGS84 ellipsoid,
+            which is more accurate and more expensive, see `vincenty`.
+            Defaults to "haversine".
 
     Returns:
         _type_: _description_
     """
 
-    left_id_key, right_id_key = _get_id_keys(
+    if by is not None:
+        by = [by] if isinstance(by, str) else list(by)
+
+    if cache is not None:
+        params = {
+            "left_id": left_id,
+            "right_id": right_id,
+            "left_lat": left_lat,
+            "left_lon": left_lon,
+            "right_lat": right_lat,
+            "right_lon": right_lon,
+            "suffixes": suffixes,
+            "max_distance_km": max_distance_km,
+            "dtype": dtype,
+            "by": by,
+            "metric": metric,
+        }
+        left_columns = (
+            [left_lat, left_lon] if left_id is None else [left_id, left_lat, left_lon]
+        ) + (by or [])
+        right_columns = (
+            [right_lat, right_lon]
+            if right_id is None
+            else [right_id, right_lat, right_lon]
+        ) + (by or [])
+
+        return cache.get_or_compute(
+            "distance_table",
+            frames=[left.loc[:, left_columns], right.loc[:, right_columns]],
+            params=params,
+            compute=lambda: distance_table(
+                left, right, **params, chunk_size=chunk_size, n_jobs=n_jobs
+            ),
+        )
+
+    if by is not None and len(left) > 0:
+        keys, right_groups = _right_groups(right, by)
+        groups = [group for group in _left_groups(left, keys, by) if group[0] >= 0]
+
+        def run(group):
+            code, left_positions = group
+            return distance_table(
+                left.iloc[left_positions],
+                right.iloc[right_groups[code]],
+                left_id=left_id,
+                right_id=right_id,
+                left_lat=left_lat,
+                left_lon=left_lon,
+                right_lat=right_lat,
+                right_lon=right_lon,
+                suffixes=suffixes,
+                chunk_size=chunk_size,
+                max_distance_km=max_distance_km,
+                dtype=dtype,
+                metric=metric,
+            )
+
+        tables = map_blocks(run, groups, n_jobs)
+        if tables:
+            return pd.concat(tables, ignore_index=True)
+
+        # no key is in both, so the table is empty
+        left = left.iloc[:0]
+
+    with stage("prepare", rows=len(left)):
+        make_block, n_left = _distance_blocks(
+            left=left,
+            right=right,
+            left_id=left_id,
+            right_id=right_id,
+            left_lat=left_lat,
+            left_lon=left_lon,
+            right_lat=right_lat,
+            right_lon=right_lon,
+            suffixes=suffixes,
+            max_distance_km=max_distance_km,
+            dtype=dtype,
+            metric=metric,
+        )
+
+    with stage("distances", rows=n_left * len(right)):
+        blocks = map_blocks(make_block, chunks(n_left, chunk_size, n_jobs), n_jobs)
+
+    with stage("concat", rows=n_left * len(right)):
+        return pd.concat(blocks, ignore_index=True)
+
+
+def distance_table_iter(
+    left,
+    right,
+    left_id=None,
+    right_id=None,
+    left_lat="lat",
+    left_lon="lon",
+    right_lat="lat",
+    right_lon="lon",
+    suffixes=("_left", "_right"),
+    chunk_size=None,
+    max_distance_km=None,
+    dtype=None,
+    metric="haversine",
+):
+    """Computes the distance table in chunks, without holding all of it in memory.
+
+    Yields DataFrames with the same columns as `distance_table`,
+    which concatenate to the same table.
+    Useful for piping a large table into a writer, e.g. a Parquet file.
+
+    Args:
+        left (DataFrame): Left DataFrame to merge with. Assumes the index is an id.
+        right (DataFrame): Right DataFrame to merge with. Assumes the index is an id.
+        left_id (str, optional): Column containing the id for the left DataFrame.
+            If None is passed, assumes the index is the id.
+            Defaults to None.
+        right_id (str, optional): Column containing the id for the right DataFrame.
+            If None is passed, assumes the index is the id.
+            Defaults to None.
+        left_lat (str, optional): Column containing the latitude in the left DataFrame.
+            Defaults to "lat".
+        left_lon (str, optional): Column containing the longitude in the left DataFrame.
+            Defaults to "lon".
+        right_lat (str, optional): Column containing the latitude in the right DataFrame.
+            Defaults to "lat".
+        right_lon (str, optional): Column containing the longitude in the right DataFrame.
+            Defaults to "lon".
+        suffixes (tuple, optional): A length-2 sequence where each element is optionally a string
+            indicating the suffix to add to overlapping column names in left and right respectively.
+            Pass a value of None instead of a string to indicate that the column name from
+            left or right should be left as-is, with no suffix.
+            At least one of the values must not be None.
+            Defaults to ("_left", "_right").
+        chunk_size (int, optional): The number of rows from the left DataFrame per chunk,
+            so each chunk has at most chunk_size * len(right) rows.
+            If None is passed, uses as many rows as fit about a million pairs per chunk.
+            Defaults to None.
+        max_distance_km (float, optional): Only keep pairs of observations
+            at most this many kms apart.
+            If None is passed, keeps every pair.
+            Defaults to None.
+        dtype (DTypeLike, optional): The floating point type to compute distances in.
+            np.float32 halves the memory used, with errors of metres for most distances,
+            see `haversine`.
+            If None is passed, uses float64.
+            Defaults to None.
+        metric (str, optional): The metric to compute distances with,
+            see `distance_table`.
+            Defaults to "haversine".
+
+    Yields:
+        DataFrame: The next chunk of the distance table.
+            Chunks left empty by max_distance_km are skipped.
+    """
+
+    make_block, n_left = _distance_blocks(
         left=left,
         right=right,
         left_id=left_id,
         right_id=right_id,
-    )
-
-    merged_df = pd.merge(
-        left=left.reset_index().loc[:, [left_id_key, left_lat, left_lon]],
-        right=right.reset_index().loc[:, [right_id_key, right_lat, right_lon]],
-        how="cross",
+        left_lat=left_lat,
+        left_lon=left_lon,
+        right_lat=right_lat,
+        right_lon=right_lon,
         suffixes=suffixes,
+        max_distance_km=max_distance_km,
+        dtype=dtype,
+        metric=metric,
     )
 
-    left_lat_key = (
-        left_lat if left_lat in merged_df.columns else f"{left_lat}{suffixes[0]}"
-    )
-    left_lon_key = (
-        left_lon if left_lon in merged_df.columns else f"{left_lon}{suffixes[0]}"
-    )
-    right_lat_key = (
-        right_lat if right_lat in merged_df.columns else f"{right_lat}{suffixes[1]}"
-    )
-    right_lon_key = (
-        right_lon if right_lon in merged_df.columns else f"{right_lon}{suffixes[1]}"
+    if chunk_size is None:
+        chunk_size = max(_CHUNK_PAIRS // max(len(right), 1), 1)
+
+    for block in chunks(n_left, chunk_size):
+        block_df = make_block(block)
+
+        if max_distance_km is None or len(block_df) > 0:
+            yield block_df
+
+
+def _k_closest_frame(right_df, right_id_key, right_id_prefix, indices, distances):
+    """Builds the columns describing the k closest right rows for each left row.
+
+    Each column of the right DataFrame is gathered once with the (n, k) positions,
+    instead of merging the right DataFrame once per neighbour.
+
+    Args:
+        right_df (DataFrame): The right DataFrame, with the id as a column.
+        right_id_key (str): Column containing the id in the right DataFrame.
+        right_id_prefix (str): Prefix of the right id columns in the output.
+        indices (np.ndarray): Positions of the closest right rows, shape (n, k).
+        distances (np.ndarray): Distances to the closest right rows, shape (n, k).
+
+    Returns:
+        DataFrame: The ids and distances of the k closest right rows,
+            followed by their other columns, one block of columns per neighbour.
+    """
+
+    k = indices.shape[1]
+    flat_indices = indices.ravel()
+
+    gathered = {
+        column: right_df[column].array.take(flat_indices) for column in right_df.columns
+    }
+
+    columns = []
+
+    def add(name, values):
+        # overlapping names get the suffixes merge would have added
+        for column in columns:
+            if column[0] == name:
+                column[0] = f"{name}_x"
+                name = f"{name}_y"
+                break
+        columns.append([name, values])
+
+    for j in range(k):
+        add(f"{right_id_prefix}_{j + 1}_closest", gathered[right_id_key][j::k])
+        add(f"distance_{j + 1}_closest", distances[:, j])
+
+    for j in range(k):
+        for column, values in gathered.items():
+            if column == right_id_key == right_id_prefix:
+                continue
+            add(f"{column}_{j + 1}_closest", values[j::k])
+
+    return pd.DataFrame(dict(columns))
+
+
+def _design_matrix(
+    left,
+    right,
+    right_df,
+    search_engine,
+    left_id,
+    right_id,
+    left_lat,
+    left_lon,
+    right_lat,
+    right_lon,
+    suffixes,
+    k_closest,
+    include_left_coords,
+    include_right_coords,
+    chunk_size,
+    n_jobs,
+    radius_km,
+    metric="haversine",
+):
+    """Builds the design matrix with an engine prepared for the right DataFrame.
+
+    See `design_matrix` for the arguments.
+    right_df is the right DataFrame with the id as a column,
+    and search_engine holds its coordinates.
+
+    Returns:
+        DataFrame: The design matrix.
+    """
+
+    _check_radius(radius_km)
+
+    # unknown metrics are rejected even when no distance is computed
+    get_metric(metric)
+    if metric == "haversine":
+        knn_search, radius_search = knn_blocked, radius_blocked
+    else:
+        knn_search = partial(knn_metric_blocked, metric=metric)
+        radius_search = partial(radius_metric_blocked, metric=metric)
+
+    left_id_key, right_id_key = _get_id_keys(
+        left=left, right=right, left_id=left_id, right_id=right_id
     )
 
-    return merged_df.assign(
-        distance=lambda df_: haversine(
-            p1_lat=df_[left_lat_key],
-            p1_lon=df_[left_lon_key],
-            p2_lat=df_[right_lat_key],
-            p2_lon=df_[right_lon_key],
-        )
+    left_id_key_w_suffix, right_id_key_w_suffix = _get_id_keys_with_potential_suffix(
+        left=left, right=right, left_id=left_id, right_id=right_id, suffixes=suffixes
     )
 
+    left_df = left.reset_index() if left_id is None else left
 
-def _k_closest(df, left_id, right_id, k):
-    grouped = df.groupby(left_id)
+    # the engine computes distances in the type of its coordinates
+    dtype = search_engine.right_lat.dtype
+    left_lat_values = left_df[left_lat].to_numpy(dtype=dtype)
+    left_lon_values = left_df[left_lon].to_numpy(dtype=dtype)
 
-    join_data = []
+    out_df = left_df.copy()
 
-    for left_id_, group_df in grouped:
-        design_row = {}
+    if k_closest:
+        if k_closest > len(right_df):
+            raise ValueError(
+                f"k_closest={k_closest} exceeds the {len(right_df)} rows in right."
+            )
+
+        with stage("knn", rows=len(left_df)):
+            indices, distances = knn_search(
+                search_engine,
+                left_lat=left_lat_values,
+                left_lon=left_lon_values,
+                k=k_closest,
+                chunk_size=chunk_size,
+                n_jobs=n_jobs,
+            )
+
+        with stage("k_closest_columns", rows=len(left_df)):
+            k_closest_df = _k_closest_frame(
+                right_df=(
+                    right_df
+                    if include_right_coords
+                    else right_df.drop([right_lat, right_lon], axis="columns")
+                ),
+                right_id_key=right_id_key,
+                right_id_prefix=right_id_key_w_suffix,
+                indices=indices,
+                distances=distances,
+            )
+
+            if left_id_key_w_suffix != left_id_key:
+                k_closest_df.insert(
+                    0, left_id_key_w_suffix, left_df[left_id_key].to_numpy()
+                )
 
-        nsmallest_df = group_df.nsmallest(n=k, columns="distance")
+            out_df = pd.concat(
+                [out_df.reset_index(drop=True), k_closest_df], axis="columns"
+            )
 
-        design_row[left_id] = left_id_
+    if radius_km is not None:
+        with stage("radius", rows=len(left_df)):
+            left_positions, _, distances = radius_search(
+                search_engine,
+                left_lat=left_lat_values,
+                left_lon=left_lon_values,
+                radius_km=radius_km,
+                chunk_size=chunk_size,
+                n_jobs=n_jobs,
+            )
 
-        for idx, (_, row) in enumerate(nsmallest_df.iterrows()):
-            design_row[f"{right_id}_{idx + 1 }_closest"] = row[right_id]
-            design_row[f"distance_{idx + 1}_closest"] = row["distance"]
+        with stage("radius_features", rows=len(left_df)):
+            out_df = out_df.assign(
+                **radius_features(left_positions, distances, n_left=len(left_df))
+            )
 
-        join_data.append(design_row)
+    if not include_left_coords:
+        out_df = out_df.drop([left_lat, left_lon], axis="columns")
 
-    return pd.DataFrame(join_data)
+    return out_df
 
 
 def design_matrix(
@@ -207,12 +698,27 @@ def design_matrix(
     k_closest=None,
     include_left_coords=False,
     include_right_coords=False,
+    engine="cross",
+    chunk_size=None,
+    n_jobs=None,
+    radius_km=None,
+    dtype=None,
+    cache=None,
+    output=None,
+    by=None,
+    metric="haversine",
 ):
-
     """_summary_
 
     Args:
-        left (DataFrame): Left DataFrame to merge with. Assumes the index is an id.
+        left (DataFrame | str | os.PathLike | Iterable[DataFrame]):
+            Left DataFrame to merge with. Assumes the index is an id.
+            To process data that doesn't fit in memory, pass the path to a Parquet file
+            or a directory of Parquet files, or an iterable of DataFrames, instead.
+            They are read and processed one partition at a time,
+            against the right DataFrame prepared once,
+            and an iterator of design matrices, one per partition, is returned.
+            Reading Parquet requires pyarrow and a left_id.
         right (DataFrame): Right DataFrame to merge with. Assumes the index is an id.
         left_id (str, optional): Column containing the id for the left DataFrame.
             If None is passed, assumes the index is the id.
@@ -243,83 +749,205 @@ def design_matrix(
         include_right_coords (bool, optional): Specifies whether to include the coordinates
             from the right DataFrame in the results.
             Defaults to False.
+        engine (str | Callable, optional): How to find the k closest observations.
+            "cross" computes the distance to every observation in the right DataFrame.
+            "kdtree" searches a k-d tree built on the right DataFrame,
+            which scales to large inputs and requires scipy.
+            Ties at the k-th distance may be broken differently than with "cross".
+            "grid" searches a latitude and longitude grid of the right DataFrame
+            with NumPy only, and gives the same results as "cross".
+            It scales to large inputs in bounded memory, though slower than "kdtree".
+            A callable with the signature
+            `(left_lat, left_lon, right_lat, right_lon, k) -> (indices, distances)`
+            returning arrays of shape (n_left, k) may also be passed.
+            Defaults to "cross".
+        chunk_size (int, optional): The number of rows from the left DataFrame
+            to find the closest observations for at a time.
+            With the "cross" engine, only a chunk_size by len(right) block
+            of distances is held in memory, instead of a len(left) by len(right) one.
+            If None is passed, processes all rows at once.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads to find the closest observations with.
+            Rows from the left DataFrame are split into blocks across the threads
+            and the output keeps their order.
+            -1 uses all CPUs.
+            If None is passed, uses a single thread.
+            Defaults to None.
+        radius_km (float, optional): Specifies a distance in kms to summarize
+            the observations from the right DataFrame within, for each observation
+            in the left DataFrame. Adds the columns "count_within_radius",
+            "min_distance_within_radius" and "mean_distance_within_radius",
+            where the distances are NaN if there are no observations within the radius.
+            Only pairs that pass a latitude and longitude prefilter,
+            or the k-d tree with the "kdtree" engine, have their distance computed.
+            Can be combined with k_closest.
+            Defaults to None.
+        dtype (DTypeLike, optional): The floating point type to compute distances in.
+            np.float32 halves the memory used, with errors of metres for most distances,
+            see `haversine`.
+            If None is passed, uses float64.
+            Defaults to None.
+        cache (ResultCache, optional): A cache to get the result from,
+            keyed on the content of both DataFrames and the arguments.
+            chunk_size and n_jobs don't change the result, so they aren't part of the key.
+            If None is passed, always computes the result.
+            Defaults to None.
+        output (str | os.PathLike, optional): A directory to write the design matrix to,
+            as one Parquet file per partition of left, written as soon as it is computed.
+            Requires pyarrow.
+            If None is passed, returns the design matrix.
+            Defaults to None.
+        by (str | list[str], optional): Columns of both DataFrames to match on.
+            The closest observations and the observations within radius_km
+            of each row of left are only searched among the rows of right
+            with equal values in them, with the right rows of each key prepared once.
+            Every key of left must have at least k_closest rows in right.
+            n_jobs then searches the keys in parallel.
+            The design matrix keeps the order of left.
+            If None is passed, searches every row of right.
+            Defaults to None.
+        metric (str, optional): The metric to compute distances with,
+            see `distance_table`.
+            The engine ranks the candidates by haversine distance,
+            and only the closest ones get their distance computed with the metric,
+            as many as needed to guarantee the same results as computing it for all.
+            Defaults to "haversine".
 
     Returns:
-        DataFrame: The design matrix.
+        DataFrame | Iterator[DataFrame] | list[Path]: The design matrix,
+            an iterator of design matrices if left is partitioned,
+            or the paths of the files written if output is passed.
     """
 
-    left_id_key, right_id_key = _get_id_keys(
-        left=left, right=right, left_id=left_id, right_id=right_id
-    )
-
-    left_id_key_w_suffix, right_id_key_w_suffix = _get_id_keys_with_potential_suffix(
-        left=left, right=right, left_id=left_id, right_id=right_id, suffixes=suffixes
-    )
+    partitioned = output is not None or not isinstance(left, pd.DataFrame)
 
-    distance_df = distance_table(
-        left,
-        right,
-        left_id=left_id,
-        right_id=right_id,
-        left_lat=left_lat,
-        left_lon=left_lon,
-        right_lat=right_lat,
-        right_lon=right_lon,
-        suffixes=suffixes,
-    )
+    if partitioned and cache is not None:
+        raise ValueError("cache can only be used with a left DataFrame and no output.")
 
-    left_df = left.reset_index() if left_id is None else left
-    right_df = right.reset_index() if right_id is None else right
+    if left_id is None and is_path(left):
+        raise ValueError(
+            "left_id is required when left is read from Parquet, "
+            "since the index of each partition starts over."
+        )
 
-    k_closest_join_df = _k_closest(
-        df=distance_df,
-        left_id=left_id_key_w_suffix,
-        right_id=right_id_key_w_suffix,
-        k=k_closest,
-    )
+    if cache is not None:
+        params = {
+            "left_id": left_id,
+            "right_id": right_id,
+            "left_lat": left_lat,
+            "left_lon": left_lon,
+            "right_lat": right_lat,
+            "right_lon": right_lon,
+            "suffixes": suffixes,
+            "k_closest": k_closest,
+            "include_left_coords": include_left_coords,
+            "include_right_coords": include_right_coords,
+            "engine": engine,
+            "radius_km": radius_km,
+            "dtype": dtype,
+            "by": by,
+            "metric": metric,
+        }
+
+        # every column of both DataFrames can end up in the design matrix
+        return cache.get_or_compute(
+            "design_matrix",
+            frames=[left, right],
+            params=params,
+            compute=lambda: design_matrix(
+                left, right, **params, chunk_size=chunk_size, n_jobs=n_jobs
+            ),
+        )
 
-    out_df = left_df.copy()
+    # the engines compute distances in the type of the coordinates
+    dtype = np.float64 if dtype is None else dtype
 
-    if k_closest:
+    right_df = right.reset_index() if right_id is None else right
 
-        k_closest_join_df = _k_closest(
-            df=distance_df,
-            left_id=left_id_key_w_suffix,
-            right_id=right_id_key_w_suffix,
-            k=k_closest,
-        )
+    def prepare(frame):
+        with stage("prepare_right", rows=len(frame)):
+            return get_engine(
+                engine,
+                right_lat=frame[right_lat].to_numpy(dtype=dtype),
+                right_lon=frame[right_lon].to_numpy(dtype=dtype),
+            )
 
-        assert set(k_closest_join_df[left_id_key_w_suffix].values) == set(
-            left_df[left_id_key].values
-        )
-        out_df = pd.merge(
-            out_df,
-            k_closest_join_df,
-            left_on=left_id_key,
-            right_on=left_id_key_w_suffix,
+    def run_all(left_df, frame, search_engine, n_jobs):
+        return _design_matrix(
+            left=left_df,
+            right=right,
+            right_df=frame,
+            search_engine=search_engine,
+            left_id=left_id,
+            right_id=right_id,
+            left_lat=left_lat,
+            left_lon=left_lon,
+            right_lat=right_lat,
+            right_lon=right_lon,
+            suffixes=suffixes,
+            k_closest=k_closest,
+            include_left_coords=include_left_coords,
+            include_right_coords=include_right_coords,
+            chunk_size=chunk_size,
+            n_jobs=n_jobs,
+            radius_km=radius_km,
+            metric=metric,
         )
 
-        for j in range(k_closest):
-            # this is a false warning,
-            # because I'm passing a different callback,
-            # for each iteration
-            # pylint:disable=cell-var-from-loop
-            right_k_df = right_df.copy()
-
-            if not include_right_coords:
-                # print(f"{k_closest_join_df.columns=}")
-                right_k_df = right_k_df.drop([right_lat, right_lon], axis="columns")
-
-            right_k_df = right_k_df.rename(columns=lambda col: f"{col}_{j + 1}_closest")
+    if by is None:
+        search_engine = prepare(right_df)
+
+        def run(left_df):
+            return run_all(left_df, right_df, search_engine, n_jobs)
+
+    else:
+        by = [by] if isinstance(by, str) else list(by)
+        keys, right_groups = _right_groups(right_df, by)
+        no_rows = np.empty(0, dtype=np.intp)
+
+        # the right rows of each key are prepared the first time a partition has it
+        engines = {}
+
+        def run(left_df):
+            groups = _left_groups(left_df, keys, by)
+
+            for code, left_positions in groups:
+                right_positions = right_groups[code] if code >= 0 else no_rows
+                if k_closest and k_closest > len(right_positions):
+                    key = tuple(left_df[by].iloc[left_positions[0]])
+                    raise ValueError(
+                        f"k_closest={k_closest} exceeds the {len(right_positions)} "
+                        f"rows in right with the key {key}."
+                    )
+                if code not in engines:
+                    engines[code] = prepare(right_df.iloc[right_positions])
+
+            def run_group(group):
+                code, left_positions = group
+                right_positions = right_groups[code] if code >= 0 else no_rows
+                return run_all(
+                    left_df.iloc[left_positions],
+                    right_df.iloc[right_positions],
+                    engines[code],
+                    n_jobs=None,
+                )
+
+            # an empty left has no key, but still gets the columns of the design matrix
+            if not groups:
+                return run_all(left_df, right_df, prepare(right_df), None)
+
+            results = map_blocks(run_group, groups, n_jobs)
+            order = np.argsort(
+                np.concatenate([left_positions for _, left_positions in groups])
+            )
 
-            out_df = pd.merge(
-                out_df,
-                right_k_df,
-                left_on=f"{right_id_key_w_suffix}_{j + 1}_closest",
-                right_on=f"{right_id_key}_{j + 1}_closest",
+            return (
+                pd.concat(results, ignore_index=True).take(order).reset_index(drop=True)
             )
 
-    if not include_left_coords:
-        out_df = out_df.drop([left_lat, left_lon], axis="columns")
+    if not partitioned:
+        return run(left)
 
-    return out_df
+    results = map(run, iter_partitions(left))
+
+    return results if output is None else write_partitions(results, output)
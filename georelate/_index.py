@@ -0,0 +1,554 @@
+"""Prepares a right DataFrame once for repeated queries."""
+
+# pylint:disable=too-many-arguments, too-many-locals
+import numpy as np
+import pandas as pd
+
+from georelate._arrays import _coordinates
+from georelate._distance import (
+    _design_matrix,
+    _distance_blocks,
+    _get_id_keys,
+    _get_id_keys_with_potential_suffix,
+)
+from georelate._profile import stage
+from georelate._search import (
+    ENGINES,
+    _check_radius,
+    chunks,
+    get_engine,
+    knn_blocked,
+    map_blocks,
+    radius_blocked,
+)
+from georelate._sparse import as_sparse, neighbour_arrays
+from georelate._store import read_store, write_store
+
+
+def _column_values(name, column):
+    """Converts a column into an array that can be saved.
+
+    Args:
+        name (str): The name of the column.
+        column (Series): The column.
+
+    Raises:
+        ValueError: If the column isn't numeric, boolean, datetime or strings.
+
+    Returns:
+        np.ndarray: The values.
+    """
+
+    values = column.to_numpy()
+
+    if values.dtype.kind in "biufcmM":
+        return values
+
+    if all(isinstance(value, str) for value in values):
+        return values.astype(str)
+
+    raise ValueError(
+        f"Column {name!r} can't be saved. "
+        "Only numeric, boolean, datetime and string columns can."
+    )
+
+
+class GeoIndex:
+    """An index over the points of a right DataFrame, built once and queried many times.
+
+    Building the index converts the coordinates, precomputes their trigonometry and,
+    with the "kdtree" engine, builds the k-d tree.
+    Each query then only pays for the left DataFrame it is given,
+    which helps when relating many left DataFrames to the same right DataFrame.
+
+    Args:
+        right (DataFrame): Right DataFrame to index. Assumes the index is an id.
+        right_id (str, optional): Column containing the id for the right DataFrame.
+            If None is passed, assumes the index is the id.
+            Defaults to None.
+        right_lat (str, optional): Column containing the latitude in the right DataFrame.
+            Defaults to "lat".
+        right_lon (str, optional): Column containing the longitude in the right DataFrame.
+            Defaults to "lon".
+        engine (str | Callable, optional): How to find the closest observations,
+            see `design_matrix`.
+            Defaults to "cross".
+        dtype (DTypeLike, optional): The floating point type to compute distances in,
+            see `design_matrix`.
+            Defaults to None.
+    """
+
+    def __init__(
+        self,
+        right,
+        right_id=None,
+        right_lat="lat",
+        right_lon="lon",
+        engine="cross",
+        dtype=None,
+    ):
+        self.right = right
+        self.right_id = right_id
+        self.right_lat = right_lat
+        self.right_lon = right_lon
+
+        dtype = np.float64 if dtype is None else dtype
+
+        self._right_df = right.reset_index() if right_id is None else right
+        with stage("prepare_right", rows=len(self._right_df)):
+            self._engine = get_engine(
+                engine,
+                right_lat=self._right_df[right_lat].to_numpy(dtype=dtype),
+                right_lon=self._right_df[right_lon].to_numpy(dtype=dtype),
+            )
+
+    def __len__(self):
+        return len(self._right_df)
+
+    @property
+    def right_ids(self):
+        """np.ndarray: The ids of the indexed rows, in the order of the positions
+        `knn_arrays` and `radius_arrays` return."""
+
+        _, right_id_key = _get_id_keys(
+            left=self.right, right=self.right, left_id=None, right_id=self.right_id
+        )
+        return self._right_df[right_id_key].to_numpy()
+
+    def save(self, path):
+        """Saves the index, including its precomputed arrays, to a file.
+
+        The file can be loaded with `GeoIndex.load`,
+        which memory-maps the arrays instead of recomputing them.
+        The columns of the right DataFrame must be numeric, boolean, datetime or strings.
+
+        Args:
+            path (str | os.PathLike): The file to write.
+
+        Raises:
+            ValueError: If the index uses a callable engine,
+                or the right DataFrame has a column that can't be saved.
+        """
+
+        engine_name = {
+            engine_class: name for name, engine_class in ENGINES.items()
+        }.get(type(self._engine))
+        if engine_name is None:
+            raise ValueError("An index with a callable engine can't be saved.")
+
+        columns = list(self._right_df.columns)
+
+        metadata = {
+            "engine": engine_name,
+            "right_id": self.right_id,
+            "right_lat": self.right_lat,
+            "right_lon": self.right_lon,
+            "index_name": self.right.index.name if self.right_id is None else None,
+            "columns": columns,
+        }
+
+        arrays = {
+            f"engine/{name}": values
+            for name, values in self._engine.to_arrays().items()
+        }
+        for position, name in enumerate(columns):
+            arrays[f"column/{position}"] = _column_values(
+                name, self._right_df.iloc[:, position]
+            )
+
+        write_store(path, metadata=metadata, arrays=arrays)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Loads an index saved with `GeoIndex.save`.
+
+        Args:
+            path (str | os.PathLike): The file to read.
+            mmap_mode (str, optional): How to memory-map the arrays, see `np.memmap`.
+                With "r", processes that load the same file share one copy in memory
+                and start almost instantly.
+                If None is passed, reads the arrays into memory.
+                Defaults to "r".
+
+        Raises:
+            ValueError: If the file isn't an index,
+                or was saved by a version of georelate with another file format.
+
+        Returns:
+            GeoIndex: The index.
+        """
+
+        metadata, arrays = read_store(path, mmap_mode=mmap_mode)
+
+        right_df = pd.DataFrame(
+            {
+                name: arrays[f"column/{position}"]
+                for position, name in enumerate(metadata["columns"])
+            },
+            copy=False,
+        )
+
+        engine_arrays = {
+            name.removeprefix("engine/"): values
+            for name, values in arrays.items()
+            if name.startswith("engine/")
+        }
+
+        index = cls.__new__(cls)
+        index.right_id = metadata["right_id"]
+        index.right_lat = metadata["right_lat"]
+        index.right_lon = metadata["right_lon"]
+        index.right = right_df
+        if index.right_id is None:
+            index_name = metadata["index_name"]
+            index.right = right_df.set_index(index_name if index_name else "index")
+            index.right.index.name = index_name
+        index._right_df = right_df
+        index._engine = ENGINES[metadata["engine"]].from_arrays(engine_arrays)
+
+        return index
+
+    def design_matrix(
+        self,
+        left,
+        left_id=None,
+        left_lat="lat",
+        left_lon="lon",
+        suffixes=("_left", "_right"),
+        k_closest=None,
+        include_left_coords=False,
+        include_right_coords=False,
+        chunk_size=None,
+        n_jobs=None,
+        radius_km=None,
+    ):
+        """Builds the design matrix of a left DataFrame against the indexed DataFrame.
+
+        Gives the same result as `design_matrix(left, right, ...)`.
+
+        Args:
+            left (DataFrame): Left DataFrame. Assumes the index is an id.
+            left_id (str, optional): Column containing the id for the left DataFrame.
+                If None is passed, assumes the index is the id.
+                Defaults to None.
+            left_lat (str, optional): Column containing the latitude in the left DataFrame.
+                Defaults to "lat".
+            left_lon (str, optional): Column containing the longitude in the left DataFrame.
+                Defaults to "lon".
+            suffixes (tuple, optional): The suffixes for overlapping column names,
+                see `design_matrix`.
+                Defaults to ("_left", "_right").
+            k_closest (int, optional): The number of nearest observations to include.
+                Defaults to None.
+            include_left_coords (bool, optional): Specifies whether to include the
+                coordinates from the left DataFrame in the results.
+                Defaults to False.
+            include_right_coords (bool, optional): Specifies whether to include the
+                coordinates from the right DataFrame in the results.
+                Defaults to False.
+            chunk_size (int, optional): The number of rows from the left DataFrame
+                to process at a time.
+                Defaults to None.
+            n_jobs (int, optional): The number of threads to use. Defaults to None.
+            radius_km (float, optional): A distance in kms to summarize the observations
+                within, see `design_matrix`.
+                Defaults to None.
+
+        Returns:
+            DataFrame: The design matrix.
+        """
+
+        # the arguments of design_matrix, forwarded as it does
+        # pylint:disable=duplicate-code
+        return _design_matrix(
+            left=left,
+            right=self.right,
+            right_df=self._right_df,
+            search_engine=self._engine,
+            left_id=left_id,
+            right_id=self.right_id,
+            left_lat=left_lat,
+            left_lon=left_lon,
+            right_lat=self.right_lat,
+            right_lon=self.right_lon,
+            suffixes=suffixes,
+            k_closest=k_closest,
+            include_left_coords=include_left_coords,
+            include_right_coords=include_right_coords,
+            chunk_size=chunk_size,
+            n_jobs=n_jobs,
+            radius_km=radius_km,
+        )
+        # pylint:enable=duplicate-code
+
+    def knn_arrays(self, left_lat, left_lon, k, chunk_size=None, n_jobs=None):
+        """Finds the k closest indexed points for each left point, without DataFrames.
+
+        See `knn_arrays`. The coordinates are converted to the index's floating point type.
+
+        Args:
+            left_lat (ArrayLike[Number]): Latitudes of the left points, shape (n,).
+            left_lon (ArrayLike[Number]): Longitudes of the left points, shape (n,).
+            k (int): The number of neighbours to find.
+            chunk_size (int, optional): The number of left points to process at a time.
+                Defaults to None.
+            n_jobs (int, optional): The number of threads to use. Defaults to None.
+
+        Raises:
+            ValueError: If k is out of range or the coordinates don't have matching shapes.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (indices, distances), both of shape (n, k),
+                with the positions of the closest rows of the right DataFrame.
+        """
+
+        if not 1 <= k <= len(self):
+            raise ValueError(f"k must be between 1 and the {len(self)} rows, got {k}.")
+
+        left_lat, left_lon = _coordinates(
+            left_lat, left_lon, self._engine.right_lat.dtype, "left"
+        )
+
+        # the search of knn_arrays, with the index's engine
+        # pylint:disable=duplicate-code
+        return knn_blocked(
+            self._engine,
+            left_lat=left_lat,
+            left_lon=left_lon,
+            k=k,
+            chunk_size=chunk_size,
+            n_jobs=n_jobs,
+        )
+        # pylint:enable=duplicate-code
+
+    def radius_arrays(
+        self, left_lat, left_lon, radius_km, chunk_size=None, n_jobs=None
+    ):
+        """Finds the pairs of left and indexed points within a distance, without DataFrames.
+
+        See `radius_arrays`.
+
+        Args:
+            left_lat (ArrayLike[Number]): Latitudes of the left points, shape (n,).
+            left_lon (ArrayLike[Number]): Longitudes of the left points, shape (n,).
+            radius_km (float): The distance in kms.
+            chunk_size (int, optional): The number of left points to process at a time.
+                Defaults to None.
+            n_jobs (int, optional): The number of threads to use. Defaults to None.
+
+        Raises:
+            ValueError: If radius_km is negative
+                or the coordinates don't have matching shapes.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]:
+                (left_positions, right_positions, distances) for each pair within radius_km,
+                sorted by left position, then distance.
+        """
+
+        _check_radius(radius_km)
+
+        left_lat, left_lon = _coordinates(
+            left_lat, left_lon, self._engine.right_lat.dtype, "left"
+        )
+
+        # the search of radius_arrays, with the index's engine
+        # pylint:disable=duplicate-code
+        return radius_blocked(
+            self._engine,
+            left_lat=left_lat,
+            left_lon=left_lon,
+            radius_km=radius_km,
+            chunk_size=chunk_size,
+            n_jobs=n_jobs,
+        )
+        # pylint:enable=duplicate-code
+
+    def neighbour_matrix(
+        self,
+        left,
+        k_closest=None,
+        radius_km=None,
+        left_lat="lat",
+        left_lon="lon",
+        chunk_size=None,
+        n_jobs=None,
+        as_arrays=False,
+    ):
+        """Builds a sparse matrix of the distances from each left row to its neighbours.
+
+        Gives the same result as `neighbour_matrix(left, right, ...)`.
+
+        Args:
+            left (DataFrame): Left DataFrame, one row of the matrix per row.
+            k_closest (int, optional): The number of closest indexed rows
+                that are the neighbours of each row of left.
+                Defaults to None.
+            radius_km (float, optional): The distance in kms within which indexed rows
+                are the neighbours of each row of left.
+                Exactly one of k_closest and radius_km must be passed.
+                Defaults to None.
+            left_lat (str, optional): Column containing the latitude in the left DataFrame.
+                Defaults to "lat".
+            left_lon (str, optional): Column containing the longitude in the left DataFrame.
+                Defaults to "lon".
+            chunk_size (int, optional): The number of rows from the left DataFrame
+                to process at a time.
+                Defaults to None.
+            n_jobs (int, optional): The number of threads to use. Defaults to None.
+            as_arrays (bool, optional): Whether to return the (indptr, indices, data)
+                arrays instead of a scipy matrix, see `neighbour_matrix`.
+                Defaults to False.
+
+        Raises:
+            ValueError: If not exactly one of k_closest and radius_km is passed,
+                or it is out of range.
+
+        Returns:
+            scipy.sparse.csr_array | tuple[np.ndarray, np.ndarray, np.ndarray]:
+                The (len(left), len(index)) matrix, or its (indptr, indices, data) arrays.
+        """
+
+        dtype = self._engine.right_lat.dtype
+
+        # the search of neighbour_matrix, with the index's engine
+        # pylint:disable=duplicate-code
+        arrays = neighbour_arrays(
+            self._engine,
+            left_lat=left[left_lat].to_numpy(dtype=dtype),
+            left_lon=left[left_lon].to_numpy(dtype=dtype),
+            k_closest=k_closest,
+            radius_km=radius_km,
+            chunk_size=chunk_size,
+            n_jobs=n_jobs,
+        )
+        # pylint:enable=duplicate-code
+
+        return as_sparse(arrays, len(self), as_arrays)
+
+    def query_radius(
+        self,
+        left,
+        radius_km,
+        left_id=None,
+        left_lat="lat",
+        left_lon="lon",
+        suffixes=("_left", "_right"),
+        chunk_size=None,
+        n_jobs=None,
+    ):
+        """Finds the pairs of observations within a distance of each other.
+
+        Args:
+            left (DataFrame): Left DataFrame. Assumes the index is an id.
+            radius_km (float): The distance in kms.
+            left_id (str, optional): Column containing the id for the left DataFrame.
+                If None is passed, assumes the index is the id.
+                Defaults to None.
+            left_lat (str, optional): Column containing the latitude in the left DataFrame.
+                Defaults to "lat".
+            left_lon (str, optional): Column containing the longitude in the left DataFrame.
+                Defaults to "lon".
+            suffixes (tuple, optional): The suffixes for the id columns if they overlap,
+                see `design_matrix`.
+                Defaults to ("_left", "_right").
+            chunk_size (int, optional): The number of rows from the left DataFrame
+                to process at a time.
+                Defaults to None.
+            n_jobs (int, optional): The number of threads to use. Defaults to None.
+
+        Returns:
+            DataFrame: The ids of each pair and their distance,
+                sorted by the left DataFrame's order, then distance.
+        """
+
+        left_id_key, right_id_key = _get_id_keys(
+            left=left, right=self.right, left_id=left_id, right_id=self.right_id
+        )
+        left_id_key_w_suffix, right_id_key_w_suffix = (
+            _get_id_keys_with_potential_suffix(
+                left=left,
+                right=self.right,
+                left_id=left_id,
+                right_id=self.right_id,
+                suffixes=suffixes,
+            )
+        )
+
+        left_df = left.reset_index() if left_id is None else left
+
+        left_positions, right_positions, distances = self.radius_arrays(
+            left_df[left_lat],
+            left_df[left_lon],
+            radius_km=radius_km,
+            chunk_size=chunk_size,
+            n_jobs=n_jobs,
+        )
+
+        return pd.DataFrame(
+            {
+                left_id_key_w_suffix: left_df[left_id_key].array.take(left_positions),
+                right_id_key_w_suffix: self._right_df[right_id_key].array.take(
+                    right_positions
+                ),
+                "distance": distances,
+            }
+        )
+
+    def distance_table(
+        self,
+        left,
+        left_id=None,
+        left_lat="lat",
+        left_lon="lon",
+        suffixes=("_left", "_right"),
+        chunk_size=None,
+        n_jobs=None,
+        max_distance_km=None,
+    ):
+        """Computes the distance table of a left DataFrame against the indexed DataFrame.
+
+        Gives the same result as `distance_table(left, right, ...)`.
+
+        Args:
+            left (DataFrame): Left DataFrame. Assumes the index is an id.
+            left_id (str, optional): Column containing the id for the left DataFrame.
+                If None is passed, assumes the index is the id.
+                Defaults to None.
+            left_lat (str, optional): Column containing the latitude in the left DataFrame.
+                Defaults to "lat".
+            left_lon (str, optional): Column containing the longitude in the left DataFrame.
+                Defaults to "lon".
+            suffixes (tuple, optional): The suffixes for overlapping column names,
+                see `distance_table`.
+                Defaults to ("_left", "_right").
+            chunk_size (int, optional): The number of rows from the left DataFrame
+                to process at a time.
+                Defaults to None.
+            n_jobs (int, optional): The number of threads to use. Defaults to None.
+            max_distance_km (float, optional): Only keep pairs of observations
+                at most this many kms apart.
+                Defaults to None.
+
+        Returns:
+            DataFrame: The distance table.
+        """
+
+        make_block, n_left = _distance_blocks(
+            left=left,
+            right=self.right,
+            left_id=left_id,
+            right_id=self.right_id,
+            left_lat=left_lat,
+            left_lon=left_lon,
+            right_lat=self.right_lat,
+            right_lon=self.right_lon,
+            suffixes=suffixes,
+            max_distance_km=max_distance_km,
+            dtype=self._engine.right_lat.dtype,
+            right_points=self._engine.right_points,
+        )
+
+        blocks = map_blocks(make_block, chunks(n_left, chunk_size, n_jobs), n_jobs)
+
+        return pd.concat(blocks, ignore_index=True)
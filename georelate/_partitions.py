@@ -0,0 +1,95 @@
+"""Reads and writes DataFrames one partition at a time."""
+
+import os
+from pathlib import Path
+
+import pandas as pd
+
+
+def _pyarrow_dataset():
+    """Imports pyarrow's dataset module.
+
+    Raises:
+        ImportError: If pyarrow isn't installed.
+
+    Returns:
+        module: pyarrow.dataset.
+    """
+
+    try:
+        # pylint:disable=import-outside-toplevel
+        import pyarrow.dataset
+    except ImportError as err:
+        raise ImportError(
+            "Reading Parquet requires pyarrow. "
+            "Install it with `pip install georelate[parquet]`."
+        ) from err
+
+    return pyarrow.dataset
+
+
+def is_path(source):
+    """Checks whether a source of DataFrames is a path.
+
+    Args:
+        source: A DataFrame, a path or an iterable of DataFrames.
+
+    Returns:
+        bool: Whether it is a path.
+    """
+    return isinstance(source, (str, os.PathLike))
+
+
+def iter_partitions(source):
+    """Iterates over the partitions of a source of DataFrames.
+
+    Args:
+        source (DataFrame | str | os.PathLike | Iterable[DataFrame]):
+            A DataFrame, which is a single partition,
+            the path to a Parquet file or a directory of Parquet files,
+            which is read one record batch at a time,
+            or an iterable of DataFrames.
+
+    Yields:
+        DataFrame: The partitions, skipping empty ones.
+    """
+
+    if isinstance(source, pd.DataFrame):
+        partitions = [source]
+    elif is_path(source):
+        dataset = _pyarrow_dataset().dataset(source, format="parquet")
+        partitions = (
+            batch.to_pandas()
+            for fragment in dataset.get_fragments()
+            for batch in fragment.to_batches()
+        )
+    else:
+        partitions = source
+
+    for partition in partitions:
+        if len(partition) > 0:
+            yield partition
+
+
+def write_partitions(partitions, directory):
+    """Writes each partition to its own Parquet file, as it is computed.
+
+    Args:
+        partitions (Iterable[DataFrame]): The partitions.
+        directory (str | os.PathLike): The directory to write the files in.
+            It is created if it doesn't exist.
+
+    Returns:
+        list[Path]: The paths of the files, in the order of the partitions.
+    """
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    for number, partition in enumerate(partitions):
+        path = directory / f"part-{number:05d}.parquet"
+        partition.to_parquet(path, index=False)
+        paths.append(path)
+
+    return paths
@@ -0,0 +1,181 @@
+"""Records where the time and memory of a call go, stage by stage."""
+
+import contextvars
+import logging
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger("georelate")
+
+# the profiler of the current context, None when not profiling
+_PROFILER = contextvars.ContextVar("georelate_profiler", default=None)
+
+
+class StageRecord(namedtuple("StageRecord", ["name", "seconds", "rows", "bytes"])):
+    """The measurements of one run of a stage.
+
+    Attributes:
+        name (str): The name of the stage, e.g. "knn".
+        seconds (float): The wall time.
+        rows (int | None): The number of rows processed, if the stage counts them.
+        bytes (int | None): The peak memory allocated during the stage,
+            if memory is traced.
+    """
+
+    __slots__ = ()
+
+
+class ProfileReport:
+    """The stages recorded while profiling.
+
+    Attributes:
+        records (list[StageRecord]): Every run of every stage, in order.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def seconds(self):
+        """float: The total wall time of the stages."""
+        return sum(record.seconds for record in self.records)
+
+    def to_frame(self):
+        """Gets the records as a DataFrame, one row per run of a stage.
+
+        Returns:
+            DataFrame: The records.
+        """
+        return pd.DataFrame(self.records, columns=StageRecord._fields)
+
+    def summary(self):
+        """Sums the records of each stage, in the order the stages first ran.
+
+        Returns:
+            DataFrame: The number of calls, seconds, rows and peak bytes of each stage.
+        """
+
+        return (
+            self.to_frame()
+            .groupby("name", sort=False)
+            .agg(
+                calls=("seconds", "size"),
+                seconds=("seconds", "sum"),
+                rows=("rows", "sum"),
+                bytes=("bytes", "max"),
+            )
+        )
+
+    def __str__(self):
+        return self.summary().to_string()
+
+
+class _Profiler:  # pylint:disable=too-few-public-methods
+    """Sends the records of the current context to a report, a callback and the logs."""
+
+    def __init__(self, report, callback, log, trace_memory):
+        self.report = report
+        self.callback = callback
+        self.log = log
+        self.trace_memory = trace_memory
+
+    def record(self, record):
+        """Handles the measurements of a stage."""
+
+        self.report.records.append(record)
+
+        if self.callback is not None:
+            self.callback(record)
+
+        if self.log:
+            logger.info(
+                "georelate stage %s took %.6f s for %s rows, peak %s bytes",
+                record.name,
+                record.seconds,
+                record.rows,
+                record.bytes,
+                extra={"georelate_stage": record._asdict()},
+            )
+
+
+@contextmanager
+def profile(callback=None, log=False, trace_memory=False):
+    """Profiles the georelate calls made inside the context, stage by stage.
+
+    Records the wall time and rows of each stage, e.g. preparing the right points,
+    the nearest neighbour search and building the output.
+    Without it, the stages only check that no profiler is active.
+
+    Example:
+        with profile() as report:
+            design_matrix(left_df, right_df, k_closest=3)
+        print(report.summary())
+
+    Args:
+        callback (Callable[[StageRecord], None], optional): Called after each stage.
+            Defaults to None.
+        log (bool, optional): Whether to log each stage at the INFO level
+            to the "georelate" logger.
+            Defaults to False.
+        trace_memory (bool, optional): Whether to record the peak memory
+            allocated in each stage with tracemalloc.
+            Tracing slows everything down, so the times are less accurate.
+            Defaults to False.
+
+    Yields:
+        ProfileReport: The report the stages are recorded in.
+    """
+
+    report = ProfileReport()
+    token = _PROFILER.set(_Profiler(report, callback, log, trace_memory))
+
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    try:
+        yield report
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _PROFILER.reset(token)
+
+
+@contextmanager
+def stage(name, rows=None):
+    """Marks a stage to profile. Does nothing unless called inside `profile`.
+
+    Stages shouldn't be nested when memory is traced,
+    since each one resets the peak.
+
+    Args:
+        name (str): The name of the stage.
+        rows (int, optional): The number of rows the stage processes. Defaults to None.
+    """
+
+    profiler = _PROFILER.get()
+    if profiler is None:
+        yield
+        return
+
+    if profiler.trace_memory:
+        tracemalloc.reset_peak()
+        start_bytes, _ = tracemalloc.get_traced_memory()
+
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+
+    n_bytes = None
+    if profiler.trace_memory:
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        n_bytes = peak_bytes - start_bytes
+
+    profiler.record(StageRecord(name=name, seconds=seconds, rows=rows, bytes=n_bytes))
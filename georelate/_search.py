@@ -0,0 +1,1633 @@
+"""Finds the closest points and the points within a radius."""
+
+# pylint:disable=too-many-arguments, too-many-locals, too-many-lines
+import contextvars
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from georelate._haversine import (
+    EARTH_RADIUS,
+    PreparedPoints,
+    haversine_prepared,
+    prepare_points,
+)
+
+
+def _unit_vectors(lat, lon):
+    """Converts coordinates in degrees into points on the unit sphere.
+
+    The straight-line (chord) distance between two unit vectors increases monotonically
+    with the great-circle distance, so nearest neighbours in 3D are nearest neighbours
+    on the sphere.
+
+    Args:
+        lat (ArrayLike[Number]): An array of latitudes.
+        lon (ArrayLike[Number]): An array of longitudes.
+
+    Returns:
+        np.ndarray: An array of shape (n, 3) with the x, y, z coordinates.
+    """
+
+    lat_r = np.radians(np.asarray(lat, dtype=np.float64))
+    lon_r = np.radians(np.asarray(lon, dtype=np.float64))
+
+    cos_lat = np.cos(lat_r)
+
+    return np.column_stack(
+        [cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)]
+    )
+
+
+def _sort_neighbours(left_points, right_points, indices):
+    """Computes the haversine distances for candidate neighbours and orders them.
+
+    Each row is sorted by distance, breaking ties by position in the right points,
+    which matches the order `DataFrame.nsmallest` keeps.
+
+    Args:
+        left_points (PreparedPoints): The left points, shape (n,).
+        right_points (PreparedPoints): The right points, shape (m,).
+        indices (np.ndarray): Positions of the candidate right points, shape (n, k).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (indices, distances), both of shape (n, k).
+    """
+
+    indices = np.sort(indices, axis=1)
+
+    distances = haversine_prepared(
+        left_points.take((slice(None), np.newaxis)), right_points.take(indices)
+    )
+
+    order = np.argsort(distances, axis=1, kind="stable")
+
+    return (
+        np.take_along_axis(indices, order, axis=1),
+        np.take_along_axis(distances, order, axis=1),
+    )
+
+
+def k_smallest(distances, k):
+    """Finds the k smallest values in each row of a distance matrix.
+
+    Runs in O(n * m) with `np.partition` and only sorts the k selected values.
+    Ties are broken by column position, which matches the order
+    `DataFrame.nsmallest` keeps. NaN values rank last, as infinite ones.
+
+    Args:
+        distances (np.ndarray): A distance matrix of shape (n, m).
+        k (int): The number of values to keep per row. Must not exceed m.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (indices, distances), both of shape (n, k),
+            sorted by distance within each row.
+    """
+
+    n_rows, n_cols = distances.shape
+
+    if k == 0 or n_rows == 0:
+        return (
+            np.empty((n_rows, k), dtype=np.intp),
+            np.empty((n_rows, k), dtype=distances.dtype),
+        )
+
+    distances = np.where(np.isnan(distances), np.inf, distances)
+
+    if k < n_cols:
+        kth = np.partition(distances, k - 1, axis=1)[:, k - 1 : k]
+
+        # keep everything below the k-th value,
+        # then the leftmost values equal to it until there are k
+        below = distances < kth
+        tied = distances == kth
+        n_tied_needed = k - below.sum(axis=1, keepdims=True)
+        selected = below | (tied & (np.cumsum(tied, axis=1) <= n_tied_needed))
+
+        indices = np.nonzero(selected)[1].reshape(n_rows, k)
+    else:
+        indices = np.broadcast_to(np.arange(n_cols), (n_rows, n_cols))
+
+    values = np.take_along_axis(distances, indices, axis=1)
+    order = np.argsort(values, axis=1, kind="stable")
+
+    return (
+        np.take_along_axis(indices, order, axis=1),
+        np.take_along_axis(values, order, axis=1),
+    )
+
+
+def _check_neighbours(distances):
+    """Checks that every point found its neighbours at finite distances.
+
+    Distances involving non-finite coordinates are NaN and rank last,
+    so a point without k neighbours at finite distances would get invented ones.
+
+    Args:
+        distances (np.ndarray): The distances to the neighbours, shape (n, k).
+
+    Raises:
+        ValueError: If any distance isn't finite.
+    """
+
+    if not np.isfinite(distances).all():
+        raise ValueError(
+            "Some points don't have k closest points at finite distances, "
+            "because of NaN or infinite coordinates. Drop or fill them first."
+        )
+
+
+def _check_radius(radius_km):
+    """Checks that a search radius isn't negative.
+
+    Args:
+        radius_km (float | None): The distance in kms, or None if there's no radius search.
+
+    Raises:
+        ValueError: If radius_km is negative.
+    """
+
+    if radius_km is not None and radius_km < 0:
+        raise ValueError(f"radius_km must not be negative, got {radius_km}.")
+
+
+def _max_lon_difference(lat, angle):
+    """Bounds the longitude difference to points within an angular distance.
+
+    Args:
+        lat (np.ndarray): Latitudes in degrees.
+        angle (float | np.ndarray): The angular distance in radians,
+            for every latitude or for each.
+
+    Returns:
+        np.ndarray: The largest longitude difference in degrees for each latitude.
+            180 where the circle around the point contains a pole.
+    """
+
+    cos_lat = np.cos(np.radians(lat))
+    ratio = np.sin(np.minimum(angle, np.pi / 2)) / np.maximum(cos_lat, 1e-300)
+
+    with np.errstate(invalid="ignore"):
+        max_lon_difference = np.degrees(np.arcsin(np.minimum(ratio, 1.0)))
+
+    return np.where(ratio >= 1.0, 180.0, max_lon_difference)
+
+
+def _sort_pairs(left_positions, right_positions, distances):
+    """Orders pairs by left position, then distance, then right position.
+
+    Args:
+        left_positions (np.ndarray): Positions of the left points.
+        right_positions (np.ndarray): Positions of the right points.
+        distances (np.ndarray): Distances between the points.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The sorted pairs.
+    """
+
+    order = np.lexsort((right_positions, distances, left_positions))
+
+    return left_positions[order], right_positions[order], distances[order]
+
+
+def _buffers(workspace, shape, dtype):
+    """Gets two buffers, reusing the ones in the workspace when they are large enough.
+
+    Args:
+        workspace (threading.local | None): Holds the buffers of the current thread.
+            If None is passed, allocates new buffers.
+        shape (tuple[int, int]): The shape of the buffers.
+        dtype (DTypeLike): The type of the buffers.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The buffers.
+    """
+
+    size = shape[0] * shape[1]
+    buffers = getattr(workspace, "buffers", None)
+
+    if buffers is None or buffers[0].size < size or buffers[0].dtype != dtype:
+        buffers = tuple(np.empty(size, dtype=dtype) for _ in range(2))
+
+        if workspace is not None:
+            workspace.buffers = buffers
+
+    return tuple(buffer[:size].reshape(shape) for buffer in buffers)
+
+
+class CrossEngine:
+    """Brute force search.
+
+    k nearest neighbour queries compute the full (n, m) distance matrix with broadcasting,
+    so callers should pass blocks of left points to bound memory.
+    Radius queries only compute distances for right points inside each left point's
+    latitude band and longitude range.
+    The trigonometry for each right point is computed once, up front.
+
+    Args:
+        right_lat (np.ndarray): Latitudes of the right points, shape (m,).
+            Distances are computed in its floating point type.
+        right_lon (np.ndarray): Longitudes of the right points, shape (m,).
+    """
+
+    def __init__(self, right_lat, right_lon):
+        self.right_lat = right_lat
+        self.right_lon = right_lon
+        self.right_points = prepare_points(right_lat, right_lon)
+
+        # sorted the first time a radius query needs them, see _lat_layout
+        self._lat_order = None
+        self._sorted_lat = None
+
+    def _lat_layout(self):
+        """Gets the order of the right points by latitude and the sorted latitudes.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The order and the sorted latitudes.
+        """
+
+        if self._lat_order is None:
+            lat_order = np.argsort(self.right_lat, kind="stable")
+            self._sorted_lat = self.right_lat[lat_order]
+            # assigned last, so other threads never see the order without the latitudes
+            self._lat_order = lat_order
+
+        return self._lat_order, self._sorted_lat
+
+    def to_arrays(self):
+        """Gets the arrays the engine precomputed for the right points, e.g. to save them.
+
+        Returns:
+            dict[str, np.ndarray]: The arrays by name.
+        """
+
+        return {
+            "right_lat": self.right_lat,
+            "right_lon": self.right_lon,
+            **self.right_points._asdict(),
+            **dict(zip(["lat_order", "sorted_lat"], self._lat_layout())),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Restores an engine from the arrays of `to_arrays` without recomputing them.
+
+        The arrays are used as is, so they can be memory-mapped.
+
+        Args:
+            arrays (dict[str, np.ndarray]): The arrays by name.
+
+        Returns:
+            CrossEngine: The engine.
+        """
+
+        engine = cls.__new__(cls)
+        engine.right_lat = arrays["right_lat"]
+        engine.right_lon = arrays["right_lon"]
+        engine.right_points = PreparedPoints(
+            *(arrays[name] for name in PreparedPoints._fields)
+        )
+        engine._lat_order = arrays["lat_order"]
+        engine._sorted_lat = arrays["sorted_lat"]
+
+        return engine
+
+    def _prepare_left(self, left_lat, left_lon):
+        return prepare_points(left_lat, left_lon, dtype=self.right_points.cos_lat.dtype)
+
+    def query(self, left_lat, left_lon, k, workspace=None):
+        """Finds the k closest right points for each left point.
+
+        Args:
+            left_lat (np.ndarray): Latitudes of the left points, shape (n,).
+            left_lon (np.ndarray): Longitudes of the left points, shape (n,).
+            k (int): The number of neighbours to find.
+            workspace (threading.local, optional): Holds buffers to reuse
+                across queries from the same thread. Defaults to None.
+
+        Raises:
+            ValueError: If a left point has non-finite coordinates,
+                or there are fewer than k right points with finite ones.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (indices, distances), both of shape (n, k).
+        """
+
+        out, work = _buffers(
+            workspace,
+            shape=(len(left_lat), len(self.right_lat)),
+            dtype=self.right_points.cos_lat.dtype,
+        )
+
+        distances = haversine_prepared(
+            self._prepare_left(left_lat, left_lon).take((slice(None), np.newaxis)),
+            self.right_points.take(np.newaxis),
+            out=out,
+            work=work,
+        )
+
+        indices, distances = k_smallest(distances, k)
+        _check_neighbours(distances)
+
+        return indices, distances
+
+    def query_radius(self, left_lat, left_lon, radius_km, above=None):
+        """Finds the right points within a distance of each left point.
+
+        Args:
+            left_lat (np.ndarray): Latitudes of the left points, shape (n,).
+            left_lon (np.ndarray): Longitudes of the left points, shape (n,).
+            radius_km (float): The distance in kms.
+            above (np.ndarray, optional): For each left point, a position
+                that right points must be above to be searched, shape (n,).
+                In a self join, passing each point's own position
+                computes every pair once. Defaults to None.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]:
+                (left_positions, right_positions, distances) for each pair within radius_km,
+                sorted by left position, then distance.
+        """
+
+        angle = radius_km / EARTH_RADIUS
+        max_lat_difference = np.degrees(angle) + 1e-9
+
+        lat_order, sorted_lat = self._lat_layout()
+        starts = np.searchsorted(sorted_lat, left_lat - max_lat_difference, "left")
+        stops = np.searchsorted(sorted_lat, left_lat + max_lat_difference, "right")
+        counts = stops - starts
+
+        # candidate pairs, the right points in each left point's latitude band
+        left_positions = np.repeat(np.arange(len(left_lat)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        right_positions = lat_order[starts[left_positions] + offsets]
+
+        lon_difference = np.abs(
+            (self.right_lon[right_positions] - left_lon[left_positions] + 180) % 360
+            - 180
+        )
+        in_lon_range = lon_difference <= (
+            _max_lon_difference(left_lat, angle)[left_positions] + 1e-9
+        )
+        if above is not None:
+            in_lon_range &= right_positions > above[left_positions]
+        left_positions = left_positions[in_lon_range]
+        right_positions = right_positions[in_lon_range]
+
+        distances = haversine_prepared(
+            self._prepare_left(left_lat, left_lon).take(left_positions),
+            self.right_points.take(right_positions),
+        )
+        within = distances <= radius_km
+
+        return _sort_pairs(
+            left_positions[within], right_positions[within], distances[within]
+        )
+
+
+def _kdtree_class():
+    """Imports scipy's k-d tree.
+
+    Raises:
+        ImportError: If scipy isn't installed.
+
+    Returns:
+        type: scipy.spatial.cKDTree.
+    """
+
+    try:
+        # pylint:disable=import-outside-toplevel
+        from scipy.spatial import cKDTree
+    except ImportError as err:
+        raise ImportError(
+            'engine="kdtree" requires scipy. '
+            "Install it with `pip install georelate[kdtree]`."
+        ) from err
+
+    return cKDTree
+
+
+class KDTreeEngine(CrossEngine):
+    """Search with a k-d tree.
+
+    The tree is built once over the right points embedded on the unit sphere,
+    so each query costs O(log m) instead of O(m).
+    Distances are recomputed with the haversine formula,
+    so they match the "cross" engine.
+    Requires scipy.
+
+    Args:
+        right_lat (np.ndarray): Latitudes of the right points, shape (m,).
+        right_lon (np.ndarray): Longitudes of the right points, shape (m,).
+    """
+
+    def __init__(self, right_lat, right_lon):
+        tree_class = _kdtree_class()
+
+        super().__init__(right_lat, right_lon)
+
+        self._tree = tree_class(_unit_vectors(right_lat, right_lon))
+
+    def to_arrays(self):
+        return {**super().to_arrays(), "unit_vectors": self._tree.data}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # scipy can't load a tree's nodes, so it's rebuilt from the saved unit vectors
+        tree_class = _kdtree_class()
+
+        engine = super().from_arrays(arrays)
+        engine._tree = tree_class(arrays["unit_vectors"])
+
+        return engine
+
+    def query(self, left_lat, left_lon, k, workspace=None):
+        _, indices = self._tree.query(_unit_vectors(left_lat, left_lon), k=k)
+
+        return _sort_neighbours(
+            left_points=self._prepare_left(left_lat, left_lon),
+            right_points=self.right_points,
+            indices=indices.reshape(len(left_lat), k),
+        )
+
+    def query_radius(self, left_lat, left_lon, radius_km, above=None):
+        # the chord length between points radius_km apart, padded for rounding
+        angle = min(radius_km / EARTH_RADIUS, np.pi)
+        chord = 2 * np.sin(angle / 2) * (1 + 1e-9) + 1e-12
+
+        neighbours = self._tree.query_ball_point(
+            _unit_vectors(left_lat, left_lon), r=chord, return_sorted=False
+        )
+        counts = np.fromiter(map(len, neighbours), dtype=np.intp, count=len(neighbours))
+
+        left_positions = np.repeat(np.arange(len(left_lat)), counts)
+        right_positions = (
+            np.concatenate(neighbours).astype(np.intp)
+            if counts.sum()
+            else np.empty(0, dtype=np.intp)
+        )
+
+        if above is not None:
+            searched = right_positions > above[left_positions]
+            left_positions = left_positions[searched]
+            right_positions = right_positions[searched]
+
+        distances = haversine_prepared(
+            self._prepare_left(left_lat, left_lon).take(left_positions),
+            self.right_points.take(right_positions),
+        )
+        within = distances <= radius_km
+
+        return _sort_pairs(
+            left_positions[within], right_positions[within], distances[within]
+        )
+
+
+def _grid_crowding(lat, lon, height):
+    """Measures how many points share a grid cell, on average over the points.
+
+    Args:
+        lat (np.ndarray): Latitudes of the points.
+        lon (np.ndarray): Longitudes of the points.
+        height (float): The height of the rows in degrees.
+
+    Returns:
+        float: The average number of points in the cell of each point.
+    """
+
+    _, counts = np.unique(_grid_cells(lat, lon, height), return_counts=True)
+
+    return float((counts.astype(np.float64) ** 2).sum() / max(len(lat), 1))
+
+
+def _grid_height(lat, lon, target=8, min_height=1e-4):
+    """Picks the height of the grid cells for a set of points.
+
+    Starts from cells holding about target points if the points were spread
+    over the whole sphere, then halves the height while the points share
+    their cell with more than twice that on average, e.g. for clustered points,
+    keeping the last height that split the crowded cells.
+    Averaging over the points rather than the cells splits the cores of clusters,
+    however few cells they take.
+
+    Args:
+        lat (np.ndarray): Latitudes of the points.
+        lon (np.ndarray): Longitudes of the points.
+        target (int, optional): The number of points per cell to aim for.
+            Defaults to 8.
+        min_height (float, optional): The smallest height in degrees. Defaults to 1e-4.
+
+    Returns:
+        float: The height in degrees.
+    """
+
+    # the sphere covers about 41,253 square degrees
+    height = float(np.clip(np.sqrt(41_253 * target / max(len(lat), 1)), 1.0, 90.0))
+    crowding = _grid_crowding(lat, lon, height)
+
+    candidate = height
+    n_tries = 0
+    while candidate / 2 >= min_height and crowding > 2 * target:
+        candidate /= 2
+        candidate_crowding = _grid_crowding(lat, lon, candidate)
+
+        if candidate_crowding <= crowding / 1.5:
+            height, crowding = candidate, candidate_crowding
+            n_tries = 0
+            continue
+
+        # clusters only split once the cells are about their size,
+        # but duplicated points never split
+        n_tries += 1
+        if n_tries == 4:
+            break
+
+    return height
+
+
+def _grid_rows(lat, height):
+    """Finds the grid row of each latitude.
+
+    Args:
+        lat (np.ndarray): Latitudes in degrees.
+        height (float): The height of the rows in degrees.
+
+    Returns:
+        np.ndarray: The rows, from 0 at the south pole.
+    """
+
+    n_rows = int(np.ceil(180 / height))
+    rows = np.floor((np.asarray(lat, dtype=np.float64) + 90) / height)
+
+    return np.clip(np.nan_to_num(rows), 0, n_rows - 1).astype(np.int64)
+
+
+def _grid_columns(rows, height):
+    """Finds the number of columns of each grid row.
+
+    The columns are about as wide as the row is high at the row's latitude
+    furthest from the equator, so they get wider in degrees towards the poles,
+    down to a single column for the rows at the poles.
+
+    Args:
+        rows (np.ndarray): The rows.
+        height (float): The height of the rows in degrees.
+
+    Returns:
+        np.ndarray: The number of columns of each row.
+    """
+
+    south = rows * height - 90
+    max_abs_lat = np.minimum(np.maximum(np.abs(south), np.abs(south + height)), 90)
+
+    return np.maximum(
+        np.floor(360 * np.cos(np.radians(max_abs_lat)) / height), 1
+    ).astype(np.int64)
+
+
+def _grid_cells(lat, lon, height):
+    """Hashes points into the cells of a grid.
+
+    Args:
+        lat (np.ndarray): Latitudes in degrees.
+        lon (np.ndarray): Longitudes in degrees.
+        height (float): The height of the rows in degrees.
+
+    Returns:
+        np.ndarray: The number of each point's cell, row by row.
+    """
+
+    rows = _grid_rows(lat, height)
+    n_columns = _grid_columns(rows, height)
+
+    lon = (np.asarray(lon, dtype=np.float64) + 180) % 360
+    columns = np.minimum(
+        np.floor(np.nan_to_num(lon) / (360 / n_columns)), n_columns - 1
+    )
+
+    return rows * _grid_stride(height) + columns.astype(np.int64)
+
+
+def _grid_stride(height):
+    """Gets the step between the cell numbers of consecutive rows.
+
+    Args:
+        height (float): The height of the rows in degrees.
+
+    Returns:
+        int: More than the number of columns of any row.
+    """
+
+    return int(360 / height) + 2
+
+
+def _group_kth(values, counts, k):
+    """Finds the k-th smallest value of each group of consecutive values.
+
+    The groups are padded to a matrix and partitioned,
+    in batches of groups of similar sizes to bound the padding.
+
+    Args:
+        values (np.ndarray): The values, group by group.
+        counts (np.ndarray): The number of values in each group.
+        k (int): The rank of the value to find, from 1.
+
+    Returns:
+        np.ndarray: The k-th smallest value of each group, infinite for the groups
+            with fewer than k values.
+    """
+
+    kth = np.full(len(counts), np.inf, dtype=values.dtype)
+    firsts = np.cumsum(counts) - counts
+
+    groups = np.flatnonzero(counts >= k)
+    batches = np.ceil(np.log2(counts[groups])).astype(np.intp)
+
+    for batch in np.unique(batches):
+        batch_groups = groups[batches == batch]
+        batch_counts = counts[batch_groups]
+
+        columns = np.arange(batch_counts.max())
+        valid = columns < batch_counts[:, np.newaxis]
+
+        matrix = np.full(valid.shape, np.inf, dtype=values.dtype)
+        matrix[valid] = values[(firsts[batch_groups][:, np.newaxis] + columns)[valid]]
+
+        kth[batch_groups] = np.partition(matrix, k - 1, axis=1)[:, k - 1]
+
+    return kth
+
+
+def _expand_ranges(owners, starts, sizes):
+    """Lists the positions in ranges, with the owner of each range.
+
+    Args:
+        owners (np.ndarray): The owner of each range.
+        starts (np.ndarray): The first position of each range.
+        sizes (np.ndarray): The number of positions in each range.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (owners, positions), one per position.
+    """
+
+    total = sizes.sum()
+    offsets = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+    return np.repeat(owners, sizes), np.repeat(starts, sizes) + offsets
+
+
+def _batches(sizes, max_size):
+    """Splits consecutive groups into batches of at most max_size items.
+
+    Groups larger than max_size get a batch of their own.
+
+    Args:
+        sizes (np.ndarray): The number of items in each group.
+        max_size (int): The number of items per batch.
+
+    Returns:
+        list[slice]: The groups of each batch.
+    """
+
+    ends = np.cumsum(sizes)
+    batches = []
+
+    start = 0
+    while start < len(sizes):
+        previous = ends[start - 1] if start > 0 else 0
+        stop = max(int(np.searchsorted(ends, previous + max_size, "right")), start + 1)
+        batches.append(slice(start, stop))
+        start = stop
+
+    return batches
+
+
+def _grid_centers(cells, height):
+    """Finds the centers of grid cells.
+
+    Args:
+        cells (np.ndarray): The cell numbers.
+        height (float): The height of the rows in degrees.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The latitudes and longitudes of the centers.
+    """
+
+    stride = _grid_stride(height)
+    rows = cells // stride
+
+    south = rows * height - 90
+    north = np.minimum(south + height, 90)
+    width = 360 / _grid_columns(rows, height)
+
+    return (south + north) / 2, (cells % stride + 0.5) * width - 180
+
+
+# the grid levels get coarser until they have at most this many cells
+_GRID_TOP_CELLS = 32
+
+
+class _GridLevel(
+    namedtuple("_GridLevel", ["centers", "radii", "counts", "firsts", "sizes"])
+):
+    """The occupied cells of a grid level, see _grid_levels.
+
+    Attributes:
+        centers (PreparedPoints): The centers of the cells, in float64.
+        radii (np.ndarray): The distance from the centers to the furthest point of each cell.
+        counts (np.ndarray): The number of points in each cell.
+        firsts (np.ndarray): The position of the first cell of the level below
+            in each cell, or of its first point for the finest level.
+        sizes (np.ndarray): The number of cells of the level below in each cell,
+            or of points for the finest level.
+    """
+
+    __slots__ = ()
+
+
+def _grid_levels(lat, lon, height):
+    """Builds grids of decreasing resolution over a set of points.
+
+    The first level holds the occupied cells of a grid of the given height.
+    Each next level groups the cells of the first level by the cell of a grid
+    twice as coarse containing their centers, within the cells of the coarser levels,
+    so each cell holds whole cells of the level below,
+    until the coarsest grid has at most _GRID_TOP_CELLS occupied cells.
+    The cells are ordered so that the cells each cell holds are consecutive,
+    and so are the points of each cell of the first level.
+    Points with non-finite coordinates are in no cell.
+
+    Args:
+        lat (np.ndarray): Latitudes of the points.
+        lon (np.ndarray): Longitudes of the points.
+        height (float): The height of the rows of the first level in degrees.
+
+    Returns:
+        dict[str, np.ndarray]: The positions of the points, cell by cell, as "grid_order",
+            the fields of the levels, finest first, concatenated as "grid_<field>",
+            with the centers as their "grid_<term>", and the position of the first cell
+            of each level and the end of the last as "grid_levels".
+    """
+
+    finite = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    cells, inverse, n_points = np.unique(
+        _grid_cells(lat[finite], lon[finite], height),
+        return_inverse=True,
+        return_counts=True,
+    )
+
+    # the cell of each level holding each cell of the first level
+    center_lat, center_lon = _grid_centers(cells, height)
+    keys, heights = [cells], [height]
+    while len(np.unique(keys[-1])) > _GRID_TOP_CELLS and heights[-1] < 180:
+        heights.append(min(2 * heights[-1], 180))
+        keys.append(_grid_cells(center_lat, center_lon, heights[-1]))
+
+    # sorting by the coarsest cells first makes every cell a range of the level below
+    cell_order = np.lexsort(keys)
+    keys = [key[cell_order] for key in keys]
+    ranks = np.empty(len(cells), dtype=np.intp)
+    ranks[cell_order] = np.arange(len(cells))
+    order = finite[np.argsort(ranks[inverse], kind="stable")]
+
+    # the first cell of the first level in each cell, level by level
+    starts = []
+    new = np.zeros(len(cells), dtype=bool)
+    for key in reversed(keys):
+        new |= np.diff(key, prepend=-1) != 0
+        starts.insert(0, np.flatnonzero(new))
+
+    levels = []
+    below = _GridLevel(
+        centers=prepare_points(lat[order], lon[order], dtype=np.float64),
+        radii=np.zeros(len(order)),
+        counts=np.ones(len(order), dtype=np.int64),
+        firsts=None,
+        sizes=None,
+    )
+    firsts = np.cumsum(n_points[cell_order]) - n_points[cell_order]
+
+    for level, (key, level_height) in enumerate(zip(keys, heights)):
+        if level > 0:
+            firsts = np.searchsorted(starts[level - 1], starts[level])
+        sizes = np.diff(np.append(firsts, len(below.radii)))
+
+        centers = prepare_points(
+            *_grid_centers(key[starts[level]], level_height), dtype=np.float64
+        )
+        # the cells of the level below are within their own radius of their centers
+        distances = haversine_prepared(
+            centers.take(np.repeat(np.arange(len(sizes)), sizes)), below.centers
+        )
+
+        below = _GridLevel(
+            centers=centers,
+            radii=np.maximum.reduceat(distances + below.radii, firsts),
+            counts=np.add.reduceat(below.counts, firsts),
+            firsts=firsts,
+            sizes=sizes,
+        )
+        levels.append(below)
+
+    return {
+        "grid_order": order,
+        "grid_levels": np.cumsum([0] + [len(level.radii) for level in levels]),
+        **{
+            f"grid_{term}": np.concatenate(values)
+            for term, values in zip(
+                PreparedPoints._fields, zip(*(level.centers for level in levels))
+            )
+        },
+        **{
+            f"grid_{field}": np.concatenate([getattr(level, field) for level in levels])
+            for field in _GridLevel._fields[1:]
+        },
+    }
+
+
+def _split_grid_levels(arrays):
+    """Splits the concatenated arrays of _grid_levels into levels.
+
+    Args:
+        arrays (dict[str, np.ndarray]): The arrays by name.
+
+    Returns:
+        list[_GridLevel]: The levels, finest first.
+    """
+
+    offsets = arrays["grid_levels"]
+
+    return [
+        _GridLevel(
+            PreparedPoints(
+                *(arrays[f"grid_{term}"][start:stop] for term in PreparedPoints._fields)
+            ),
+            *(arrays[f"grid_{field}"][start:stop] for field in _GridLevel._fields[1:]),
+        )
+        for start, stop in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def _kth_bound(owners, upper, counts, k, n_owners):
+    """Bounds the distance to the k-th closest point of each left point from cells around it.
+
+    Taking the cells of a left point by the distance to their furthest possible point,
+    its k-th closest point is at most as far as that of the cell reaching k points.
+
+    Args:
+        owners (np.ndarray): The left point of each cell, grouped.
+        upper (np.ndarray): The distance to the furthest possible point of each cell.
+        counts (np.ndarray): The number of points in each cell.
+        k (int): The number of points.
+        n_owners (int): The number of left points.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The bound of each left point, infinite if its cells
+            hold fewer than k points, and whether each cell is among those reaching k points.
+    """
+
+    # the owners are grouped, so adding the distances scaled below 1 sorts by both,
+    # up to rounding, which the padding of the bounds covers
+    order = np.argsort(owners + upper / (2 * upper.max(initial=0) + 1))
+
+    sorted_counts = counts[order]
+    totals = np.bincount(owners, weights=counts, minlength=n_owners).astype(np.int64)
+    reached = np.cumsum(sorted_counts) - np.repeat(
+        np.cumsum(totals) - totals, np.bincount(owners, minlength=n_owners)
+    )
+    before = reached - sorted_counts
+
+    reaching = order[(reached >= k) & (before < k)]
+    bounds = np.full(n_owners, np.inf)
+    bounds[owners[reaching]] = upper[reaching]
+
+    needed = np.empty(len(owners), dtype=bool)
+    needed[order] = before < k
+
+    return bounds, needed
+
+
+def _run_ranks(starts):
+    """Ranks items within consecutive runs.
+
+    Args:
+        starts (np.ndarray): Whether each item starts a run.
+
+    Returns:
+        np.ndarray: The rank of each item in its run, from 0.
+    """
+
+    positions = np.arange(len(starts))
+
+    return positions - np.maximum.accumulate(np.where(starts, positions, 0))
+
+
+def _group_k_smallest(owners, positions, values, n_owners, k):
+    """Finds the k smallest values of each group, ties broken by position like k_smallest.
+
+    Args:
+        owners (np.ndarray): The group of each value, grouped.
+        positions (np.ndarray): The position of each value.
+        values (np.ndarray): The values.
+        n_owners (int): The number of groups.
+        k (int): The number of values.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The positions and values of shape (n_owners, k),
+            with NaN values for the groups with fewer than k values.
+    """
+
+    counts = np.bincount(owners, minlength=n_owners)
+    found = counts >= k
+    # the groups with fewer than k values keep none
+    kth = np.where(found, _group_kth(values, counts, k), -np.inf)[owners]
+
+    # only the ties at the k-th value that fit are kept, by position,
+    # as all the values of duplicated points can be tied
+    below = values < kth
+    n_missing = k - np.bincount(owners[below], minlength=n_owners)
+    tied = np.flatnonzero(values == kth)
+
+    # the candidates are mostly in runs of increasing positions, e.g. the points
+    # of a cell, and only the first ties of each run can fit
+    run_starts = np.diff(positions[tied], prepend=-1) < 0
+    run_starts |= np.diff(owners[tied], prepend=-1) != 0
+    tied = tied[_run_ranks(run_starts) < n_missing[owners[tied]]]
+
+    tied = tied[np.lexsort((positions[tied], owners[tied]))]
+    owner_starts = np.diff(owners[tied], prepend=-1) != 0
+    below[tied[_run_ranks(owner_starts) < n_missing[owners[tied]]]] = True
+
+    owners, positions, values = owners[below], positions[below], values[below]
+    order = np.lexsort((positions, values, owners))
+
+    firsts = np.cumsum(found) * k - k
+    take = order[firsts[found][:, np.newaxis] + np.arange(k)]
+
+    k_positions = np.zeros((n_owners, k), dtype=np.intp)
+    k_values = np.full((n_owners, k), np.nan, dtype=values.dtype)
+    k_positions[found] = positions[take]
+    k_values[found] = values[take]
+
+    return k_positions, k_values
+
+
+# the number of left points the grid engine searches the levels for at a time
+_GRID_BLOCK_SIZE = 1024
+
+# the number of candidate points the grid engine computes distances to at a time
+_GRID_MAX_CANDIDATES = 1 << 18
+
+
+class GridEngine(CrossEngine):
+    """Search with grids hashing the right points into cells of latitude and longitude.
+
+    The rows of a grid have the same height in degrees,
+    and each row has as many columns as fit cells about as wide as they are high,
+    so the columns are wider in degrees near the poles.
+    Only the occupied cells are stored, so the grid can be fine without using memory
+    for empty cells, and its height adapts to the density of the right points.
+    Coarser grids, doubling the height each time, hold the cells of the finer ones,
+    with the distance from their centers to their furthest point.
+
+    A query goes from the coarsest grid to the finest, only keeping the cells that may
+    hold points closer than the k-th closest point is sure to be, from the cells that
+    hold k points when taken by the distance to their furthest point.
+    A first pass only keeping those cells gives a tight bound from the start.
+    The left points are searched in blocks and the distances to the points
+    of the remaining cells in batches, which bounds memory.
+    Distances are computed with the haversine formula, so they match the "cross" engine.
+    Only needs NumPy, and scales to large right datasets,
+    though the "kdtree" engine is faster.
+
+    Args:
+        right_lat (np.ndarray): Latitudes of the right points, shape (m,).
+        right_lon (np.ndarray): Longitudes of the right points, shape (m,).
+    """
+
+    def __init__(self, right_lat, right_lon):
+        super().__init__(right_lat, right_lon)
+
+        self._height = _grid_height(right_lat, right_lon)
+        self._grid = _grid_levels(right_lat, right_lon, self._height)
+        self._levels = _split_grid_levels(self._grid)
+
+    def to_arrays(self):
+        return {
+            **super().to_arrays(),
+            "grid_height": np.array([self._height]),
+            **self._grid,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        engine = super().from_arrays(arrays)
+        engine._height = float(arrays["grid_height"][0])
+        engine._grid = {
+            name: values
+            for name, values in arrays.items()
+            if name.startswith("grid_") and name != "grid_height"
+        }
+        engine._levels = _split_grid_levels(engine._grid)
+
+        return engine
+
+    def _descend(self, left_points, bounds, k=None, greedy=False):
+        """Finds the cells of the finest grid that may hold points within bounds of left points.
+
+        Args:
+            left_points (PreparedPoints): The left points in float64, shape (n,).
+            bounds (np.ndarray): The distance from each left point to search within, shape (n,).
+            k (int, optional): Lowers the bounds to the distance within which each left point
+                is sure to have k points, at each level. Defaults to None.
+            greedy (bool, optional): Only keeps the cells needed to reach k points
+                at each level, which is quick but only gives bounds. Defaults to False.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: (left_positions, cells),
+                grouped by left position, and the bounds.
+        """
+
+        n_left = len(bounds)
+        n_top = len(self._levels[-1].radii)
+
+        # points with non-finite coordinates are in no cell
+        finite = np.flatnonzero(
+            np.isfinite(left_points.half_lat) & np.isfinite(left_points.half_lon)
+        )
+        owners = np.repeat(finite, n_top)
+        cells = np.tile(np.arange(n_top), len(finite))
+
+        for level in reversed(self._levels):
+            center_distances = haversine_prepared(
+                left_points.take(owners), level.centers.take(cells)
+            )
+            radii = level.radii[cells]
+
+            kept = None
+            if k is not None:
+                level_bounds, needed = _kth_bound(
+                    owners, center_distances + radii, level.counts[cells], k, n_left
+                )
+                bounds = np.minimum(bounds, level_bounds)
+                kept = needed if greedy else None
+
+            # the bounds are padded, so the cells left out clearly only hold further points
+            if kept is None:
+                kept = center_distances - radii <= (
+                    bounds[owners] * (1 + 1e-6) + 1e-5 * EARTH_RADIUS
+                )
+            owners, cells = owners[kept], cells[kept]
+
+            if level is not self._levels[0]:
+                owners, cells = _expand_ranges(
+                    owners, level.firsts[cells], level.sizes[cells]
+                )
+
+        return owners, cells, bounds
+
+    def _candidate_batches(self, left_points, bounds, k=None):
+        """Finds the right points in the cells that may hold points within bounds, in batches.
+
+        The batches are consecutive left points with at most _GRID_MAX_CANDIDATES
+        candidates, or a single left point.
+
+        Args:
+            left_points (PreparedPoints): The left points in float64, shape (n,).
+            bounds (np.ndarray): The distance from each left point to search within, shape (n,).
+            k (int, optional): Searches for the k closest points instead, see _descend.
+                Defaults to None.
+
+        Yields:
+            tuple[slice, np.ndarray, np.ndarray]: The left points of the batch,
+                and the (left_positions, right_positions) pairs, with left positions
+                from the start of the batch, grouped by left position.
+        """
+
+        if k is not None:
+            # the cells needed to reach k points give a bound to start from
+            _, _, bounds = self._descend(left_points, bounds, k, greedy=True)
+
+        owners, cells, _ = self._descend(left_points, bounds, k)
+
+        finest = self._levels[0]
+        sizes = finest.sizes[cells]
+        n_candidates = np.bincount(owners, weights=sizes, minlength=len(bounds))
+        cell_firsts = np.append(
+            0, np.cumsum(np.bincount(owners, minlength=len(bounds)))
+        )
+
+        for batch in _batches(n_candidates.astype(np.int64), _GRID_MAX_CANDIDATES):
+            batch_cells = slice(cell_firsts[batch.start], cell_firsts[batch.stop])
+            batch_owners, positions = _expand_ranges(
+                owners[batch_cells] - batch.start,
+                finest.firsts[cells[batch_cells]],
+                sizes[batch_cells],
+            )
+
+            yield batch, batch_owners, self._grid["grid_order"][positions]
+
+    def query(self, left_lat, left_lon, k, workspace=None):
+        left_points = self._prepare_left(left_lat, left_lon)
+        # the bounds of the cells are compared in float64, whatever the dtype
+        left_points64 = prepare_points(left_lat, left_lon, dtype=np.float64)
+
+        indices = np.zeros((len(left_lat), k), dtype=np.intp)
+        distances = np.full((len(left_lat), k), np.nan, dtype=left_points.cos_lat.dtype)
+
+        # without k right points with finite coordinates, every cell would be searched
+        if len(self._grid["grid_order"]) < k:
+            _check_neighbours(distances)
+
+        for block in chunks(len(left_lat), _GRID_BLOCK_SIZE):
+            block_points = left_points.take(block)
+            batches = self._candidate_batches(
+                left_points64.take(block),
+                np.full(len(block_points.cos_lat), np.inf),
+                k,
+            )
+
+            for batch, owners, right_positions in batches:
+                candidate_distances = haversine_prepared(
+                    block_points.take(batch).take(owners),
+                    self.right_points.take(right_positions),
+                )
+
+                rows = slice(block.start + batch.start, block.start + batch.stop)
+                indices[rows], distances[rows] = _group_k_smallest(
+                    owners,
+                    right_positions,
+                    candidate_distances,
+                    batch.stop - batch.start,
+                    k,
+                )
+
+        _check_neighbours(distances)
+
+        return indices, distances
+
+    def query_radius(self, left_lat, left_lon, radius_km, above=None):
+        left_points = self._prepare_left(left_lat, left_lon)
+        left_points64 = prepare_points(left_lat, left_lon, dtype=np.float64)
+
+        pairs = [
+            (np.zeros(0, dtype=np.intp),) * 2
+            + (np.zeros(0, dtype=left_points.cos_lat.dtype),)
+        ]
+        for block in chunks(len(left_lat), _GRID_BLOCK_SIZE):
+            block_points = left_points.take(block)
+            batches = self._candidate_batches(
+                left_points64.take(block),
+                np.full(len(block_points.cos_lat), float(radius_km)),
+            )
+
+            for batch, owners, right_positions in batches:
+                left_positions = block.start + batch.start + owners
+
+                if above is not None:
+                    searched = right_positions > above[left_positions]
+                    left_positions = left_positions[searched]
+                    right_positions = right_positions[searched]
+
+                candidate_distances = haversine_prepared(
+                    left_points.take(left_positions),
+                    self.right_points.take(right_positions),
+                )
+                within = candidate_distances <= radius_km
+
+                pairs.append(
+                    (
+                        left_positions[within],
+                        right_positions[within],
+                        candidate_distances[within],
+                    )
+                )
+
+        return _sort_pairs(*(np.concatenate(values) for values in zip(*pairs)))
+
+
+class CallableEngine(CrossEngine):
+    """Search with a user provided k nearest neighbours function.
+
+    Radius queries fall back to the "cross" engine.
+
+    Args:
+        knn (Callable): A function with the signature
+            `(left_lat, left_lon, right_lat, right_lon, k) -> (indices, distances)`.
+        right_lat (np.ndarray): Latitudes of the right points, shape (m,).
+        right_lon (np.ndarray): Longitudes of the right points, shape (m,).
+    """
+
+    def __init__(self, knn, right_lat, right_lon):
+        super().__init__(right_lat, right_lon)
+        self._knn = knn
+
+    def query(self, left_lat, left_lon, k, workspace=None):
+        return self._knn(left_lat, left_lon, self.right_lat, self.right_lon, k)
+
+
+ENGINES = {
+    "cross": CrossEngine,
+    "kdtree": KDTreeEngine,
+    "grid": GridEngine,
+}
+
+
+def get_engine(engine, right_lat, right_lon):
+    """Prepares a search engine for the right points.
+
+    Args:
+        engine (str | Callable): The name of a registered engine or a callable with the
+            signature `(left_lat, left_lon, right_lat, right_lon, k) -> (indices, distances)`.
+        right_lat (np.ndarray): Latitudes of the right points, shape (m,).
+        right_lon (np.ndarray): Longitudes of the right points, shape (m,).
+
+    Raises:
+        ValueError: If the engine is unknown.
+
+    Returns:
+        CrossEngine: The engine, with `query` and `query_radius` methods.
+    """
+
+    if callable(engine):
+        return CallableEngine(engine, right_lat=right_lat, right_lon=right_lon)
+
+    try:
+        engine_class = ENGINES[engine]
+    except (KeyError, TypeError) as err:
+        options = ", ".join(repr(name) for name in ENGINES)
+        raise ValueError(
+            f"Unknown engine {engine!r}. Expected one of {options} or a callable."
+        ) from err
+
+    return engine_class(right_lat, right_lon)
+
+
+def _get_n_workers(n_jobs):
+    """Converts n_jobs into a number of workers.
+
+    Args:
+        n_jobs (int | None): The number of workers.
+            None means 1 and negative values count back from the number of CPUs,
+            so -1 uses all of them.
+
+    Raises:
+        ValueError: If n_jobs is 0.
+
+    Returns:
+        int: The number of workers.
+    """
+
+    if n_jobs is None:
+        return 1
+
+    if n_jobs == 0:
+        raise ValueError("n_jobs must not be 0.")
+
+    if n_jobs < 0:
+        return max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+
+    return n_jobs
+
+
+def chunks(n_rows, chunk_size, n_jobs=None):
+    """Splits a range of rows into consecutive blocks.
+
+    Args:
+        n_rows (int): The number of rows.
+        chunk_size (int | None): The maximum number of rows per block.
+            If None is passed, uses one block per worker.
+        n_jobs (int, optional): The number of workers. Defaults to None.
+
+    Raises:
+        ValueError: If chunk_size is not positive.
+
+    Returns:
+        list[slice]: The blocks.
+    """
+
+    if chunk_size is None:
+        chunk_size = max(-(-n_rows // _get_n_workers(n_jobs)), 1)
+
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be a positive integer, got {chunk_size}.")
+
+    return [
+        slice(start, start + chunk_size)
+        for start in range(0, max(n_rows, 1), chunk_size)
+    ]
+
+
+def map_blocks(func, blocks, n_jobs=None):
+    """Applies a function to each block, optionally in a thread pool.
+
+    NumPy releases the GIL in its vectorized math, so threads run blocks in parallel
+    without copying the inputs to other processes.
+    Each block runs in a copy of the caller's context, so e.g. `profile` records
+    the stages of the threads too.
+    Results are returned in the order of the blocks.
+
+    Args:
+        func (Callable): The function to apply.
+        blocks (list[slice]): The blocks.
+        n_jobs (int, optional): The number of threads. Defaults to None.
+
+    Returns:
+        list: The results.
+    """
+
+    n_workers = min(_get_n_workers(n_jobs), len(blocks))
+
+    if n_workers <= 1:
+        return [func(block) for block in blocks]
+
+    # a context can only be entered by one thread at a time, so each block gets a copy
+    contexts = [contextvars.copy_context() for _ in blocks]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(
+            executor.map(
+                lambda context, block: context.run(func, block), contexts, blocks
+            )
+        )
+
+
+def knn_blocked(engine, left_lat, left_lon, k, chunk_size=None, n_jobs=None):
+    """Runs a k nearest neighbours search over blocks of left points.
+
+    Peak memory is bounded by the engine's cost for one block per worker,
+    e.g. a (chunk_size, m) distance matrix for the "cross" engine.
+
+    Args:
+        engine (CrossEngine): The engine.
+        left_lat (np.ndarray): Latitudes of the left points, shape (n,).
+            The distances are computed in its floating point type.
+        left_lon (np.ndarray): Longitudes of the left points, shape (n,).
+        k (int): The number of neighbours to find.
+        chunk_size (int, optional): The maximum number of left points per block.
+            If None is passed, uses one block per worker.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads. Defaults to None.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (indices, distances), both of shape (n, k).
+    """
+
+    indices = np.empty((len(left_lat), k), dtype=np.intp)
+    distances = np.empty((len(left_lat), k), dtype=left_lat.dtype)
+
+    # buffers are reused across the blocks each thread runs, and freed afterwards
+    workspace = threading.local()
+
+    def run(block):
+        indices[block], distances[block] = engine.query(
+            left_lat[block], left_lon[block], k, workspace=workspace
+        )
+
+    map_blocks(run, chunks(len(left_lat), chunk_size, n_jobs), n_jobs)
+
+    return indices, distances
+
+
+def radius_blocked(engine, left_lat, left_lon, radius_km, chunk_size=None, n_jobs=None):
+    """Runs a radius search over blocks of left points.
+
+    Args:
+        engine (CrossEngine): The engine.
+        left_lat (np.ndarray): Latitudes of the left points, shape (n,).
+        left_lon (np.ndarray): Longitudes of the left points, shape (n,).
+        radius_km (float): The distance in kms.
+        chunk_size (int, optional): The maximum number of left points per block.
+            If None is passed, uses one block per worker.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads. Defaults to None.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]:
+            (left_positions, right_positions, distances) for each pair within radius_km,
+            sorted by left position, then distance.
+    """
+
+    def run(block):
+        left_positions, right_positions, distances = engine.query_radius(
+            left_lat[block], left_lon[block], radius_km
+        )
+        return left_positions + block.start, right_positions, distances
+
+    pairs = map_blocks(run, chunks(len(left_lat), chunk_size, n_jobs), n_jobs)
+
+    return tuple(np.concatenate(arrays) for arrays in zip(*pairs))
+
+
+def _merge_neighbours(indices, distances, new_indices, new_distances):
+    """Keeps the closest of two sets of candidate neighbours for each row.
+
+    Ties are broken by position, like `k_smallest`.
+
+    Args:
+        indices (np.ndarray): Positions of the current neighbours, shape (n, k).
+        distances (np.ndarray): Distances to the current neighbours, shape (n, k).
+        new_indices (np.ndarray): Positions of the new candidates, shape (n, j).
+        new_distances (np.ndarray): Distances to the new candidates, shape (n, j).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (indices, distances), both of shape (n, k).
+    """
+
+    k = indices.shape[1]
+    merged_indices = np.concatenate([indices, new_indices], axis=1)
+    merged_distances = np.concatenate([distances, new_distances], axis=1)
+
+    order = np.lexsort((merged_indices, merged_distances), axis=1)[:, :k]
+
+    return (
+        np.take_along_axis(merged_indices, order, axis=1),
+        np.take_along_axis(merged_distances, order, axis=1),
+    )
+
+
+def _self_knn_triangle(engine, k, chunk_size):
+    """Finds the k closest other points of each point with the "cross" engine.
+
+    The distances between each pair of blocks of points are computed once
+    and used for both blocks, so only half of the distance matrix is computed.
+
+    Args:
+        engine (CrossEngine): The engine, prepared on the points.
+        k (int): The number of neighbours to find.
+        chunk_size (int): The number of points per block.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (indices, distances), both of shape (n, k).
+    """
+
+    n_points = len(engine.right_lat)
+    points = engine.right_points
+    dtype = points.cos_lat.dtype
+
+    # the placeholders lose to any point, even at an infinite distance
+    indices = np.full((n_points, k), n_points, dtype=np.intp)
+    distances = np.full((n_points, k), np.inf, dtype=dtype)
+
+    blocks = chunks(n_points, chunk_size)
+
+    for position, rows in enumerate(blocks):
+        for columns in blocks[position:]:
+            block_distances = haversine_prepared(
+                points.take((rows, np.newaxis)), points.take((np.newaxis, columns))
+            )
+
+            if columns == rows:
+                np.fill_diagonal(block_distances, np.inf)
+
+            new_indices, new_distances = k_smallest(
+                block_distances, min(k, block_distances.shape[1])
+            )
+            indices[rows], distances[rows] = _merge_neighbours(
+                indices[rows],
+                distances[rows],
+                new_indices + columns.start,
+                new_distances,
+            )
+
+            if columns != rows:
+                transposed = np.ascontiguousarray(block_distances.T)
+                new_indices, new_distances = k_smallest(
+                    transposed, min(k, transposed.shape[1])
+                )
+                indices[columns], distances[columns] = _merge_neighbours(
+                    indices[columns],
+                    distances[columns],
+                    new_indices + rows.start,
+                    new_distances,
+                )
+
+    _check_neighbours(distances)
+
+    return indices, distances
+
+
+def self_knn_blocked(engine, k, chunk_size=None, n_jobs=None):
+    """Finds the k closest other points of each point the engine was prepared on.
+
+    A point is never its own neighbour, but other points at the same coordinates are.
+    With the "cross" engine and a single thread, each pair of points
+    has its distance computed once, see `_self_knn_triangle`.
+    Otherwise, k + 1 neighbours are searched and the point itself is dropped.
+
+    Args:
+        engine (CrossEngine): The engine, prepared on the points.
+        k (int): The number of neighbours to find. Must be less than the number of points.
+        chunk_size (int, optional): The maximum number of points per block.
+            If None is passed, uses blocks of about a million distances
+            with the "cross" engine, or one block per worker otherwise.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads. Defaults to None.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (indices, distances), both of shape (n, k).
+    """
+
+    n_points = len(engine.right_lat)
+
+    brute_force = isinstance(engine, CrossEngine) and not isinstance(
+        engine, (KDTreeEngine, GridEngine, CallableEngine)
+    )
+    if brute_force and _get_n_workers(n_jobs) == 1:
+        return _self_knn_triangle(engine, k, chunk_size or 1024)
+
+    indices, distances = knn_blocked(
+        engine,
+        left_lat=engine.right_lat,
+        left_lon=engine.right_lon,
+        k=k + 1,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+    )
+
+    # the point itself is usually first, but may come later among duplicates
+    # or be missing if more than k other points share its coordinates
+    others = indices != np.arange(n_points)[:, np.newaxis]
+    others[others.all(axis=1), -1] = False
+
+    return (
+        indices[others].reshape(n_points, k),
+        distances[others].reshape(n_points, k),
+    )
+
+
+def self_radius_blocked(engine, radius_km, chunk_size=None, n_jobs=None):
+    """Finds the pairs of distinct points within a distance of each other.
+
+    Only pairs of a point with a point at a later position are searched,
+    then each pair is added in both directions,
+    so each distance is computed once.
+
+    Args:
+        engine (CrossEngine): The engine, prepared on the points.
+        radius_km (float): The distance in kms.
+        chunk_size (int, optional): The maximum number of points per block.
+            If None is passed, uses one block per worker.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads. Defaults to None.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]:
+            (left_positions, right_positions, distances) for each pair within radius_km,
+            sorted by left position, then distance.
+    """
+
+    lat = engine.right_lat
+    lon = engine.right_lon
+
+    def run(block):
+        positions = np.arange(len(lat))[block]
+        left_positions, right_positions, distances = engine.query_radius(
+            lat[block], lon[block], radius_km, above=positions
+        )
+        return positions[left_positions], right_positions, distances
+
+    pairs = map_blocks(run, chunks(len(lat), chunk_size, n_jobs), n_jobs)
+    left_positions, right_positions, distances = (
+        np.concatenate(arrays) for arrays in zip(*pairs)
+    )
+
+    return _sort_pairs(
+        np.concatenate([left_positions, right_positions]),
+        np.concatenate([right_positions, left_positions]),
+        np.concatenate([distances, distances]),
+    )
+
+
+def radius_features(left_positions, distances, n_left):
+    """Summarizes the pairs within a radius for each left point.
+
+    Args:
+        left_positions (np.ndarray): Positions of the left points in each pair.
+        distances (np.ndarray): Distances between the points in each pair.
+        n_left (int): The number of left points.
+
+    Returns:
+        dict[str, np.ndarray]: The count, min and mean distance for each left point.
+            The distances are NaN for left points with no right points in the radius.
+    """
+
+    counts = np.bincount(left_positions, minlength=n_left)
+    sums = np.bincount(left_positions, weights=distances, minlength=n_left)
+
+    min_distances = np.full(n_left, np.inf, dtype=distances.dtype)
+    np.minimum.at(min_distances, left_positions, distances)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_distances = (sums / counts).astype(distances.dtype)
+
+    return {
+        "count_within_radius": counts,
+        "min_distance_within_radius": np.where(counts > 0, min_distances, np.nan),
+        "mean_distance_within_radius": np.where(counts > 0, mean_distances, np.nan),
+    }
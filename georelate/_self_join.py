@@ -0,0 +1,126 @@
+"""Relates the points of a DataFrame to the other points of the same DataFrame."""
+
+# pylint:disable=too-many-arguments, too-many-locals
+import numpy as np
+import pandas as pd
+
+from georelate._distance import _get_id_keys, _k_closest_frame
+from georelate._profile import stage
+from georelate._search import (
+    _check_radius,
+    get_engine,
+    radius_features,
+    self_knn_blocked,
+    self_radius_blocked,
+)
+
+
+def self_design_matrix(
+    df,
+    df_id=None,
+    lat="lat",
+    lon="lon",
+    k_closest=None,
+    include_coords=False,
+    engine="cross",
+    chunk_size=None,
+    n_jobs=None,
+    radius_km=None,
+    dtype=None,
+):
+    """Builds the design matrix of a DataFrame against its own other rows.
+
+    Like `design_matrix(df, df, ...)`, e.g. to find each store's nearest other stores,
+    but a row is never its own neighbour, although other rows
+    at the same coordinates are.
+    The coordinates are prepared once, and with the "cross" engine and a single thread,
+    the distance between each pair of rows is only computed once.
+    The neighbours' columns are named without suffixes,
+    e.g. "store_id_1_closest" and "distance_1_closest".
+
+    Args:
+        df (DataFrame): The DataFrame. Assumes the index is an id.
+        df_id (str, optional): Column containing the id.
+            If None is passed, assumes the index is the id.
+            Defaults to None.
+        lat (str, optional): Column containing the latitude. Defaults to "lat".
+        lon (str, optional): Column containing the longitude. Defaults to "lon".
+        k_closest (int, optional): The number of nearest other rows to include.
+            Must be less than the number of rows.
+            Defaults to None.
+        include_coords (bool, optional): Whether to include the coordinates of the rows
+            and of their neighbours in the results.
+            Defaults to False.
+        engine (str | Callable, optional): How to find the closest rows,
+            see `design_matrix`.
+            Defaults to "cross".
+        chunk_size (int, optional): The number of rows to process at a time.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads to use. Defaults to None.
+        radius_km (float, optional): A distance in kms to summarize the other rows
+            within, see `design_matrix`.
+            Defaults to None.
+        dtype (DTypeLike, optional): The floating point type to compute distances in.
+            If None is passed, uses float64.
+            Defaults to None.
+
+    Raises:
+        ValueError: If k_closest isn't less than the number of rows
+            or radius_km is negative.
+
+    Returns:
+        DataFrame: The design matrix.
+    """
+
+    _check_radius(radius_km)
+
+    dtype = np.float64 if dtype is None else dtype
+
+    _, id_key = _get_id_keys(left=df, right=df, left_id=df_id, right_id=df_id)
+    points_df = df.reset_index() if df_id is None else df
+
+    with stage("prepare", rows=len(points_df)):
+        search_engine = get_engine(
+            engine,
+            right_lat=points_df[lat].to_numpy(dtype=dtype),
+            right_lon=points_df[lon].to_numpy(dtype=dtype),
+        )
+
+    neighbours_df = (
+        points_df if include_coords else points_df.drop([lat, lon], axis="columns")
+    )
+    out_df = neighbours_df.reset_index(drop=True)
+
+    if k_closest:
+        if k_closest >= len(points_df):
+            raise ValueError(
+                f"k_closest={k_closest} must be less than the {len(points_df)} rows."
+            )
+
+        with stage("knn", rows=len(points_df)):
+            indices, distances = self_knn_blocked(
+                search_engine, k=k_closest, chunk_size=chunk_size, n_jobs=n_jobs
+            )
+
+        with stage("k_closest_columns", rows=len(points_df)):
+            k_closest_df = _k_closest_frame(
+                right_df=neighbours_df,
+                right_id_key=id_key,
+                right_id_prefix=id_key,
+                indices=indices,
+                distances=distances,
+            )
+            out_df = pd.concat([out_df, k_closest_df], axis="columns")
+
+    if radius_km is not None:
+        with stage("radius", rows=len(points_df)):
+            left_positions, _, distances = self_radius_blocked(
+                search_engine, radius_km=radius_km, chunk_size=chunk_size, n_jobs=n_jobs
+            )
+
+        with stage("radius_features", rows=len(points_df)):
+            out_df = out_df.assign(
+                **radius_features(left_positions, distances, n_left=len(points_df))
+            )
+
+    return out_df
@@ -0,0 +1,325 @@
+"""Answers queries against a GeoIndex over HTTP, batching concurrent requests."""
+
+# pylint:disable=too-many-locals
+import asyncio
+import json
+
+import numpy as np
+
+from georelate._profile import stage
+from georelate._search import _check_radius, radius_features
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+}
+
+
+def _jsonable(values):
+    """Converts an array into lists JSON can encode, with NaN as null.
+
+    Args:
+        values (np.ndarray): The values.
+
+    Returns:
+        list: The values.
+    """
+
+    if values.dtype.kind == "f":
+        values = np.where(np.isnan(values), None, values.astype(object))
+    return values.tolist()
+
+
+class GeoServer:
+    """A server answering nearest neighbour and radius queries against a GeoIndex.
+
+    The index, with its prepared right points, is loaded once and queries only pay
+    for their own points. Queries arriving within max_delay of each other
+    with the same k_closest and radius_km are answered by a single search,
+    which spreads the overhead of NumPy over many small requests.
+
+    Serves HTTP/1.1 with keep-alive, on a TCP port or a Unix socket:
+    POST /query with a JSON body such as
+    {"lat": [-6.69], "lon": [-39.77], "k_closest": 3, "radius_km": 50}
+    returns the ids and distances of the closest right rows
+    and the radius features, like `design_matrix`, one entry per point:
+    {"ids": [[...]], "distances": [[...]], "count_within_radius": [...], ...}.
+    GET /health returns the number of indexed rows.
+
+    Example:
+        index = GeoIndex.load("index.bin")
+        asyncio.run(GeoServer(index).serve_forever(port=8000))
+
+    Args:
+        index (GeoIndex): The index to query.
+        max_batch_size (int, optional): The number of pending points
+            that triggers a search without waiting for more.
+            Defaults to 4096.
+        max_delay (float, optional): The seconds to wait for more queries
+            before searching. With 0, only batches the queries
+            that arrived in the same iteration of the event loop.
+            Defaults to 0.
+    """
+
+    def __init__(self, index, max_batch_size=4096, max_delay=0.0):
+        self.index = index
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+
+        self._right_ids = index.right_ids
+        self._pending = {}
+        self._n_pending = 0
+        self._flush_handle = None
+
+        # the lazily prepared arrays of the engine are built before the first request
+        if len(index) > 0:
+            index.knn_arrays([0.0], [0.0], k=1)
+            index.radius_arrays([0.0], [0.0], radius_km=0.0)
+
+    async def query(self, lat, lon, k_closest=None, radius_km=None):
+        """Finds the closest right rows and the radius features of some points.
+
+        Concurrent queries are batched, see `GeoServer`.
+
+        Args:
+            lat (ArrayLike[Number] | Number): Latitudes of the points.
+            lon (ArrayLike[Number] | Number): Longitudes of the points.
+            k_closest (int, optional): The number of nearest observations to include.
+                Defaults to None.
+            radius_km (float, optional): A distance in kms to summarize the observations
+                within, see `design_matrix`.
+                Defaults to None.
+
+        Raises:
+            ValueError: If neither k_closest nor radius_km is passed,
+                either is out of range, or the coordinates aren't finite
+                or don't have matching shapes.
+
+        Returns:
+            dict[str, np.ndarray]: With k_closest, "ids" and "distances",
+                of shape (n, k_closest), sorted by distance.
+                With radius_km, "count_within_radius", "min_distance_within_radius"
+                and "mean_distance_within_radius", of shape (n,).
+        """
+
+        if k_closest is None and radius_km is None:
+            raise ValueError("Pass k_closest, radius_km or both.")
+        if k_closest is not None and not 1 <= k_closest <= len(self.index):
+            raise ValueError(
+                f"k_closest must be between 1 and the {len(self.index)} rows, "
+                f"got {k_closest}."
+            )
+        _check_radius(radius_km)
+
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        if lat.ndim != 1 or lat.shape != lon.shape:
+            raise ValueError(
+                "lat and lon must be numbers or one dimensional with the same length, "
+                f"got shapes {lat.shape} and {lon.shape}."
+            )
+        # a point failing the search would fail the other queries of its batch
+        if not (np.isfinite(lat).all() and np.isfinite(lon).all()):
+            raise ValueError("lat and lon must be finite.")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        self._pending.setdefault((k_closest, radius_km), []).append((lat, lon, future))
+        self._n_pending += len(lat)
+
+        if self._n_pending >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_delay, self._flush)
+
+        return await future
+
+    def _flush(self):
+        """Answers every pending query, one search per k_closest and radius_km."""
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, {}
+        self._n_pending = 0
+
+        for (k_closest, radius_km), requests in pending.items():
+            futures = [future for _, _, future in requests]
+            try:
+                results = self._search(requests, k_closest, radius_km)
+            except Exception as err:  # pylint:disable=broad-exception-caught
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(err)
+                continue
+
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _search(self, requests, k_closest, radius_km):
+        """Searches the points of several queries at once.
+
+        Args:
+            requests (list[tuple[np.ndarray, np.ndarray, asyncio.Future]]):
+                The coordinates of each query.
+            k_closest (int | None): The number of nearest observations to include.
+            radius_km (float | None): A distance in kms to summarize the observations
+                within.
+
+        Returns:
+            list[dict[str, np.ndarray]]: The result of each query.
+        """
+
+        lat = np.concatenate([lat for lat, _, _ in requests])
+        lon = np.concatenate([lon for _, lon, _ in requests])
+        splits = np.cumsum([len(lat) for lat, _, _ in requests])[:-1]
+
+        columns = {}
+        with stage("query_batch", rows=len(lat)):
+            if k_closest is not None:
+                indices, distances = self.index.knn_arrays(lat, lon, k=k_closest)
+                columns["ids"] = self._right_ids[indices]
+                columns["distances"] = distances
+
+            if radius_km is not None:
+                left_positions, _, distances = self.index.radius_arrays(
+                    lat, lon, radius_km=radius_km
+                )
+                columns.update(radius_features(left_positions, distances, len(lat)))
+
+        parts = {name: np.split(values, splits) for name, values in columns.items()}
+
+        return [
+            {name: parts[name][position] for name in columns}
+            for position in range(len(requests))
+        ]
+
+    async def _respond(self, method, target, body):
+        """Answers an HTTP request.
+
+        Args:
+            method (str): The method, e.g. "POST".
+            target (str): The path.
+            body (bytes): The body.
+
+        Returns:
+            tuple[int, dict]: The status and the JSON payload.
+        """
+
+        if target == "/health":
+            if method != "GET":
+                return 405, {"error": f"{method} is not allowed on {target}."}
+            return 200, {"rows": len(self.index)}
+
+        if target != "/query":
+            return 404, {"error": f"{target} not found."}
+        if method != "POST":
+            return 405, {"error": f"{method} is not allowed on {target}."}
+
+        try:
+            request = json.loads(body)
+            if not isinstance(request, dict) or not {"lat", "lon"} <= request.keys():
+                raise ValueError("The body must be an object with lat and lon.")
+
+            result = await self.query(
+                request["lat"],
+                request["lon"],
+                k_closest=request.get("k_closest"),
+                radius_km=request.get("radius_km"),
+            )
+        except (ValueError, TypeError) as err:
+            return 400, {"error": str(err)}
+
+        return 200, {name: _jsonable(values) for name, values in result.items()}
+
+    async def _handle(self, reader, writer):
+        """Serves the HTTP requests of a connection until it is closed."""
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+
+                parts = request_line.decode("latin-1").split()
+                if len(parts) == 3 and length >= 0:
+                    body = await reader.readexactly(length)
+                    method, target, version = parts
+                    status, payload = await self._respond(method, target, body)
+                else:
+                    # without a valid request line and length, the body can't be skipped
+                    # and the connection is closed
+                    version = "HTTP/1.0"
+                    status, payload = 400, {
+                        "error": "Malformed request line or Content-Length."
+                    }
+
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+
+                content = json.dumps(payload, default=str).encode("utf-8")
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(content)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + content
+                )
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        """Starts serving in the background of the running event loop.
+
+        Args:
+            host (str, optional): The host to listen on. Defaults to "127.0.0.1".
+            port (int, optional): The port to listen on.
+                With 0, picks a free port, see `asyncio.Server.sockets`.
+                Defaults to 0.
+            path (str | os.PathLike, optional): A Unix socket to listen on
+                instead of host and port.
+                Defaults to None.
+
+        Returns:
+            asyncio.Server: The server, to close when done.
+        """
+
+        if path is not None:
+            return await asyncio.start_unix_server(self._handle, path=path)
+        return await asyncio.start_server(self._handle, host=host, port=port)
+
+    async def serve_forever(self, host="127.0.0.1", port=0, path=None):
+        """Serves until cancelled. Takes the same arguments as `GeoServer.start`."""
+
+        server = await self.start(host=host, port=port, path=path)
+        async with server:
+            await server.serve_forever()
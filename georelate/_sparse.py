@@ -0,0 +1,223 @@
+"""Builds sparse matrices of the distances between neighbouring points."""
+
+# pylint:disable=too-many-arguments
+import numpy as np
+
+from georelate._profile import stage
+from georelate._search import _check_radius, get_engine, knn_blocked, radius_blocked
+
+
+def _csr_array_class():
+    """Imports scipy's compressed sparse row array.
+
+    Raises:
+        ImportError: If scipy isn't installed.
+
+    Returns:
+        type: scipy.sparse.csr_array.
+    """
+
+    try:
+        # pylint:disable=import-outside-toplevel
+        from scipy.sparse import csr_array
+    except ImportError as err:
+        raise ImportError(
+            "Sparse matrices require scipy. "
+            "Install it with `pip install georelate[sparse]`, "
+            "or pass as_arrays=True to get NumPy arrays."
+        ) from err
+
+    return csr_array
+
+
+def neighbour_arrays(
+    search_engine,
+    left_lat,
+    left_lon,
+    k_closest=None,
+    radius_km=None,
+    chunk_size=None,
+    n_jobs=None,
+):
+    """Finds the neighbours of each left point, in compressed sparse row form.
+
+    Args:
+        search_engine (CrossEngine): The engine prepared on the right points.
+        left_lat (np.ndarray): Latitudes of the left points, shape (n,).
+        left_lon (np.ndarray): Longitudes of the left points, shape (n,).
+        k_closest (int, optional): The number of closest right points of each left point.
+            Defaults to None.
+        radius_km (float, optional): The distance in kms within which right points
+            are neighbours.
+            Defaults to None.
+        chunk_size (int, optional): The number of left points to process at a time.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads to use. Defaults to None.
+
+    Raises:
+        ValueError: If not exactly one of k_closest and radius_km is passed,
+            or it is out of range.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: (indptr, indices, data),
+            where the neighbours of left point i are the right points
+            indices[indptr[i]:indptr[i + 1]], at distances data[indptr[i]:indptr[i + 1]],
+            closest first.
+    """
+
+    n_left = len(left_lat)
+    n_right = len(search_engine.right_lat)
+
+    if (k_closest is None) == (radius_km is None):
+        raise ValueError("Pass exactly one of k_closest and radius_km.")
+
+    if k_closest is not None:
+        if not 1 <= k_closest <= n_right:
+            raise ValueError(
+                f"k_closest must be between 1 and the {n_right} right rows, "
+                f"got {k_closest}."
+            )
+
+        with stage("knn", rows=n_left):
+            indices, distances = knn_blocked(
+                search_engine,
+                left_lat=left_lat,
+                left_lon=left_lon,
+                k=k_closest,
+                chunk_size=chunk_size,
+                n_jobs=n_jobs,
+            )
+
+        indptr = np.arange(0, n_left * k_closest + 1, k_closest, dtype=np.intp)
+        return indptr, indices.ravel(), distances.ravel()
+
+    _check_radius(radius_km)
+
+    with stage("radius", rows=n_left):
+        # the same search as radius_arrays
+        # pylint:disable=duplicate-code
+        left_positions, right_positions, distances = radius_blocked(
+            search_engine,
+            left_lat=left_lat,
+            left_lon=left_lon,
+            radius_km=radius_km,
+            chunk_size=chunk_size,
+            n_jobs=n_jobs,
+        )
+        # pylint:enable=duplicate-code
+
+    # the pairs are sorted by left position, so each row's pairs are contiguous
+    indptr = np.zeros(n_left + 1, dtype=np.intp)
+    np.cumsum(np.bincount(left_positions, minlength=n_left), out=indptr[1:])
+
+    return indptr, right_positions, distances
+
+
+def as_sparse(arrays, n_right, as_arrays):
+    """Converts the arrays of `neighbour_arrays` into the requested output.
+
+    Args:
+        arrays (tuple[np.ndarray, np.ndarray, np.ndarray]): (indptr, indices, data).
+        n_right (int): The number of right points, the number of columns.
+        as_arrays (bool): Whether to return the arrays as they are.
+
+    Returns:
+        scipy.sparse.csr_array | tuple[np.ndarray, np.ndarray, np.ndarray]:
+            The sparse matrix or the arrays.
+    """
+
+    if as_arrays:
+        return arrays
+
+    indptr, indices, data = arrays
+    return _csr_array_class()(
+        (data, indices, indptr), shape=(len(indptr) - 1, n_right), copy=False
+    )
+
+
+def neighbour_matrix(
+    left,
+    right,
+    k_closest=None,
+    radius_km=None,
+    left_lat="lat",
+    left_lon="lon",
+    right_lat="lat",
+    right_lon="lon",
+    engine="cross",
+    chunk_size=None,
+    n_jobs=None,
+    dtype=None,
+    as_arrays=False,
+):
+    """Builds a sparse matrix of the distances from each left row to its neighbours.
+
+    Row i holds the distances in kms from the i-th row of left to its neighbours,
+    in the columns of their positions in right, e.g. as spatial weights.
+    Only the neighbours are stored, so memory grows with their number
+    instead of len(left) * len(right).
+    Neighbours at a distance of 0 are stored as explicit zeros,
+    and the entries of each row are ordered by distance rather than column.
+
+    Args:
+        left (DataFrame): Left DataFrame, one row of the matrix per row.
+        right (DataFrame): Right DataFrame, one column of the matrix per row.
+        k_closest (int, optional): Makes the k_closest closest rows of right,
+            as in `design_matrix`, the neighbours of each row of left.
+            Defaults to None.
+        radius_km (float, optional): Makes the rows of right within radius_km
+            the neighbours of each row of left.
+            Exactly one of k_closest and radius_km must be passed.
+            Defaults to None.
+        left_lat (str, optional): Column containing the latitude in the left DataFrame.
+            Defaults to "lat".
+        left_lon (str, optional): Column containing the longitude in the left DataFrame.
+            Defaults to "lon".
+        right_lat (str, optional): Column containing the latitude in the right DataFrame.
+            Defaults to "lat".
+        right_lon (str, optional): Column containing the longitude in the right DataFrame.
+            Defaults to "lon".
+        engine (str | Callable, optional): How to find the neighbours,
+            see `design_matrix`.
+            Defaults to "cross".
+        chunk_size (int, optional): The number of rows from the left DataFrame
+            to process at a time.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads to use. Defaults to None.
+        dtype (DTypeLike, optional): The floating point type to compute distances in.
+            If None is passed, uses float64.
+            Defaults to None.
+        as_arrays (bool, optional): Whether to return the (indptr, indices, data)
+            arrays of the compressed sparse row format instead of a scipy matrix,
+            which requires scipy.
+            Defaults to False.
+
+    Raises:
+        ValueError: If not exactly one of k_closest and radius_km is passed,
+            or it is out of range.
+
+    Returns:
+        scipy.sparse.csr_array | tuple[np.ndarray, np.ndarray, np.ndarray]:
+            The (len(left), len(right)) matrix, or its (indptr, indices, data) arrays.
+    """
+
+    dtype = np.float64 if dtype is None else dtype
+
+    with stage("prepare_right", rows=len(right)):
+        search_engine = get_engine(
+            engine,
+            right_lat=right[right_lat].to_numpy(dtype=dtype),
+            right_lon=right[right_lon].to_numpy(dtype=dtype),
+        )
+
+    arrays = neighbour_arrays(
+        search_engine,
+        left_lat=left[left_lat].to_numpy(dtype=dtype),
+        left_lon=left[left_lon].to_numpy(dtype=dtype),
+        k_closest=k_closest,
+        radius_km=radius_km,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+    )
+
+    return as_sparse(arrays, len(right), as_arrays)
@@ -0,0 +1,135 @@
+"""Reads and writes arrays in a file that can be memory-mapped."""
+
+# pylint:disable=too-many-locals
+import json
+import os
+import struct
+
+import numpy as np
+
+# the first bytes of every file, to recognize it
+MAGIC = b"GEORELAT"
+
+# bump whenever the layout or the meaning of the saved arrays changes,
+# so files written by other versions are rejected instead of misread
+FORMAT_VERSION = 1
+
+# the magic, then the format version and the header length as little-endian uint32
+_PREFIX = struct.Struct(f"<{len(MAGIC)}sII")
+
+# arrays start at multiples of this many bytes, so they are aligned when mapped
+_ALIGNMENT = 64
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def write_store(path, metadata, arrays):
+    """Writes arrays and metadata to a file.
+
+    The file holds a short prefix, a JSON header with the metadata and the dtype, shape
+    and offset of each array, then the raw bytes of each array.
+
+    Args:
+        path (str | os.PathLike): The file to write.
+        metadata (dict): JSON serializable metadata.
+        arrays (dict[str, np.ndarray]): The arrays by name. They can't hold Python objects.
+
+    Raises:
+        ValueError: If an array holds Python objects.
+    """
+
+    arrays = {name: np.ascontiguousarray(values) for name, values in arrays.items()}
+
+    entries = {}
+    offset = 0
+    for name, values in arrays.items():
+        if values.dtype.hasobject:
+            raise ValueError(f"Array {name!r} holds Python objects and can't be saved.")
+
+        entries[name] = {
+            "dtype": values.dtype.str,
+            "shape": list(values.shape),
+            "offset": offset,
+        }
+        offset = _align(offset + values.nbytes)
+
+    header = json.dumps(
+        {"metadata": metadata, "arrays": entries}, separators=(",", ":")
+    ).encode("utf-8")
+    data_start = _align(_PREFIX.size + len(header))
+
+    with open(path, "wb") as file:
+        file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        file.write(header)
+
+        for name, values in arrays.items():
+            file.seek(data_start + entries[name]["offset"])
+            file.write(values.tobytes())
+
+        # pad the end, so every array can be mapped with its full length
+        file.truncate(data_start + offset)
+
+
+def read_store(path, mmap_mode="r"):
+    """Reads the arrays and metadata of a file written by `write_store`.
+
+    Args:
+        path (str | os.PathLike): The file to read.
+        mmap_mode (str, optional): How to memory-map the arrays, see `np.memmap`.
+            With "r", processes that read the same file share one copy in memory.
+            If None is passed, reads the arrays into memory.
+            Defaults to "r".
+
+    Raises:
+        ValueError: If the file wasn't written by `write_store`,
+            was written with another format version or is truncated.
+
+    Returns:
+        tuple[dict, dict[str, np.ndarray]]: The metadata and the arrays by name.
+    """
+
+    with open(path, "rb") as file:
+        prefix = file.read(_PREFIX.size)
+
+        if len(prefix) < _PREFIX.size or not prefix.startswith(MAGIC):
+            raise ValueError(f"{path} is not a georelate index file.")
+
+        _, version, header_length = _PREFIX.unpack(prefix)
+
+        if version != FORMAT_VERSION:
+            raise ValueError(
+                f"{path} was saved with index format version {version}, "
+                f"but this version of georelate reads version {FORMAT_VERSION}. "
+                "Build the index again and save it."
+            )
+
+        header = json.loads(file.read(header_length).decode("utf-8"))
+
+    data_start = _align(_PREFIX.size + header_length)
+    file_size = os.path.getsize(path)
+
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        offset = data_start + entry["offset"]
+        count = int(np.prod(shape))
+
+        if offset + count * dtype.itemsize > file_size:
+            raise ValueError(f"{path} is truncated.")
+
+        if count == 0:
+            # empty arrays can't be mapped
+            arrays[name] = np.empty(shape, dtype=dtype)
+        elif mmap_mode is None:
+            arrays[name] = np.fromfile(
+                path, dtype=dtype, count=count, offset=offset
+            ).reshape(shape)
+        else:
+            arrays[name] = np.memmap(
+                path, dtype=dtype, mode=mmap_mode, offset=offset, shape=shape
+            )
+
+    return header["metadata"], arrays
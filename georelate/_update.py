@@ -0,0 +1,315 @@
+"""Updates a design matrix after rows are added to or removed from the right DataFrame."""
+
+# pylint:disable=too-many-arguments, too-many-locals, too-many-statements
+import numpy as np
+import pandas as pd
+
+from georelate._distance import (
+    _get_id_keys,
+    _get_id_keys_with_potential_suffix,
+    _k_closest_frame,
+)
+from georelate._search import get_engine, knn_blocked, radius_blocked, radius_features
+
+
+def _assign_rows(result, rows, values_df):
+    """Overwrites some rows of a DataFrame, column by column.
+
+    Args:
+        result (DataFrame): The DataFrame to change in place.
+        rows (np.ndarray): The positions of the rows.
+        values_df (DataFrame): The new values, one row per position.
+    """
+
+    for column, values in values_df.items():
+        result.iloc[rows, result.columns.get_loc(column)] = values.to_numpy()
+
+
+def update_design_matrix(
+    previous,
+    left,
+    right,
+    inserted=None,
+    deleted=None,
+    left_id=None,
+    right_id=None,
+    left_lat="lat",
+    left_lon="lon",
+    right_lat="lat",
+    right_lon="lon",
+    suffixes=("_left", "_right"),
+    k_closest=None,
+    include_right_coords=False,
+    engine="cross",
+    chunk_size=None,
+    n_jobs=None,
+    radius_km=None,
+    dtype=None,
+):
+    """Updates a design matrix after rows are added to or removed from the right DataFrame.
+
+    Gives the same result as calling `design_matrix` with the updated right DataFrame,
+    but only searches the left rows the change can affect:
+    a new row can only displace the closest observations of the left rows
+    it is closer to than their k-th closest observation,
+    and only left rows with a removed row among their closest observations
+    are searched again.
+    With radius_km, only left rows within radius_km of an added or removed row
+    are summarized again.
+
+    The arguments must be the ones previous was built with.
+    The ids of the right DataFrame must be unique,
+    and the rows that weren't inserted must keep their order,
+    since ties at the k-th distance are broken by position in the right DataFrame.
+    Inserted rows can be anywhere.
+    To move a row, pass it in both deleted and inserted.
+
+    Args:
+        previous (DataFrame): The design matrix to update, one row per row of left.
+        left (DataFrame): Left DataFrame previous was built from.
+        right (DataFrame): The updated right DataFrame, with the inserted rows
+            and without the deleted ones.
+        inserted (DataFrame, optional): The rows added to the right DataFrame.
+            Defaults to None.
+        deleted (DataFrame, optional): The rows removed from the right DataFrame.
+            Defaults to None.
+        left_id (str, optional): Column containing the id for the left DataFrame.
+            Defaults to None.
+        right_id (str, optional): Column containing the id for the right DataFrames.
+            Defaults to None.
+        left_lat (str, optional): Column containing the latitude in the left DataFrame.
+            Defaults to "lat".
+        left_lon (str, optional): Column containing the longitude in the left DataFrame.
+            Defaults to "lon".
+        right_lat (str, optional): Column containing the latitude in the right DataFrames.
+            Defaults to "lat".
+        right_lon (str, optional): Column containing the longitude in the right DataFrames.
+            Defaults to "lon".
+        suffixes (tuple, optional): The suffixes for overlapping column names.
+            Defaults to ("_left", "_right").
+        k_closest (int, optional): The number of nearest observations previous includes.
+            Defaults to None.
+        include_right_coords (bool, optional): Whether previous includes the coordinates
+            from the right DataFrame.
+            Defaults to False.
+        engine (str | Callable, optional): How to find the closest observations.
+            Defaults to "cross".
+        chunk_size (int, optional): The number of rows from the left DataFrame
+            to process at a time.
+            Defaults to None.
+        n_jobs (int, optional): The number of threads to use. Defaults to None.
+        radius_km (float, optional): The distance in kms previous summarizes
+            the observations within.
+            Defaults to None.
+        dtype (DTypeLike, optional): The floating point type to compute distances in.
+            Defaults to None.
+
+    Raises:
+        ValueError: If previous doesn't match left or the arguments,
+            the ids of the right DataFrame aren't unique,
+            an inserted row isn't in the right DataFrame
+            or the rows of the right DataFrame were reordered among tied closest observations.
+
+    Returns:
+        DataFrame: The updated design matrix.
+    """
+
+    dtype = np.float64 if dtype is None else dtype
+
+    left_id_key, right_id_key = _get_id_keys(
+        left=left, right=right, left_id=left_id, right_id=right_id
+    )
+    _, right_id_key_w_suffix = _get_id_keys_with_potential_suffix(
+        left=left, right=right, left_id=left_id, right_id=right_id, suffixes=suffixes
+    )
+
+    def as_right_df(frame):
+        if frame is None:
+            return right_df.iloc[:0]
+        return frame.reset_index() if right_id is None else frame
+
+    right_df = right.reset_index() if right_id is None else right
+    inserted_df = as_right_df(inserted)
+    deleted_df = as_right_df(deleted)
+    left_df = left.reset_index() if left_id is None else left
+
+    if len(previous) != len(left_df):
+        raise ValueError(
+            f"previous has {len(previous)} rows, but left has {len(left_df)}."
+        )
+    if not np.array_equal(
+        previous[left_id_key].to_numpy(), left_df[left_id_key].to_numpy()
+    ):
+        raise ValueError("previous and left have different ids.")
+
+    ids = pd.Index(right_df[right_id_key])
+    if not ids.is_unique:
+        raise ValueError("The ids in right must be unique.")
+
+    inserted_positions = ids.get_indexer(inserted_df[right_id_key])
+    if (inserted_positions < 0).any():
+        raise ValueError("Every inserted row must be in right.")
+
+    left_lat_values = left_df[left_lat].to_numpy(dtype=dtype)
+    left_lon_values = left_df[left_lon].to_numpy(dtype=dtype)
+
+    def engine_for(frame):
+        return get_engine(
+            engine,
+            right_lat=frame[right_lat].to_numpy(dtype=dtype),
+            right_lon=frame[right_lon].to_numpy(dtype=dtype),
+        )
+
+    # the right DataFrame is only prepared if a search over all of it is needed
+    right_engines = []
+
+    def right_engine():
+        if not right_engines:
+            right_engines.append(engine_for(right_df))
+        return right_engines[0]
+
+    result = previous.copy()
+
+    if k_closest:
+        if k_closest > len(right_df):
+            raise ValueError(
+                f"k_closest={k_closest} exceeds the {len(right_df)} rows in right."
+            )
+
+        right_selected = (
+            right_df
+            if include_right_coords
+            else right_df.drop([right_lat, right_lon], axis="columns")
+        )
+
+        # the columns of the closest observations, ids and distances first
+        columns = _k_closest_frame(
+            right_df=right_selected.iloc[:0],
+            right_id_key=right_id_key,
+            right_id_prefix=right_id_key_w_suffix,
+            indices=np.empty((0, k_closest), dtype=np.intp),
+            distances=np.empty((0, k_closest), dtype=dtype),
+        ).columns
+        missing = columns.difference(previous.columns)
+        if len(missing) > 0:
+            raise ValueError(
+                f"previous doesn't have the columns {list(missing)} "
+                "of a design matrix built with these arguments."
+            )
+
+        id_columns = list(columns[0 : 2 * k_closest : 2])
+        distance_columns = list(columns[1 : 2 * k_closest : 2])
+
+        closest_ids = previous[id_columns]
+        positions = ids.get_indexer(closest_ids.to_numpy().ravel()).reshape(
+            len(previous), k_closest
+        )
+        distances = np.array(previous[distance_columns], dtype=dtype)
+
+        # left rows with a removed observation among their closest are searched again
+        stale = (positions < 0).any(axis=1)
+        stale |= (
+            closest_ids.isin(deleted_df[right_id_key].tolist()).to_numpy().any(axis=1)
+        )
+
+        # ties are broken by position in right, so the kept observations of the other rows
+        # are only still the closest if right kept its order
+        tied = distances[~stale, 1:] == distances[~stale, :-1]
+        if (tied & (positions[~stale, 1:] < positions[~stale, :-1])).any():
+            raise ValueError(
+                "The rows of right that weren't inserted must keep their order, "
+                "which breaks ties between equally close observations."
+            )
+
+        changed = stale.copy()
+
+        if stale.any():
+            positions[stale], distances[stale] = knn_blocked(
+                right_engine(),
+                left_lat=left_lat_values[stale],
+                left_lon=left_lon_values[stale],
+                k=k_closest,
+                chunk_size=chunk_size,
+                n_jobs=n_jobs,
+            )
+
+        if len(inserted_df) > 0:
+            rows = np.flatnonzero(~stale)
+
+            new_indices, new_distances = knn_blocked(
+                engine_for(inserted_df),
+                left_lat=left_lat_values[rows],
+                left_lon=left_lon_values[rows],
+                k=min(k_closest, len(inserted_df)),
+                chunk_size=chunk_size,
+                n_jobs=n_jobs,
+            )
+
+            # a new observation can only displace the k-th closest if it is as close
+            displaces = new_distances[:, 0] <= distances[rows, -1]
+            rows = rows[displaces]
+
+            merged_positions = np.concatenate(
+                [positions[rows], inserted_positions[new_indices[displaces]]], axis=1
+            )
+            merged_distances = np.concatenate(
+                [distances[rows], new_distances[displaces]], axis=1
+            )
+
+            # ties are broken by position in right, like a full search
+            order = np.lexsort((merged_positions, merged_distances), axis=1)
+            order = order[:, :k_closest]
+
+            positions[rows] = np.take_along_axis(merged_positions, order, axis=1)
+            distances[rows] = np.take_along_axis(merged_distances, order, axis=1)
+            changed[rows] = True
+
+        rows = np.flatnonzero(changed)
+        _assign_rows(
+            result,
+            rows,
+            _k_closest_frame(
+                right_df=right_selected,
+                right_id_key=right_id_key,
+                right_id_prefix=right_id_key_w_suffix,
+                indices=positions[rows],
+                distances=distances[rows],
+            ),
+        )
+
+    if radius_km is not None:
+        moved_df = pd.concat(
+            [inserted_df[[right_lat, right_lon]], deleted_df[[right_lat, right_lon]]],
+            ignore_index=True,
+        )
+
+        if len(moved_df) > 0:
+            # only left rows near an added or removed observation are summarized again,
+            # with the same search as design_matrix
+            # pylint:disable=duplicate-code
+            near_positions, _, _ = radius_blocked(
+                engine_for(moved_df),
+                left_lat=left_lat_values,
+                left_lon=left_lon_values,
+                radius_km=radius_km,
+                chunk_size=chunk_size,
+                n_jobs=n_jobs,
+            )
+            # pylint:enable=duplicate-code
+            rows = np.unique(near_positions)
+
+            left_positions, _, distances = radius_blocked(
+                right_engine(),
+                left_lat=left_lat_values[rows],
+                left_lon=left_lon_values[rows],
+                radius_km=radius_km,
+                chunk_size=chunk_size,
+                n_jobs=n_jobs,
+            )
+            _assign_rows(
+                result,
+                rows,
+                pd.DataFrame(radius_features(left_positions, distances, len(rows))),
+            )
+
+    return result
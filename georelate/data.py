@@ -1,7 +1,23 @@
-"""Allow the user to load example datasets."""
+"""Allow the user to load example datasets and generate synthetic ones."""
 
+import numpy as np
 import pandas as pd
 
+# approximate bounding boxes, as (min_lat, max_lat, min_lon, max_lon),
+# a min_lon above max_lon crosses the antimeridian
+COUNTRY_BOUNDS = {
+    "brazil": (-33.75, 5.27, -73.99, -34.79),
+    "germany": (47.27, 55.06, 5.87, 15.04),
+    "india": (6.75, 35.5, 68.1, 97.4),
+    "nigeria": (4.27, 13.89, 2.67, 14.68),
+    "united_states": (24.52, 49.38, -124.77, -66.95),
+    "fiji": (-20.68, -12.48, 177.0, -178.0),
+    "antarctica": (-90.0, -60.0, -180.0, 180.0),
+}
+
+# kms per degree of latitude, on a sphere with the radius haversine uses
+_KM_PER_DEGREE = 6367 * np.pi / 180
+
 
 def _load_poll_df():
     """Fictitious polling locations.
@@ -44,3 +60,187 @@ def load_poll_aid_data():
         tuple[pd.DataFrame, pd.DataFrame]: (Fictitious polling locations, Fictitious aid locations)
     """
     return (_load_poll_df(), _load_aid_df())
+
+
+def _points_df(lat, lon):
+    """Wraps coordinates in a DataFrame with an id.
+
+    Args:
+        lat (np.ndarray): The latitudes.
+        lon (np.ndarray): The longitudes.
+
+    Returns:
+        pd.DataFrame: The points, with the columns "id", "lat" and "lon".
+    """
+    return pd.DataFrame({"id": np.arange(len(lat)), "lat": lat, "lon": lon})
+
+
+def _bounded_coords(rng, n, bounds):
+    """Draws coordinates uniformly over the area of a box on the sphere.
+
+    Args:
+        rng (np.random.Generator): The random generator.
+        n (int): The number of points.
+        bounds (tuple): (min_lat, max_lat, min_lon, max_lon) in degrees.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The latitudes and longitudes.
+    """
+
+    min_lat, max_lat, min_lon, max_lon = bounds
+
+    # uniform in sin(lat), so the density is uniform over the area
+    sin_lat = rng.uniform(np.sin(np.radians(min_lat)), np.sin(np.radians(max_lat)), n)
+    lat = np.degrees(np.arcsin(sin_lat))
+
+    width = (max_lon - min_lon) % 360 or 360
+    lon = (min_lon + rng.uniform(0, width, n) + 180) % 360 - 180
+
+    return lat, lon
+
+
+def make_uniform_points(n, seed=None):
+    """Generates points spread uniformly over the Earth.
+
+    Args:
+        n (int): The number of points.
+        seed (int | np.random.Generator, optional): The random seed. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The points, with the columns "id", "lat" and "lon".
+    """
+    return make_bounded_points(n, bounds=(-90, 90, -180, 180), seed=seed)
+
+
+def make_bounded_points(n, bounds, seed=None):
+    """Generates points spread uniformly over a latitude and longitude box.
+
+    Args:
+        n (int): The number of points.
+        bounds (tuple): (min_lat, max_lat, min_lon, max_lon) in degrees.
+            A min_lon above max_lon gives a box across the antimeridian.
+        seed (int | np.random.Generator, optional): The random seed. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The points, with the columns "id", "lat" and "lon".
+    """
+    return _points_df(*_bounded_coords(np.random.default_rng(seed), n, bounds))
+
+
+def make_country_points(n, country="brazil", seed=None):
+    """Generates points spread uniformly over a country's bounding box.
+
+    Args:
+        n (int): The number of points.
+        country (str, optional): A key of COUNTRY_BOUNDS. Defaults to "brazil".
+        seed (int | np.random.Generator, optional): The random seed. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The points, with the columns "id", "lat" and "lon".
+    """
+    return make_bounded_points(n, bounds=COUNTRY_BOUNDS[country], seed=seed)
+
+
+def make_clustered_points(n, n_clusters=100, scale_km=10.0, bounds=None, seed=None):
+    """Generates points in Gaussian clusters, like addresses around cities.
+
+    The cluster centers are spread uniformly and their sizes vary like city sizes,
+    following a log-normal distribution.
+
+    Args:
+        n (int): The number of points.
+        n_clusters (int, optional): The number of clusters. Defaults to 100.
+        scale_km (float, optional): The standard deviation of each cluster in kms.
+            Defaults to 10.0.
+        bounds (tuple, optional): A box to spread the centers over,
+            see `make_bounded_points`.
+            If None is passed, spreads them over the Earth.
+            Defaults to None.
+        seed (int | np.random.Generator, optional): The random seed. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The points, with the columns "id", "lat" and "lon".
+    """
+
+    rng = np.random.default_rng(seed)
+
+    center_lat, center_lon = _bounded_coords(
+        rng, n_clusters, (-90, 90, -180, 180) if bounds is None else bounds
+    )
+    weights = rng.lognormal(sigma=1.5, size=n_clusters)
+    cluster = rng.choice(n_clusters, size=n, p=weights / weights.sum())
+
+    scale_deg = scale_km / _KM_PER_DEGREE
+    cos_lat = np.maximum(np.cos(np.radians(center_lat[cluster])), 0.01)
+
+    lat = np.clip(center_lat[cluster] + rng.normal(0, scale_deg, n), -90, 90)
+    lon = center_lon[cluster] + rng.normal(0, 1, n) * scale_deg / cos_lat
+    lon = (lon + 180) % 360 - 180
+
+    return _points_df(lat, lon)
+
+
+def make_duplicate_points(n, n_unique=100, seed=None):
+    """Generates points drawn from a few locations, so many share coordinates.
+
+    Points with the same coordinates are at the same distance from every other point,
+    which exercises the handling of duplicates and ties.
+
+    Args:
+        n (int): The number of points.
+        n_unique (int, optional): The number of distinct locations. Defaults to 100.
+        seed (int | np.random.Generator, optional): The random seed. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The points, with the columns "id", "lat" and "lon".
+    """
+
+    rng = np.random.default_rng(seed)
+
+    unique_lat, unique_lon = _bounded_coords(rng, n_unique, (-90, 90, -180, 180))
+    location = rng.integers(n_unique, size=n)
+
+    return _points_df(unique_lat[location], unique_lon[location])
+
+
+def make_poll_aid_data(n_poll, n_aid, distribution="clustered", seed=None):
+    """Generates a synthetic dataset shaped like `load_poll_aid_data`, at any size.
+
+    Args:
+        n_poll (int): The number of polling locations.
+        n_aid (int): The number of aid locations.
+        distribution (str, optional): How the points are spread,
+            "uniform", "clustered", "duplicates" or a key of COUNTRY_BOUNDS.
+            Defaults to "clustered".
+        seed (int | np.random.Generator, optional): The random seed. Defaults to None.
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: (polling locations, aid locations)
+    """
+
+    rng = np.random.default_rng(seed)
+
+    generators = {
+        "uniform": make_uniform_points,
+        "clustered": make_clustered_points,
+        "duplicates": make_duplicate_points,
+    }
+
+    def make_points(n):
+        if distribution in generators:
+            return generators[distribution](n, seed=rng)
+        return make_country_points(n, country=distribution, seed=rng)
+
+    poll_df = make_points(n_poll).rename(columns={"id": "local_id"})
+    poll_df["local_id"] += 1
+
+    aid_df = make_points(n_aid)
+    aid_df = pd.DataFrame(
+        {
+            "project_id_aid": "p" + (aid_df["id"] + 1).astype(str),
+            "lat_aid": aid_df["lat"],
+            "long_aid": aid_df["lon"],
+        }
+    )
+
+    return poll_df, aid_df
@@ -0,0 +1,41 @@
+"""Fixtures shared by the tests."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def _random_points(seed, n_left, n_right):
+    """Makes random left and right DataFrames.
+
+    The right ids include the seed, so the points of different seeds can be
+    combined.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    left_df = pd.DataFrame(
+        {
+            "left_id": np.arange(n_left),
+            "lat": rng.uniform(-80, 80, n_left),
+            "lon": rng.uniform(-180, 180, n_left),
+        }
+    )
+
+    right_df = pd.DataFrame(
+        {
+            "right_id": [f"r{seed}_{i}" for i in range(n_right)],
+            "lat": rng.uniform(-80, 80, n_right),
+            "lon": rng.uniform(-180, 180, n_right),
+            "other": rng.normal(size=n_right),
+        }
+    )
+
+    return left_df, right_df
+
+
+@pytest.fixture(name="random_points")
+def fixture_random_points():
+    """Returns a function making random left and right DataFrames from a seed."""
+
+    return _random_points
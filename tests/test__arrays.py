@@ -0,0 +1,84 @@
+"""Tests _arrays.py"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from georelate import (
+    GeoIndex,
+    design_matrix,
+    distance_matrix,
+    distance_table,
+    knn_arrays,
+    radius_arrays,
+)
+
+
+def _random_coords(seed, n):
+    """Makes random latitudes and longitudes."""
+
+    rng = np.random.default_rng(seed)
+
+    return rng.uniform(-80, 80, n), rng.uniform(-180, 180, n)
+
+
+@pytest.mark.parametrize("engine", ["cross", "kdtree"])
+def test_knn_arrays(engine):
+    """Tests knn_arrays finds the same neighbours as design_matrix."""
+
+    if engine == "kdtree":
+        pytest.importorskip("scipy")
+
+    left_lat, left_lon = _random_coords(seed=0, n=30)
+    right_lat, right_lon = _random_coords(seed=1, n=40)
+
+    indices, distances = knn_arrays(
+        left_lat, left_lon, right_lat, right_lon, k=3, engine=engine
+    )
+
+    expected = design_matrix(
+        pd.DataFrame({"lat": left_lat, "lon": left_lon}),
+        pd.DataFrame({"lat": right_lat, "lon": right_lon}),
+        k_closest=3,
+        engine=engine,
+    )
+
+    assert indices.shape == distances.shape == (30, 3)
+    for j in range(3):
+        np.testing.assert_array_equal(indices[:, j], expected[f"index_{j + 1}_closest"])
+        np.testing.assert_array_equal(
+            distances[:, j], expected[f"distance_{j + 1}_closest"]
+        )
+
+    index = GeoIndex(pd.DataFrame({"lat": right_lat, "lon": right_lon}), engine=engine)
+    index_indices, index_distances = index.knn_arrays(left_lat, left_lon, k=3)
+    np.testing.assert_array_equal(index_indices, indices)
+    np.testing.assert_array_equal(index_distances, distances)
+
+    with pytest.raises(ValueError, match="k must be"):
+        knn_arrays(left_lat, left_lon, right_lat, right_lon, k=41)
+    with pytest.raises(ValueError, match="same length"):
+        knn_arrays(left_lat, left_lon[:-1], right_lat, right_lon, k=1)
+
+
+def test_radius_arrays_and_distance_matrix():
+    """Tests radius_arrays keeps the pairs of the distance matrix within the radius."""
+
+    left_lat, left_lon = _random_coords(seed=0, n=30)
+    right_lat, right_lon = _random_coords(seed=1, n=40)
+
+    matrix = distance_matrix(left_lat, left_lon, right_lat, right_lon)
+    table = distance_table(
+        pd.DataFrame({"lat": left_lat, "lon": left_lon}),
+        pd.DataFrame({"lat": right_lat, "lon": right_lon}),
+    )
+    np.testing.assert_array_equal(matrix.ravel(), table["distance"])
+
+    left_positions, right_positions, distances = radius_arrays(
+        left_lat, left_lon, right_lat, right_lon, radius_km=3000
+    )
+
+    expected_left, expected_right = np.nonzero(matrix <= 3000)
+    assert set(zip(left_positions, right_positions)) == set(
+        zip(expected_left, expected_right)
+    )
+    np.testing.assert_array_equal(distances, matrix[left_positions, right_positions])
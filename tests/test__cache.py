@@ -0,0 +1,119 @@
+"""Tests _cache.py"""
+
+import pandas as pd
+import pytest
+from georelate import ResultCache, design_matrix, distance_table
+
+
+def test_result_cache_hits_and_misses(random_points):
+    """Tests results are reused only for the same content and arguments."""
+
+    left_df, right_df = random_points(seed=0, n_left=20, n_right=30)
+    cache = ResultCache()
+
+    expected = design_matrix(left_df, right_df, right_id="right_id", k_closest=2)
+
+    for _ in range(2):
+        result = design_matrix(
+            left_df, right_df, right_id="right_id", k_closest=2, cache=cache
+        )
+        pd.testing.assert_frame_equal(result, expected)
+
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # a copy with the same content hits, changed content or arguments miss
+    design_matrix(
+        left_df.copy(), right_df.copy(), right_id="right_id", k_closest=2, cache=cache
+    )
+    design_matrix(left_df, right_df, right_id="right_id", k_closest=3, cache=cache)
+    changed_df = right_df.assign(other=right_df["other"] + 1)
+    design_matrix(left_df, changed_df, right_id="right_id", k_closest=2, cache=cache)
+
+    assert (cache.hits, cache.misses) == (2, 3)
+
+    # distance_table only depends on the ids and coordinates
+    distance_table(left_df, right_df, right_id="right_id", cache=cache)
+    distance_table(left_df, changed_df, right_id="right_id", cache=cache)
+
+    assert (cache.hits, cache.misses) == (3, 4)
+
+
+def test_result_cache_returns_copies(random_points):
+    """Tests changing a returned result doesn't change the cached one."""
+
+    left_df, right_df = random_points(seed=0, n_left=5, n_right=5)
+    cache = ResultCache()
+
+    result = distance_table(left_df, right_df, cache=cache)
+    result["distance"] = 0.0
+
+    assert (distance_table(left_df, right_df, cache=cache)["distance"] > 0).any()
+
+
+def test_result_cache_evicts_least_recently_used(random_points):
+    """Tests results are evicted once they exceed max_bytes."""
+
+    left_df, right_df = random_points(seed=0, n_left=10, n_right=10)
+    n_bytes = distance_table(left_df, right_df).memory_usage(deep=True).sum()
+
+    cache = ResultCache(max_bytes=int(n_bytes * 2.5))
+    for max_distance_km in [None, 1e5, 2e5]:
+        distance_table(left_df, right_df, max_distance_km=max_distance_km, cache=cache)
+    assert len(cache) == 2
+    assert cache.n_bytes <= cache.max_bytes
+
+    # the first result was evicted, the last one is kept
+    distance_table(left_df, right_df, max_distance_km=2e5, cache=cache)
+    distance_table(left_df, right_df, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_result_cache_index_names(random_points):
+    """Tests renaming the index, which names the id column, isn't a hit."""
+
+    left_df, right_df = random_points(seed=0, n_left=5, n_right=5)
+    cache = ResultCache()
+
+    design_matrix(left_df, right_df, right_id="right_id", k_closest=2, cache=cache)
+    distance_table(left_df, right_df, right_id="right_id", cache=cache)
+
+    renamed_df = left_df.rename_axis("site")
+    result = design_matrix(
+        renamed_df, right_df, right_id="right_id", k_closest=2, cache=cache
+    )
+    table = distance_table(renamed_df, right_df, right_id="right_id", cache=cache)
+
+    assert (cache.hits, cache.misses) == (0, 4)
+    pd.testing.assert_frame_equal(
+        result,
+        design_matrix(renamed_df, right_df, right_id="right_id", k_closest=2),
+    )
+    assert "site" in table.columns
+
+
+def test_result_cache_on_disk(tmp_path, random_points):
+    """Tests results stored on disk are found by another cache."""
+
+    pytest.importorskip("pyarrow")
+
+    left_df, right_df = random_points(seed=0, n_left=10, n_right=10)
+
+    kwargs = {"right_id": "right_id", "k_closest": 2, "radius_km": 3000}
+    expected = design_matrix(
+        left_df, right_df, **kwargs, cache=ResultCache(directory=tmp_path)
+    )
+
+    cache = ResultCache(directory=tmp_path)
+    result = design_matrix(left_df, right_df, **kwargs, cache=cache)
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert (cache.hits, cache.misses) == (1, 0)
+
+    # only the most recent file fits
+    n_bytes = next(tmp_path.glob("*.parquet")).stat().st_size
+    cache = ResultCache(directory=tmp_path, max_disk_bytes=int(n_bytes * 1.5))
+    design_matrix(left_df, right_df, right_id="right_id", k_closest=3, cache=cache)
+    assert len(list(tmp_path.glob("*.parquet"))) == 1
+
+    cache.clear()
+    assert not list(tmp_path.glob("*.parquet"))
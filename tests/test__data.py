@@ -1,5 +1,14 @@
 """Tests georelate.data"""
-from georelate.data import load_poll_aid_data
+import pandas as pd
+from georelate.data import (
+    COUNTRY_BOUNDS,
+    load_poll_aid_data,
+    make_clustered_points,
+    make_country_points,
+    make_duplicate_points,
+    make_poll_aid_data,
+    make_uniform_points,
+)
 
 
 def test_load_poll_aid_data():
@@ -9,3 +18,51 @@ def test_load_poll_aid_data():
 
     print(poll_df)
     print(aid_df)
+
+
+def test_generators_are_seeded():
+    """Tests the generators give the same points for the same seed."""
+
+    for make_points in [
+        make_uniform_points,
+        make_clustered_points,
+        make_duplicate_points,
+        make_country_points,
+    ]:
+        points_df = make_points(1000, seed=0)
+
+        assert list(points_df.columns) == ["id", "lat", "lon"]
+        assert len(points_df) == 1000
+        assert points_df["lat"].between(-90, 90).all()
+        assert points_df["lon"].between(-180, 180).all()
+        pd.testing.assert_frame_equal(points_df, make_points(1000, seed=0))
+
+
+def test_make_country_points_bounds():
+    """Tests country points stay in the bounding box, including across the antimeridian."""
+
+    fiji_df = make_country_points(1000, country="fiji", seed=0)
+    min_lat, max_lat, min_lon, max_lon = COUNTRY_BOUNDS["fiji"]
+
+    assert fiji_df["lat"].between(min_lat, max_lat).all()
+    assert ((fiji_df["lon"] >= min_lon) | (fiji_df["lon"] <= max_lon)).all()
+    assert (fiji_df["lon"] < 0).any() and (fiji_df["lon"] > 0).any()
+
+
+def test_make_duplicate_points():
+    """Tests duplicate points only use the given number of locations."""
+
+    points_df = make_duplicate_points(1000, n_unique=10, seed=0)
+
+    assert len(points_df.drop_duplicates(["lat", "lon"])) <= 10
+
+
+def test_make_poll_aid_data():
+    """Tests the synthetic dataset has the columns of load_poll_aid_data."""
+
+    poll_df, aid_df = make_poll_aid_data(n_poll=50, n_aid=20, seed=0)
+    example_poll_df, example_aid_df = load_poll_aid_data()
+
+    assert list(poll_df.columns) == list(example_poll_df.columns)
+    assert list(aid_df.columns) == list(example_aid_df.columns)
+    assert (len(poll_df), len(aid_df)) == (50, 20)
@@ -3,7 +3,15 @@
 # pylint:disable=duplicate-code
 import numpy as np
 import pandas as pd
-from georelate._distance import haversine, distance_table, design_matrix
+import pytest
+import georelate._distance as distance_module
+from georelate._distance import (
+    haversine,
+    distance_table,
+    distance_table_iter,
+    design_matrix,
+)
+from georelate._metrics import get_metric
 
 
 def test_haversine():
@@ -290,3 +298,599 @@ def test_design_matrix_some_options_1():
     }
 
     assert all_expected_columns.issubset(set(result_df.columns))
+
+
+def test_design_matrix_kdtree_engine(random_points):
+    """Tests that the kdtree engine matches the cross engine."""
+
+    pytest.importorskip("scipy")
+
+    left_df, right_df = random_points(seed=0, n_left=50, n_right=30)
+
+    kwargs = {
+        "left": left_df,
+        "right": right_df,
+        "left_id": "left_id",
+        "right_id": "right_id",
+        "k_closest": 4,
+    }
+
+    expected_df = design_matrix(**kwargs)
+    result_df = design_matrix(**kwargs, engine="kdtree")
+
+    pd.testing.assert_frame_equal(result_df, expected_df, check_dtype=False)
+
+
+def test_design_matrix_unknown_engine(random_points):
+    """Tests that an unknown engine raises a ValueError."""
+
+    left_df, right_df = random_points(seed=0, n_left=2, n_right=3)
+
+    with pytest.raises(ValueError, match="Unknown engine"):
+        design_matrix(left=left_df, right=right_df, k_closest=1, engine="nope")
+
+
+def test_distance_table_chunk_size(random_points):
+    """Tests that chunking the distance table does not change it."""
+
+    left_df, right_df = random_points(seed=1, n_left=23, n_right=7)
+
+    expected_df = distance_table(left=left_df, right=right_df)
+    result_df = distance_table(left=left_df, right=right_df, chunk_size=5)
+
+    pd.testing.assert_frame_equal(result_df, expected_df)
+
+
+def test_design_matrix_chunk_size(random_points):
+    """Tests that chunking the design matrix does not change it."""
+
+    left_df, right_df = random_points(seed=2, n_left=23, n_right=7)
+
+    kwargs = {
+        "left": left_df,
+        "right": right_df,
+        "left_id": "left_id",
+        "right_id": "right_id",
+        "k_closest": 3,
+    }
+
+    expected_df = design_matrix(**kwargs)
+    result_df = design_matrix(**kwargs, chunk_size=4)
+
+    pd.testing.assert_frame_equal(result_df, expected_df, check_dtype=False)
+
+
+def test_n_jobs(random_points):
+    """Tests that running in threads keeps the results and their order."""
+
+    left_df, right_df = random_points(seed=3, n_left=31, n_right=9)
+
+    pd.testing.assert_frame_equal(
+        distance_table(left=left_df, right=right_df, chunk_size=4, n_jobs=3),
+        distance_table(left=left_df, right=right_df),
+    )
+
+    kwargs = {
+        "left": left_df,
+        "right": right_df,
+        "left_id": "left_id",
+        "right_id": "right_id",
+        "k_closest": 2,
+    }
+
+    pd.testing.assert_frame_equal(
+        design_matrix(**kwargs, n_jobs=-1),
+        design_matrix(**kwargs),
+        check_dtype=False,
+    )
+
+    with pytest.raises(ValueError, match="n_jobs"):
+        design_matrix(**kwargs, n_jobs=0)
+
+
+@pytest.mark.parametrize("engine", ["cross", "kdtree"])
+def test_design_matrix_radius_km(engine, random_points):
+    """Tests the radius mode against filtering the distance table."""
+
+    if engine == "kdtree":
+        pytest.importorskip("scipy")
+
+    left_df, right_df = random_points(seed=4, n_left=40, n_right=60)
+
+    # points near the poles and the antimeridian
+    left_df.loc[:3, "lat"] = [89.5, -89.5, 10.0, -10.0]
+    left_df.loc[:3, "lon"] = [0.0, 90.0, 179.9, -179.9]
+    right_df.loc[:3, "lat"] = [89.9, -89.9, 10.1, -10.1]
+    right_df.loc[:3, "lon"] = [180.0, -90.0, -179.9, 179.9]
+
+    radius_km = 1500
+
+    distance_df = distance_table(
+        left=left_df, right=right_df, left_id="left_id", right_id="right_id"
+    )
+    expected_df = (
+        distance_df.loc[lambda df_: df_["distance"] <= radius_km]
+        .groupby("left_id")["distance"]
+        .agg(["count", "min", "mean"])
+        .reindex(left_df["left_id"])
+    )
+
+    result_df = design_matrix(
+        left=left_df,
+        right=right_df,
+        left_id="left_id",
+        right_id="right_id",
+        radius_km=radius_km,
+        engine=engine,
+        chunk_size=7,
+    )
+
+    assert list(result_df.columns) == [
+        "left_id",
+        "count_within_radius",
+        "min_distance_within_radius",
+        "mean_distance_within_radius",
+    ]
+    np.testing.assert_array_equal(
+        result_df["count_within_radius"], expected_df["count"].fillna(0)
+    )
+    np.testing.assert_allclose(
+        result_df["min_distance_within_radius"], expected_df["min"]
+    )
+    np.testing.assert_allclose(
+        result_df["mean_distance_within_radius"], expected_df["mean"]
+    )
+
+
+def test_distance_table_suffixes(random_points):
+    """Tests the coordinates are found whichever side keeps its column names."""
+
+    left_df, right_df = random_points(seed=9, n_left=4, n_right=3)
+
+    result = distance_table(
+        left_df,
+        right_df,
+        left_id="left_id",
+        right_id="right_id",
+        suffixes=(None, "_r"),
+    )
+
+    assert list(result.columns) == [
+        "left_id",
+        "lat",
+        "lon",
+        "right_id",
+        "lat_r",
+        "lon_r",
+        "distance",
+    ]
+    np.testing.assert_allclose(
+        result["distance"],
+        haversine(result["lat"], result["lon"], result["lat_r"], result["lon_r"]),
+    )
+
+
+def test_distance_table_iter(random_points):
+    """Tests that the chunks concatenate to the distance table."""
+
+    left_df, right_df = random_points(seed=5, n_left=17, n_right=6)
+
+    chunk_dfs = list(distance_table_iter(left=left_df, right=right_df, chunk_size=5))
+
+    assert [len(chunk_df) for chunk_df in chunk_dfs] == [30, 30, 30, 12]
+    pd.testing.assert_frame_equal(
+        pd.concat(chunk_dfs, ignore_index=True),
+        distance_table(left=left_df, right=right_df),
+    )
+
+
+def test_distance_table_max_distance_km(random_points):
+    """Tests filtering the distance table by distance."""
+
+    left_df, right_df = random_points(seed=6, n_left=17, n_right=6)
+
+    distance_df = distance_table(left=left_df, right=right_df)
+    expected_df = distance_df.loc[distance_df["distance"] <= 5000].reset_index(
+        drop=True
+    )
+
+    pd.testing.assert_frame_equal(
+        distance_table(left=left_df, right=right_df, max_distance_km=5000),
+        expected_df,
+    )
+    pd.testing.assert_frame_equal(
+        pd.concat(
+            distance_table_iter(
+                left=left_df, right=right_df, chunk_size=3, max_distance_km=5000
+            ),
+            ignore_index=True,
+        ),
+        expected_df,
+    )
+
+
+def _count_calls(monkeypatch, module, name, calls):
+    """Wraps a function in a module to record each call in calls."""
+
+    func = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        calls.append(name)
+        return func(*args, **kwargs)
+
+    monkeypatch.setattr(module, name, wrapper)
+
+
+@pytest.mark.parametrize("engine_kwargs", [{}, {"chunk_size": 4}])
+def test_design_matrix_top_k_runs_once(monkeypatch, engine_kwargs, random_points):
+    """Tests that the top k stage runs exactly once per design matrix."""
+
+    left_df, right_df = random_points(seed=7, n_left=10, n_right=5)
+
+    top_k_calls = []
+    _count_calls(monkeypatch, distance_module, "knn_blocked", top_k_calls)
+
+    design_matrix(left=left_df, right=right_df, k_closest=2, **engine_kwargs)
+
+    assert len(top_k_calls) == 1
+
+
+def test_design_matrix_without_k_closest(monkeypatch, random_points):
+    """Tests that no distances are computed when nothing is requested."""
+
+    left_df, right_df = random_points(seed=7, n_left=10, n_right=5)
+
+    distance_calls = []
+    _count_calls(monkeypatch, distance_module, "distance_table", distance_calls)
+    _count_calls(monkeypatch, distance_module, "knn_blocked", distance_calls)
+
+    result_df = design_matrix(left=left_df, right=right_df, left_id="left_id")
+
+    assert not distance_calls
+    pd.testing.assert_frame_equal(result_df, left_df.drop(columns=["lat", "lon"]))
+
+
+def test_design_matrix_column_layout():
+    """Tests the order and values of the columns for the k closest observations."""
+
+    left_df = pd.DataFrame({"id": [1, 2], "lat": [0.0, 1.0], "lon": [0.0, 1.0]})
+    right_df = pd.DataFrame(
+        {
+            "id": ["a", "b", "c"],
+            "lat": [1.0, 0.0, 5.0],
+            "lon": [1.0, 0.1, 5.0],
+            "distance": [7, 8, 9],
+        }
+    )
+
+    result_df = design_matrix(
+        left=left_df, right=right_df, left_id="id", right_id="id", k_closest=2
+    )
+
+    assert list(result_df.columns) == [
+        "id",
+        "id_left",
+        "id_right_1_closest",
+        "distance_1_closest_x",
+        "id_right_2_closest",
+        "distance_2_closest_x",
+        "id_1_closest",
+        "distance_1_closest_y",
+        "id_2_closest",
+        "distance_2_closest_y",
+    ]
+    assert list(result_df["id_right_1_closest"]) == ["b", "a"]
+    assert list(result_df["id_right_2_closest"]) == ["a", "b"]
+    assert list(result_df["distance_1_closest_y"]) == [8, 7]
+
+
+def test_haversine_float32():
+    """Tests the documented error bounds of computing in float32."""
+
+    rng = np.random.default_rng(8)
+    n_points = 100_000
+
+    p1_lat = rng.uniform(-90, 90, n_points)
+    p1_lon = rng.uniform(-180, 180, n_points)
+    # half of the second points are near the first points
+    p2_lat = np.concatenate(
+        [
+            rng.uniform(-90, 90, n_points // 2),
+            np.clip(
+                p1_lat[n_points // 2 :] + rng.normal(0, 0.05, n_points // 2), -90, 90
+            ),
+        ]
+    )
+    p2_lon = np.concatenate(
+        [
+            rng.uniform(-180, 180, n_points // 2),
+            p1_lon[n_points // 2 :] + rng.normal(0, 0.05, n_points // 2),
+        ]
+    )
+
+    expected = haversine(p1_lat, p1_lon, p2_lat, p2_lon)
+    result = haversine(p1_lat, p1_lon, p2_lat, p2_lon, dtype=np.float32)
+
+    assert result.dtype == np.float32
+
+    error = np.abs(result - expected)
+
+    assert error[expected <= 1_000].max() < 0.01
+    assert error[expected <= 19_000].max() < 0.1
+    assert error.max() < 3
+
+
+def test_design_matrix_float32(random_points):
+    """Tests that computing in float32 finds the same neighbours."""
+
+    left_df, right_df = random_points(seed=9, n_left=50, n_right=20)
+
+    kwargs = {
+        "left": left_df,
+        "right": right_df,
+        "left_id": "left_id",
+        "right_id": "right_id",
+        "k_closest": 3,
+    }
+
+    expected_df = design_matrix(**kwargs)
+    result_df = design_matrix(**kwargs, dtype=np.float32)
+
+    assert result_df["distance_1_closest"].dtype == np.float32
+    pd.testing.assert_frame_equal(
+        result_df, expected_df, check_dtype=False, rtol=1e-5, atol=0.01
+    )
+
+
+def test_design_matrix_partitions(tmp_path, random_points):
+    """Tests design_matrix processes partitioned left DataFrames one at a time."""
+
+    left_df, right_df = random_points(seed=0, n_left=30, n_right=20)
+    partitions = [left_df.iloc[:10], left_df.iloc[10:25], left_df.iloc[25:]]
+
+    kwargs = {
+        "left_id": "left_id",
+        "right_id": "right_id",
+        "k_closest": 2,
+        "radius_km": 2000,
+    }
+    expected = design_matrix(left_df, right_df, **kwargs)
+
+    results = design_matrix(iter(partitions), right_df, **kwargs)
+    pd.testing.assert_frame_equal(pd.concat(list(results), ignore_index=True), expected)
+
+    with pytest.raises(ValueError, match="left_id"):
+        design_matrix(tmp_path / "left", right_df, right_id="right_id")
+
+    # from a directory of Parquet files to another one
+    pytest.importorskip("pyarrow")
+
+    (tmp_path / "left").mkdir()
+    for number, partition in enumerate(partitions):
+        partition.to_parquet(tmp_path / "left" / f"{number}.parquet", index=False)
+
+    paths = design_matrix(
+        tmp_path / "left", right_df, **kwargs, output=tmp_path / "output"
+    )
+
+    assert len(paths) == 3
+    pd.testing.assert_frame_equal(
+        pd.concat(map(pd.read_parquet, paths), ignore_index=True), expected
+    )
+
+
+def _grouped_points():
+    """Makes random left and right DataFrames with country and year keys."""
+
+    rng = np.random.default_rng(7)
+
+    def points(prefix, n):
+        return pd.DataFrame(
+            {
+                "id": [f"{prefix}{i}" for i in range(n)],
+                "lat": rng.uniform(-20, 20, n),
+                "lon": rng.uniform(-20, 20, n),
+                "country": rng.choice(["a", "b", "c"], n),
+                "year": rng.choice([2018, 2022], n),
+            }
+        )
+
+    return points("l", 40), points("r", 50)
+
+
+@pytest.mark.parametrize("n_jobs", [None, 2])
+def test_distance_table_by(n_jobs):
+    """Tests by only pairs the observations sharing a key."""
+
+    left_df, right_df = _grouped_points()
+
+    result = distance_table(
+        left_df,
+        right_df,
+        left_id="id",
+        right_id="id",
+        by=["country", "year"],
+        n_jobs=n_jobs,
+    )
+    expected = (
+        distance_table(left_df, right_df, left_id="id", right_id="id")
+        .merge(left_df[["id", "country", "year"]], left_on="id_left", right_on="id")
+        .merge(
+            right_df[["id", "country", "year"]],
+            left_on="id_right",
+            right_on="id",
+            suffixes=("", "_r"),
+        )
+        .query("country == country_r and year == year_r")
+    )
+
+    assert list(result.columns) == [
+        "id_left",
+        "lat_left",
+        "lon_left",
+        "id_right",
+        "lat_right",
+        "lon_right",
+        "distance",
+    ]
+    pd.testing.assert_frame_equal(
+        result.sort_values(["id_left", "id_right"], ignore_index=True),
+        expected[result.columns].sort_values(
+            ["id_left", "id_right"], ignore_index=True
+        ),
+    )
+
+
+@pytest.mark.parametrize("engine, n_jobs", [("cross", None), ("kdtree", 2)])
+def test_design_matrix_by(engine, n_jobs):
+    """Tests by searches each left row's key only, keeping the order of left."""
+
+    if engine == "kdtree":
+        pytest.importorskip("scipy")
+
+    left_df, right_df = _grouped_points()
+
+    result = design_matrix(
+        left_df,
+        right_df,
+        left_id="id",
+        right_id="id",
+        k_closest=2,
+        radius_km=500,
+        engine=engine,
+        n_jobs=n_jobs,
+        by="country",
+    )
+
+    assert result["id"].tolist() == left_df["id"].tolist()
+
+    for country, left_group in left_df.groupby("country"):
+        expected = design_matrix(
+            left_group,
+            right_df[right_df["country"] == country],
+            left_id="id",
+            right_id="id",
+            k_closest=2,
+            radius_km=500,
+        )
+        pd.testing.assert_frame_equal(
+            result[result["country"] == country].reset_index(drop=True),
+            expected.reset_index(drop=True),
+        )
+
+
+def test_design_matrix_by_missing_key():
+    """Tests keys without enough right rows fail with k_closest, and not with radius_km."""
+
+    left_df, right_df = _grouped_points()
+    right_df = right_df[right_df["country"] != "b"]
+
+    with pytest.raises(ValueError, match="'b'"):
+        design_matrix(
+            left_df, right_df, left_id="id", right_id="id", k_closest=1, by="country"
+        )
+
+    result = design_matrix(
+        left_df, right_df, left_id="id", right_id="id", radius_km=500, by="country"
+    )
+    assert (result.loc[left_df["country"] == "b", "count_within_radius"] == 0).all()
+
+
+@pytest.mark.parametrize("metric", ["equirectangular", "vincenty"])
+def test_distance_table_metric(metric, random_points):
+    """Tests the distance table computes the distances with the metric."""
+
+    left_df, right_df = random_points(seed=8, n_left=12, n_right=9)
+
+    result = distance_table(left_df, right_df, metric=metric, chunk_size=5)
+    expected = distance_table(left_df, right_df)
+
+    pd.testing.assert_frame_equal(
+        result.drop(columns="distance"), expected.drop(columns="distance")
+    )
+    np.testing.assert_allclose(
+        result["distance"],
+        get_metric(metric)(
+            result["lat_left"],
+            result["lon_left"],
+            result["lat_right"],
+            result["lon_right"],
+        ),
+    )
+
+    with pytest.raises(ValueError, match="metric"):
+        distance_table(left_df, right_df, metric="manhattan")
+
+
+@pytest.mark.parametrize("engine", ["cross", "kdtree", "grid"])
+@pytest.mark.parametrize("metric", ["equirectangular", "vincenty"])
+def test_design_matrix_metric(engine, metric, random_points):
+    """Tests the design matrix ranks and summarizes with the metric's distances."""
+
+    if engine == "kdtree":
+        pytest.importorskip("scipy")
+
+    left_df, right_df = random_points(seed=9, n_left=40, n_right=300)
+    radius_km = 800
+
+    result = design_matrix(
+        left_df,
+        right_df,
+        left_id="left_id",
+        right_id="right_id",
+        k_closest=3,
+        radius_km=radius_km,
+        engine=engine,
+        metric=metric,
+    )
+
+    distances = distance_table(
+        left_df, right_df, left_id="left_id", right_id="right_id", metric=metric
+    )
+    closest = (
+        distances.sort_values(["left_id", "distance"], kind="stable", ignore_index=True)
+        .groupby("left_id")
+        .head(3)
+    )
+    within = (
+        distances.loc[lambda df_: df_["distance"] <= radius_km]
+        .groupby("left_id")["distance"]
+        .agg(["count", "min", "mean"])
+        .reindex(left_df["left_id"])
+    )
+
+    np.testing.assert_array_equal(
+        result[[f"right_id_{j}_closest" for j in range(1, 4)]].to_numpy().ravel(),
+        closest["right_id"],
+    )
+    np.testing.assert_allclose(
+        result[[f"distance_{j}_closest" for j in range(1, 4)]].to_numpy().ravel(),
+        closest["distance"],
+    )
+    np.testing.assert_array_equal(
+        result["count_within_radius"], within["count"].fillna(0)
+    )
+    np.testing.assert_allclose(result["mean_distance_within_radius"], within["mean"])
+
+
+@pytest.mark.parametrize("engine", ["cross", "kdtree", "grid"])
+def test_design_matrix_non_finite_coordinates(engine):
+    """Tests points with NaN coordinates don't get invented neighbours."""
+
+    if engine == "kdtree":
+        pytest.importorskip("scipy")
+
+    left_df = pd.DataFrame({"lat": [np.nan, 1.0], "lon": [1.0, 1.0]})
+    right_df = pd.DataFrame({"lat": [0.0, np.nan, 2.0], "lon": [0.0, 1.0, 2.0]})
+
+    with pytest.raises(ValueError, match="finite"):
+        design_matrix(left_df, right_df.iloc[[0, 2]], k_closest=1, engine=engine)
+
+    with pytest.raises(ValueError, match="finite"):
+        design_matrix(left_df.iloc[1:], right_df, k_closest=3, engine=engine)
+
+    # radius queries have nothing to invent, points with NaN coordinates have no pairs,
+    # while scipy's k-d tree rejects them
+    if engine == "cross":
+        result = design_matrix(left_df, right_df.iloc[[0, 2]], radius_km=500)
+        assert result["count_within_radius"].tolist() == [0, 2]
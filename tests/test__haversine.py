@@ -0,0 +1,44 @@
+"""Tests _haversine.py"""
+
+import numpy as np
+from georelate._haversine import haversine, haversine_prepared, prepare_points
+
+
+def test_haversine_prepared():
+    """Tests that the prepared kernel matches haversine and fills the buffers."""
+
+    rng = np.random.default_rng(0)
+
+    p1_lat, p1_lon = rng.uniform(-90, 90, 30), rng.uniform(-180, 180, 30)
+    p2_lat, p2_lon = rng.uniform(-90, 90, 20), rng.uniform(-180, 180, 20)
+
+    expected = haversine(
+        p1_lat=p1_lat[:, np.newaxis],
+        p1_lon=p1_lon[:, np.newaxis],
+        p2_lat=p2_lat[np.newaxis, :],
+        p2_lon=p2_lon[np.newaxis, :],
+    )
+
+    out = np.empty((30, 20))
+    work = np.empty((30, 20))
+
+    result = haversine_prepared(
+        prepare_points(p1_lat, p1_lon).take((slice(None), np.newaxis)),
+        prepare_points(p2_lat, p2_lon).take(np.newaxis),
+        out=out,
+        work=work,
+    )
+
+    assert result is out
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_haversine_prepared_pairs():
+    """Tests the prepared kernel on pairs of points."""
+
+    # austin and houston
+    result = haversine_prepared(
+        prepare_points([30.2672], [97.7431]), prepare_points([29.7604], [95.3698])
+    )
+
+    assert result.round(0) == [235]
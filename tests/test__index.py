@@ -0,0 +1,131 @@
+"""Tests _index.py"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from georelate import GeoIndex, design_matrix, distance_table
+
+
+@pytest.mark.parametrize("engine", ["cross", "kdtree", "grid"])
+def test_geo_index_design_matrix(engine, random_points):
+    """Tests the index gives the same design matrix for several left DataFrames."""
+
+    if engine == "kdtree":
+        pytest.importorskip("scipy")
+
+    _, right_df = random_points(seed=0, n_left=0, n_right=60)
+    index = GeoIndex(right_df, right_id="right_id", engine=engine)
+
+    for seed in range(1, 4):
+        left_df, _ = random_points(seed=seed, n_left=25, n_right=0)
+
+        kwargs = {"left_id": "left_id", "k_closest": 3, "radius_km": 2000}
+
+        expected = design_matrix(left_df, right_df, right_id="right_id", **kwargs)
+        result = index.design_matrix(left_df, chunk_size=7, **kwargs)
+
+        pd.testing.assert_frame_equal(result, expected)
+
+
+def test_geo_index_distance_table(random_points):
+    """Tests the index gives the same distance table."""
+
+    left_df, right_df = random_points(seed=0, n_left=20, n_right=30)
+    index = GeoIndex(right_df, right_id="right_id")
+
+    expected = distance_table(
+        left_df, right_df, left_id="left_id", right_id="right_id", max_distance_km=5000
+    )
+    result = index.distance_table(left_df, left_id="left_id", max_distance_km=5000)
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("engine", ["cross", "kdtree", "grid"])
+def test_geo_index_query_radius(engine, random_points):
+    """Tests query_radius finds the pairs the distance table keeps."""
+
+    if engine == "kdtree":
+        pytest.importorskip("scipy")
+
+    left_df, right_df = random_points(seed=0, n_left=30, n_right=40)
+    index = GeoIndex(right_df, right_id="right_id", engine=engine)
+
+    result = index.query_radius(left_df, radius_km=3000, left_id="left_id")
+
+    expected = distance_table(
+        left_df, right_df, left_id="left_id", right_id="right_id", max_distance_km=3000
+    )
+    expected = expected.sort_values(["left_id", "distance"], kind="stable")
+
+    assert list(result.columns) == ["left_id", "right_id", "distance"]
+    np.testing.assert_array_equal(result["left_id"], expected["left_id"])
+    np.testing.assert_array_equal(result["right_id"], expected["right_id"])
+    np.testing.assert_allclose(result["distance"], expected["distance"])
+
+    with pytest.raises(ValueError):
+        index.query_radius(left_df, radius_km=-1)
+
+
+@pytest.mark.parametrize("engine", ["cross", "kdtree", "grid"])
+@pytest.mark.parametrize("right_id", [None, "right_id"])
+def test_geo_index_save_load(tmp_path, engine, right_id, random_points):
+    """Tests a saved and loaded index gives the same results."""
+
+    if engine == "kdtree":
+        pytest.importorskip("scipy")
+
+    left_df, right_df = random_points(seed=0, n_left=25, n_right=40)
+    if right_id is None:
+        right_df = right_df.set_index("right_id")
+
+    index = GeoIndex(right_df, right_id=right_id, engine=engine)
+    index.save(tmp_path / "index.bin")
+
+    loaded = GeoIndex.load(tmp_path / "index.bin")
+
+    # pylint:disable-next=protected-access
+    assert isinstance(loaded._engine.right_points.cos_lat, np.memmap)
+
+    kwargs = {"left_id": "left_id", "k_closest": 3, "radius_km": 2000}
+    pd.testing.assert_frame_equal(
+        loaded.design_matrix(left_df, **kwargs), index.design_matrix(left_df, **kwargs)
+    )
+    pd.testing.assert_frame_equal(
+        loaded.distance_table(left_df, left_id="left_id"),
+        index.distance_table(left_df, left_id="left_id"),
+    )
+
+
+def test_geo_index_load_rejects_other_files(tmp_path, random_points):
+    """Tests loading fails for files that aren't indexes or have another version."""
+
+    _, right_df = random_points(seed=0, n_left=0, n_right=10)
+    GeoIndex(right_df, right_id="right_id").save(tmp_path / "index.bin")
+
+    content = (tmp_path / "index.bin").read_bytes()
+
+    # the format version follows the magic bytes
+    (tmp_path / "stale.bin").write_bytes(
+        content[:8] + b"\x00\x00\x00\x00" + content[12:]
+    )
+    with pytest.raises(ValueError, match="version"):
+        GeoIndex.load(tmp_path / "stale.bin")
+
+    (tmp_path / "other.bin").write_bytes(b"not an index")
+    with pytest.raises(ValueError, match="not a georelate index"):
+        GeoIndex.load(tmp_path / "other.bin")
+
+    (tmp_path / "truncated.bin").write_bytes(content[:-100])
+    with pytest.raises(ValueError, match="truncated"):
+        GeoIndex.load(tmp_path / "truncated.bin")
+
+
+def test_geo_index_save_callable_engine(tmp_path, random_points):
+    """Tests an index with a callable engine can't be saved."""
+
+    _, right_df = random_points(seed=0, n_left=0, n_right=10)
+    index = GeoIndex(right_df, right_id="right_id", engine=lambda *args: None)
+
+    with pytest.raises(ValueError, match="callable"):
+        index.save(tmp_path / "index.bin")
@@ -0,0 +1,196 @@
+"""Tests _metrics.py"""
+
+import numpy as np
+import pytest
+import georelate._metrics as metrics_module
+from georelate._haversine import haversine
+from georelate._metrics import (
+    equirectangular,
+    get_metric,
+    knn_metric_blocked,
+    radius_metric_blocked,
+    vincenty,
+)
+from georelate._search import get_engine
+
+
+def test_vincenty():
+    """Tests Vincenty's formulae against reference geodesics on WGS84."""
+
+    # flinders peak to buninyong, the example of Vincenty's paper, in kms
+    result = vincenty(
+        p1_lat=[-(37 + 57 / 60 + 3.72030 / 3600), 0.0, 10.0],
+        p1_lon=[144 + 25 / 60 + 29.52440 / 3600, 0.0, 20.0],
+        p2_lat=[-(37 + 39 / 60 + 10.15610 / 3600), 0.0, 10.0],
+        p2_lon=[143 + 55 / 60 + 35.38390 / 3600, 1.0, 20.0],
+    )
+
+    np.testing.assert_allclose(result, [54.972271, 111.319491, 0.0], atol=1e-6)
+
+
+def test_vincenty_antipodal():
+    """Tests that pairs that don't converge fall back to a finite distance."""
+
+    result = vincenty([0.0, 0.0], [0.0, 0.0], [0.0, 0.5], [180.0, 179.7])
+
+    assert np.isfinite(result).all()
+    np.testing.assert_allclose(result, 20000, rtol=0.005)
+
+
+def test_vincenty_shapes():
+    """Tests that vincenty broadcasts like haversine and casts to dtype."""
+
+    rng = np.random.default_rng(0)
+    lat, lon = rng.uniform(-90, 90, 5), rng.uniform(-180, 180, 5)
+
+    result = vincenty(
+        lat[:, np.newaxis], lon[:, np.newaxis], lat, lon, dtype=np.float32
+    )
+
+    assert result.shape == (5, 5)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(np.diag(result), 0, atol=1e-6)
+    np.testing.assert_allclose(
+        result, haversine(lat[:, np.newaxis], lon[:, np.newaxis], lat, lon), rtol=0.006
+    )
+
+
+def test_equirectangular():
+    """Tests the equirectangular approximation against haversine."""
+
+    rng = np.random.default_rng(1)
+
+    p1_lat, p1_lon = rng.uniform(-60, 60, 1000), rng.uniform(-180, 180, 1000)
+    p2_lat = p1_lat + rng.uniform(-0.5, 0.5, 1000)
+    p2_lon = p1_lon + rng.uniform(-0.5, 0.5, 1000)
+
+    # close points, including across the antimeridian
+    np.testing.assert_allclose(
+        equirectangular(p1_lat, p1_lon, p2_lat, p2_lon),
+        haversine(p1_lat, p1_lon, p2_lat, p2_lon),
+        rtol=1e-3,
+    )
+    np.testing.assert_allclose(
+        equirectangular(0.0, 179.9, 0.0, -179.9), haversine(0.0, 179.9, 0.0, -179.9)
+    )
+
+    # distant points are never closer than with haversine
+    p2_lat, p2_lon = rng.uniform(-90, 90, 1000), rng.uniform(-180, 180, 1000)
+    assert (
+        equirectangular(p1_lat, p1_lon, p2_lat, p2_lon)
+        >= haversine(p1_lat, p1_lon, p2_lat, p2_lon) * (1 - 1e-9)
+    ).all()
+
+
+def test_get_metric():
+    """Tests that unknown metrics raise a ValueError."""
+
+    assert get_metric("haversine") is haversine
+
+    with pytest.raises(ValueError, match="metric must be one of"):
+        get_metric("manhattan")
+
+
+def _clustered_points(seed, n_left, n_right):
+    """Makes left and right points in a few tight clusters, with many near ties."""
+
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-60, 60, (4, 2)) * [1, 3]
+
+    def points(n):
+        cluster = centers[rng.integers(len(centers), size=n)]
+        return (
+            cluster[:, 0] + rng.normal(0, 0.05, n),
+            cluster[:, 1] + rng.normal(0, 0.05, n),
+        )
+
+    return points(n_left), points(n_right)
+
+
+@pytest.mark.parametrize("metric", ["equirectangular", "vincenty"])
+@pytest.mark.parametrize("engine", ["cross", "kdtree", "grid"])
+def test_knn_metric_blocked(metric, engine):
+    """Tests that refining the haversine candidates matches a brute force search."""
+
+    if engine == "kdtree":
+        pytest.importorskip("scipy")
+
+    (left_lat, left_lon), (right_lat, right_lon) = _clustered_points(0, 50, 200)
+    search_engine = get_engine(engine, right_lat=right_lat, right_lon=right_lon)
+
+    indices, distances = knn_metric_blocked(
+        search_engine, left_lat, left_lon, k=5, metric=metric, chunk_size=16
+    )
+
+    all_distances = get_metric(metric)(
+        left_lat[:, np.newaxis], left_lon[:, np.newaxis], right_lat, right_lon
+    )
+    expected = np.argsort(all_distances, axis=1, kind="stable")[:, :5]
+
+    np.testing.assert_array_equal(indices, expected)
+    np.testing.assert_allclose(
+        distances, np.take_along_axis(all_distances, expected, axis=1)
+    )
+
+
+@pytest.mark.parametrize("metric", ["equirectangular", "vincenty"])
+def test_radius_metric_blocked(metric):
+    """Tests that the radius search keeps the pairs within the radius with the metric."""
+
+    (left_lat, left_lon), (right_lat, right_lon) = _clustered_points(1, 30, 100)
+    search_engine = get_engine("cross", right_lat=right_lat, right_lon=right_lon)
+
+    left_positions, right_positions, distances = radius_metric_blocked(
+        search_engine, left_lat, left_lon, radius_km=5.0, metric=metric
+    )
+
+    all_distances = get_metric(metric)(
+        left_lat[:, np.newaxis], left_lon[:, np.newaxis], right_lat, right_lon
+    )
+    expected_left, expected_right = np.nonzero(all_distances <= 5.0)
+    order = np.lexsort(
+        (expected_right, all_distances[expected_left, expected_right], expected_left)
+    )
+
+    np.testing.assert_array_equal(left_positions, expected_left[order])
+    np.testing.assert_array_equal(right_positions, expected_right[order])
+    np.testing.assert_allclose(
+        distances, all_distances[expected_left[order], expected_right[order]]
+    )
+
+
+def test_knn_metric_blocked_refines(monkeypatch):
+    """Tests that rows fetch more candidates until the metric's order is certain."""
+
+    # right points at nearly the same distance around the left points,
+    # so haversine and Vincenty order them differently
+    rng = np.random.default_rng(2)
+    angles = rng.uniform(0, 2 * np.pi, 300)
+    ring = 1 + rng.uniform(0, 0.002, 300)
+    right_lat, right_lon = ring * np.sin(angles), ring * np.cos(angles)
+    left_lat, left_lon = np.array([0.0, 0.001]), np.array([0.0, -0.001])
+
+    searches = []
+    knn_blocked = metrics_module.knn_blocked
+
+    def counted(*args):
+        searches.append(args[3])
+        return knn_blocked(*args)
+
+    monkeypatch.setattr(metrics_module, "knn_blocked", counted)
+
+    search_engine = get_engine("cross", right_lat=right_lat, right_lon=right_lon)
+    indices, _ = knn_metric_blocked(
+        search_engine, left_lat, left_lon, k=3, metric="vincenty"
+    )
+
+    expected = np.argsort(
+        vincenty(
+            left_lat[:, np.newaxis], left_lon[:, np.newaxis], right_lat, right_lon
+        ),
+        axis=1,
+        kind="stable",
+    )[:, :3]
+
+    assert len(searches) > 1
+    np.testing.assert_array_equal(indices, expected)
@@ -0,0 +1,80 @@
+"""Tests _profile.py"""
+
+import logging
+
+import numpy as np
+from georelate import design_matrix, distance_table, profile
+
+
+def test_profile_design_matrix(random_points):
+    """Tests each stage of design_matrix is recorded."""
+
+    left_df, right_df = random_points(seed=0, n_left=20, n_right=30)
+    records = []
+
+    with profile(callback=records.append, trace_memory=True) as report:
+        design_matrix(left_df, right_df, k_closest=2, radius_km=1000)
+
+    summary = report.summary()
+
+    assert list(summary.index) == [
+        "prepare_right",
+        "knn",
+        "k_closest_columns",
+        "radius",
+        "radius_features",
+    ]
+    assert summary.loc["knn", "rows"] == 20
+    assert summary.loc["prepare_right", "rows"] == 30
+    assert (summary["bytes"] > 0).all()
+    assert records == report.records
+    assert report.seconds > 0
+
+
+def test_profile_disabled_and_logging(caplog, random_points):
+    """Tests nothing is recorded outside the context, and stages can be logged."""
+
+    left_df, right_df = random_points(seed=0, n_left=5, n_right=5)
+
+    with profile() as report:
+        pass
+    distance_table(left_df, right_df)
+
+    assert len(report) == 0
+
+    with caplog.at_level(logging.INFO, logger="georelate"):
+        with profile(log=True) as report:
+            distance_table(left_df, right_df)
+
+    assert [record.georelate_stage["name"] for record in caplog.records] == [
+        "prepare",
+        "distances",
+        "concat",
+    ]
+    assert report.summary().loc["distances", "rows"] == 25
+    assert report.summary()["bytes"].isna().all()
+
+
+def test_profile_threads(random_points):
+    """Tests the stages run in threads, e.g. per key of by, are recorded."""
+
+    left_df, right_df = random_points(seed=1, n_left=40, n_right=60)
+    left_df["c"] = np.arange(40) % 4
+    right_df["c"] = np.arange(60) % 4
+
+    with profile() as report:
+        design_matrix(left_df, right_df, k_closest=2, by="c", n_jobs=4)
+
+    summary = report.summary()
+    assert summary.loc["prepare_right", "calls"] == 4
+    assert summary.loc["knn", "calls"] == 4
+    assert summary.loc["knn", "rows"] == 40
+    assert "k_closest_columns" in summary.index
+
+    with profile() as report:
+        distance_table(left_df, right_df, by="c", n_jobs=4)
+
+    summary = report.summary()
+    assert list(summary.index) == ["prepare", "distances", "concat"]
+    assert summary.loc["distances", "calls"] == 4
+    assert summary.loc["distances", "rows"] == 4 * 10 * 15
@@ -0,0 +1,142 @@
+"""Tests _search.py"""
+
+import numpy as np
+import pytest
+from georelate._search import (
+    _grid_cells,
+    _grid_columns,
+    _grid_rows,
+    get_engine,
+    k_smallest,
+)
+from georelate.data import (
+    make_clustered_points,
+    make_country_points,
+    make_duplicate_points,
+    make_uniform_points,
+)
+
+
+def test_k_smallest_ties():
+    """Tests that k_smallest keeps the first of tied distances, like nsmallest."""
+
+    distances = np.array(
+        [
+            [3.0, 3.0, 0.5, 3.0],
+            [5.0, 1.0, 1.0, 1.0],
+        ]
+    )
+
+    indices, k_distances = k_smallest(distances, k=2)
+
+    np.testing.assert_array_equal(indices, [[2, 0], [1, 2]])
+    np.testing.assert_array_equal(k_distances, [[0.5, 3.0], [1.0, 1.0]])
+
+
+@pytest.mark.parametrize(
+    "right_df, left_df",
+    [
+        (make_uniform_points(3000, seed=0), make_uniform_points(300, seed=1)),
+        (make_clustered_points(3000, seed=0), make_uniform_points(300, seed=1)),
+        (make_clustered_points(3000, seed=0), make_clustered_points(300, seed=10)),
+        (
+            make_duplicate_points(1000, n_unique=20, seed=0),
+            make_duplicate_points(200, n_unique=20, seed=0),
+        ),
+        (
+            make_country_points(2000, "fiji", seed=0),
+            make_country_points(200, "fiji", seed=1),
+        ),
+        (
+            make_country_points(2000, "antarctica", seed=0),
+            make_uniform_points(200, seed=1),
+        ),
+    ],
+    ids=["uniform", "clustered", "far_clusters", "duplicates", "antimeridian", "pole"],
+)
+def test_grid_engine_matches_cross(right_df, left_df):
+    """Tests the grid engine finds the same neighbours and pairs as the cross engine."""
+
+    right_lat, right_lon = right_df["lat"].to_numpy(), right_df["lon"].to_numpy()
+    left_lat, left_lon = left_df["lat"].to_numpy(), left_df["lon"].to_numpy()
+
+    cross = get_engine("cross", right_lat, right_lon)
+    grid = get_engine("grid", right_lat, right_lon)
+
+    for k in [1, 7]:
+        for expected, result in zip(
+            cross.query(left_lat, left_lon, k), grid.query(left_lat, left_lon, k)
+        ):
+            np.testing.assert_array_equal(result, expected)
+
+    for radius_km in [0, 50, 5000]:
+        for expected, result in zip(
+            cross.query_radius(left_lat, left_lon, radius_km),
+            grid.query_radius(left_lat, left_lon, radius_km),
+        ):
+            np.testing.assert_array_equal(result, expected)
+
+
+def test_grid_engine_batches(monkeypatch):
+    """Tests the grid engine gives the same results in small blocks and batches."""
+
+    right_df = make_duplicate_points(1000, n_unique=20, seed=0)
+    left_df = make_clustered_points(300, seed=1)
+    right_lat, right_lon = right_df["lat"].to_numpy(), right_df["lon"].to_numpy()
+    left_lat, left_lon = left_df["lat"].to_numpy(), left_df["lon"].to_numpy()
+
+    cross = get_engine("cross", right_lat, right_lon)
+    grid = get_engine("grid", right_lat, right_lon)
+
+    monkeypatch.setattr("georelate._search._GRID_BLOCK_SIZE", 7)
+    monkeypatch.setattr("georelate._search._GRID_MAX_CANDIDATES", 30)
+
+    for expected, result in zip(
+        cross.query(left_lat, left_lon, 5), grid.query(left_lat, left_lon, 5)
+    ):
+        np.testing.assert_array_equal(result, expected)
+
+    for expected, result in zip(
+        cross.query_radius(left_lat, left_lon, 500),
+        grid.query_radius(left_lat, left_lon, 500),
+    ):
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_grid_engine_non_finite_coordinates():
+    """Tests the grid engine stops searching for points with non-finite coordinates."""
+
+    right_lat, right_lon = np.arange(10.0), np.arange(10.0)
+    right_lat[3] = np.nan
+
+    cross = get_engine("cross", right_lat, right_lon)
+    grid = get_engine("grid", right_lat, right_lon)
+
+    with pytest.raises(ValueError, match="finite"):
+        grid.query(np.array([np.nan, 1.0]), np.array([1.0, 1.0]), k=1)
+
+    with pytest.raises(ValueError, match="finite"):
+        grid.query(np.array([1.0]), np.array([1.0]), k=10)
+
+    # the right point with a NaN latitude is never needed with k=9
+    for expected, result in zip(
+        cross.query(np.array([1.0]), np.array([1.0]), 9),
+        grid.query(np.array([1.0]), np.array([1.0]), 9),
+    ):
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_grid_engine_cells():
+    """Tests the grid's columns widen towards the poles and wrap at the antimeridian."""
+
+    height = 1.0
+    rows = _grid_rows(np.array([0.5, 60.5, 89.5]), height)
+    n_columns = _grid_columns(rows, height)
+
+    assert n_columns[0] == 359
+    assert n_columns[1] == int(360 * np.cos(np.radians(61)))
+    assert n_columns[2] == 1
+
+    # longitudes 180 and -180 are the same cell
+    cells = _grid_cells(np.array([10.0, 10.0]), np.array([180.0, -180.0]), height)
+    assert cells[0] == cells[1]
@@ -0,0 +1,107 @@
+"""Tests _self_join.py"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from georelate import distance_matrix, self_design_matrix
+from georelate.data import make_clustered_points, make_duplicate_points
+
+
+def _expected_neighbours(points_df, k):
+    """Finds the k closest other points by brute force, ties broken by position."""
+
+    distances = distance_matrix(
+        points_df["lat"], points_df["lon"], points_df["lat"], points_df["lon"]
+    )
+    np.fill_diagonal(distances, np.inf)
+
+    positions = np.broadcast_to(np.arange(len(points_df)), distances.shape)
+    order = np.lexsort((positions, distances), axis=1)[:, :k]
+
+    return order, np.take_along_axis(distances, order, axis=1)
+
+
+@pytest.mark.parametrize(
+    "engine, chunk_size, n_jobs",
+    [
+        ("cross", None, None),
+        ("cross", 7, None),
+        ("cross", 7, 2),
+        ("kdtree", None, None),
+    ],
+)
+def test_self_design_matrix_k_closest(engine, chunk_size, n_jobs):
+    """Tests each row gets its closest other rows, including duplicates of itself."""
+
+    if engine == "kdtree":
+        pytest.importorskip("scipy")
+
+    points_df = pd.concat(
+        [
+            make_clustered_points(40, n_clusters=3, seed=0),
+            make_duplicate_points(20, n_unique=4, seed=1),
+        ],
+        ignore_index=True,
+    )
+    points_df["id"] = [f"p{i}" for i in range(len(points_df))]
+    points_df["size"] = np.arange(len(points_df))
+
+    result = self_design_matrix(
+        points_df,
+        df_id="id",
+        k_closest=3,
+        engine=engine,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+    )
+    order, distances = _expected_neighbours(points_df, k=3)
+
+    id_columns = ["id_1_closest", "id_2_closest", "id_3_closest"]
+    distance_columns = [
+        "distance_1_closest",
+        "distance_2_closest",
+        "distance_3_closest",
+    ]
+
+    assert list(result.columns[:2]) == ["id", "size"]
+    assert "size_3_closest" in result.columns
+    np.testing.assert_allclose(result[distance_columns].to_numpy(), distances)
+    if engine == "cross":
+        np.testing.assert_array_equal(
+            result[id_columns].to_numpy(), points_df["id"].to_numpy()[order]
+        )
+    assert (result[id_columns].to_numpy() != result[["id"]].to_numpy()).all()
+
+
+def test_self_design_matrix_radius():
+    """Tests the radius features count the other rows only."""
+
+    points_df = make_clustered_points(50, n_clusters=2, seed=2)
+
+    result = self_design_matrix(points_df, radius_km=300, include_coords=True)
+
+    distances = distance_matrix(
+        points_df["lat"], points_df["lon"], points_df["lat"], points_df["lon"]
+    )
+    np.fill_diagonal(distances, np.inf)
+    within = distances <= 300
+
+    assert {"lat", "lon", "id"} <= set(result.columns)
+    np.testing.assert_array_equal(result["count_within_radius"], within.sum(axis=1))
+    np.testing.assert_allclose(
+        result["min_distance_within_radius"],
+        np.where(
+            within.any(axis=1), np.where(within, distances, np.inf).min(axis=1), np.nan
+        ),
+    )
+
+
+def test_self_design_matrix_errors():
+    """Tests k_closest must leave out the row itself."""
+
+    points_df = make_clustered_points(5, n_clusters=1, seed=0)
+
+    with pytest.raises(ValueError):
+        self_design_matrix(points_df, k_closest=5)
+    with pytest.raises(ValueError):
+        self_design_matrix(points_df, radius_km=-1)
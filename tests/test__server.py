@@ -0,0 +1,236 @@
+"""Tests _server.py"""
+
+import asyncio
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from georelate import GeoIndex, GeoServer, design_matrix
+from georelate.data import make_uniform_points
+
+
+@pytest.fixture(name="right_df")
+def fixture_right_df():
+    """Random right points with string ids."""
+
+    right_df = make_uniform_points(200, seed=0)
+    right_df["id"] = [f"r{i}" for i in range(len(right_df))]
+    return right_df
+
+
+def test_geo_server_query_matches_design_matrix(right_df):
+    """Tests concurrent queries give the rows of the design matrix of their points."""
+
+    left_df = make_uniform_points(12, seed=1)
+    server = GeoServer(GeoIndex(right_df, right_id="id"))
+
+    async def run():
+        return await asyncio.gather(
+            *(
+                server.query(
+                    left_df["lat"].iloc[start : start + 3],
+                    left_df["lon"].iloc[start : start + 3],
+                    k_closest=2,
+                    radius_km=3000,
+                )
+                for start in range(0, len(left_df), 3)
+            )
+        )
+
+    results = asyncio.run(run())
+
+    expected = design_matrix(
+        left_df,
+        right_df,
+        left_id="id",
+        right_id="id",
+        k_closest=2,
+        radius_km=3000,
+    )
+
+    assert len(results) == 4
+    np.testing.assert_array_equal(
+        np.concatenate([result["ids"] for result in results]),
+        expected[["id_right_1_closest", "id_right_2_closest"]].to_numpy(),
+    )
+    np.testing.assert_allclose(
+        np.concatenate([result["distances"] for result in results]),
+        expected[["distance_1_closest", "distance_2_closest"]].to_numpy(),
+    )
+    for column in [
+        "count_within_radius",
+        "min_distance_within_radius",
+        "mean_distance_within_radius",
+    ]:
+        np.testing.assert_allclose(
+            np.concatenate([result[column] for result in results]),
+            expected[column].to_numpy(dtype=float),
+        )
+
+
+def test_geo_server_batches_concurrent_queries(right_df):
+    """Tests queries arriving together are answered by one search per k_closest."""
+
+    index = GeoIndex(right_df, right_id="id")
+    server = GeoServer(index, max_delay=0.01)
+
+    calls = []
+    knn_arrays = index.knn_arrays
+
+    def counting_knn_arrays(*args, **kwargs):
+        calls.append(kwargs["k"])
+        return knn_arrays(*args, **kwargs)
+
+    index.knn_arrays = counting_knn_arrays
+
+    async def run():
+        return await asyncio.gather(
+            *(server.query(i, -i, k_closest=1 + i % 2) for i in range(20))
+        )
+
+    results = asyncio.run(run())
+
+    assert sorted(calls) == [1, 2]
+    for i, result in enumerate(results):
+        expected_ids, _ = knn_arrays([i], [-i], k=1 + i % 2)
+        np.testing.assert_array_equal(result["ids"], index.right_ids[expected_ids])
+
+
+def test_geo_server_query_errors(right_df):
+    """Tests invalid queries fail without affecting the others."""
+
+    server = GeoServer(GeoIndex(right_df, right_id="id"), max_delay=0.01)
+
+    async def run():
+        return await asyncio.gather(
+            server.query(0, 0, k_closest=1),
+            server.query([0, 1], [0], k_closest=1),
+            server.query(0, 0, k_closest=500),
+            server.query(0, 0),
+            server.query([0, np.nan], [0, 0], k_closest=1),
+            server.query(0, np.inf, k_closest=1),
+            return_exceptions=True,
+        )
+
+    valid, *errors = asyncio.run(run())
+
+    assert valid["ids"].shape == (1, 1)
+    assert all(isinstance(error, ValueError) for error in errors)
+
+
+def test_geo_server_http(right_df):
+    """Tests the HTTP endpoints on a local port, reusing the connection."""
+
+    server = GeoServer(GeoIndex(right_df, right_id="id"))
+
+    async def request(reader, writer, method, target, payload=None):
+        body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"{method} {target} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while (line := await reader.readline()) != b"\r\n":
+            name, _, value = line.decode().partition(":")
+            headers[name.lower()] = value.strip()
+        content = await reader.readexactly(int(headers["content-length"]))
+
+        return status, json.loads(content)
+
+    async def run():
+        http_server = await server.start()
+        port = http_server.sockets[0].getsockname()[1]
+
+        async with http_server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            responses = [
+                await request(reader, writer, "GET", "/health"),
+                await request(
+                    reader,
+                    writer,
+                    "POST",
+                    "/query",
+                    {"lat": 10.5, "lon": -20, "k_closest": 2, "radius_km": 0},
+                ),
+                await request(reader, writer, "POST", "/query", {"lat": [1]}),
+                await request(reader, writer, "GET", "/query"),
+                await request(reader, writer, "GET", "/missing"),
+            ]
+            writer.close()
+            await writer.wait_closed()
+
+        return responses
+
+    health, query, invalid, wrong_method, missing = asyncio.run(run())
+
+    assert health == (200, {"rows": 200})
+
+    status, result = query
+    assert status == 200
+    expected_ids, expected_distances = server.index.knn_arrays([10.5], [-20], k=2)
+    assert result["ids"] == right_df["id"].to_numpy()[expected_ids].tolist()
+    np.testing.assert_allclose(result["distances"], expected_distances)
+    assert result["count_within_radius"] == [0]
+    assert result["min_distance_within_radius"] == [None]
+
+    assert invalid[0] == 400
+    assert wrong_method[0] == 405
+    assert missing[0] == 404
+
+
+def test_geo_server_http_malformed(right_df):
+    """Tests malformed requests get a 400 without failing the valid ones."""
+
+    server = GeoServer(GeoIndex(right_df, right_id="id"), max_delay=0.01)
+
+    async def post(port, payload, length=None):
+        body = json.dumps(payload).encode("utf-8")
+        length = len(body) if length is None else length
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(
+            f"POST /query HTTP/1.1\r\nContent-Length: {length}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        _, _, content = (await reader.read()).partition(b"\r\n\r\n")
+        writer.close()
+        await writer.wait_closed()
+
+        return status, json.loads(content)
+
+    async def run():
+        http_server = await server.start()
+        port = http_server.sockets[0].getsockname()[1]
+
+        async with http_server:
+            return await asyncio.gather(
+                post(port, {"lat": 1.0, "lon": 0, "k_closest": 1}),
+                post(port, {"lat": float("nan"), "lon": 0, "k_closest": 1}),
+                post(port, {"lat": 1.0, "lon": 0, "k_closest": 1}, length="ten"),
+            )
+
+    (valid, _), (non_finite, error), (malformed, _) = asyncio.run(run())
+
+    assert valid == 200
+    assert non_finite == 400
+    assert "finite" in error["error"]
+    assert malformed == 400
+
+
+def test_geo_server_empty_index():
+    """Tests a server over an empty index rejects nearest neighbour queries."""
+
+    index = GeoIndex(pd.DataFrame({"lat": [], "lon": []}))
+    server = GeoServer(index)
+
+    with pytest.raises(ValueError):
+        asyncio.run(server.query(0, 0, k_closest=1))
+
+    result = asyncio.run(server.query(0, 0, radius_km=10))
+    assert result["count_within_radius"].tolist() == [0]
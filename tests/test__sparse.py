@@ -0,0 +1,108 @@
+"""Tests _sparse.py"""
+
+import numpy as np
+import pytest
+from georelate import GeoIndex, distance_matrix, knn_arrays, neighbour_matrix
+from georelate.data import make_clustered_points, make_uniform_points
+
+
+@pytest.mark.parametrize("engine", ["cross", "kdtree"])
+def test_neighbour_matrix_k_closest(engine):
+    """Tests each row holds the distances to the k closest right rows."""
+
+    pytest.importorskip("scipy")
+
+    left_df = make_uniform_points(50, seed=0)
+    right_df = make_uniform_points(80, seed=1)
+
+    matrix = neighbour_matrix(left_df, right_df, k_closest=3, engine=engine)
+    indices, distances = knn_arrays(
+        left_df["lat"], left_df["lon"], right_df["lat"], right_df["lon"], k=3
+    )
+
+    assert matrix.shape == (50, 80)
+    assert matrix.nnz == 150
+    np.testing.assert_array_equal(matrix.indices.reshape(50, 3), indices)
+    np.testing.assert_allclose(matrix.data.reshape(50, 3), distances)
+
+
+def test_neighbour_matrix_radius():
+    """Tests the matrix holds every pair within the radius and no other."""
+
+    pytest.importorskip("scipy")
+
+    left_df = make_clustered_points(60, n_clusters=3, seed=0)
+    right_df = make_clustered_points(70, n_clusters=3, seed=0)
+
+    matrix = neighbour_matrix(left_df, right_df, radius_km=200)
+    dense = distance_matrix(
+        left_df["lat"], left_df["lon"], right_df["lat"], right_df["lon"]
+    )
+
+    within = dense <= 200
+    assert matrix.nnz == within.sum()
+    np.testing.assert_allclose(matrix.toarray()[within], dense[within])
+    assert (matrix.toarray()[~within] == 0).all()
+
+    # the spatial lag of a column is a product with the matrix
+    weights = matrix.copy()
+    weights.data = np.ones_like(weights.data)
+    values = right_df["lat"].to_numpy()
+    np.testing.assert_allclose(weights @ values, (within * values).sum(axis=1))
+
+
+def test_neighbour_matrix_as_arrays():
+    """Tests the arrays hold the pairs within the radius, with empty rows, without scipy."""
+
+    left_df = make_uniform_points(30, seed=2)
+    right_df = make_uniform_points(40, seed=3)
+
+    indptr, indices, data = neighbour_matrix(
+        left_df, right_df, radius_km=1500, as_arrays=True
+    )
+    dense = distance_matrix(
+        left_df["lat"], left_df["lon"], right_df["lat"], right_df["lon"]
+    )
+
+    assert len(indptr) == 31
+    assert (np.diff(indptr) == 0).any()
+
+    for row, (start, stop) in enumerate(zip(indptr[:-1], indptr[1:])):
+        np.testing.assert_array_equal(
+            np.sort(indices[start:stop]), np.flatnonzero(dense[row] <= 1500)
+        )
+        np.testing.assert_allclose(data[start:stop], dense[row, indices[start:stop]])
+
+        # each row is ordered by distance
+        assert (np.diff(data[start:stop]) >= 0).all()
+
+
+def test_geo_index_neighbour_matrix():
+    """Tests the index gives the same matrix as the function."""
+
+    pytest.importorskip("scipy")
+
+    left_df = make_uniform_points(20, seed=4)
+    right_df = make_uniform_points(25, seed=5)
+    index = GeoIndex(right_df)
+
+    for kwargs in [{"k_closest": 4}, {"radius_km": 3000}]:
+        expected = neighbour_matrix(left_df, right_df, **kwargs)
+        result = index.neighbour_matrix(left_df, **kwargs)
+        assert (result != expected).nnz == 0
+        np.testing.assert_array_equal(result.indices, expected.indices)
+
+
+def test_neighbour_matrix_errors():
+    """Tests exactly one valid neighbourhood must be passed."""
+
+    points_df = make_uniform_points(5, seed=0)
+
+    for kwargs in [
+        {},
+        {"k_closest": 2, "radius_km": 10},
+        {"k_closest": 6},
+        {"radius_km": -1},
+    ]:
+        with pytest.raises(ValueError):
+            neighbour_matrix(points_df, points_df, **kwargs)
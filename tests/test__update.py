@@ -0,0 +1,161 @@
+"""Tests _update.py"""
+
+import pandas as pd
+import pytest
+import georelate._update as update_module
+from georelate import design_matrix, update_design_matrix
+
+
+@pytest.mark.parametrize("engine", ["cross", "kdtree"])
+def test_update_design_matrix(engine, random_points):
+    """Tests updating gives the same design matrix as building it again."""
+
+    if engine == "kdtree":
+        pytest.importorskip("scipy")
+
+    left_df, right_df = random_points(seed=0, n_left=200, n_right=100)
+    _, inserted_df = random_points(seed=1, n_left=0, n_right=5)
+
+    deleted_df = right_df.iloc[[3, 50]]
+    # a moved row is deleted, then inserted
+    moved_df = right_df.iloc[[10]].assign(lat=0.0, lon=0.0)
+
+    updated_df = pd.concat(
+        [right_df.drop(index=[3, 10, 50]), moved_df, inserted_df], ignore_index=True
+    )
+
+    kwargs = {
+        "left_id": "left_id",
+        "right_id": "right_id",
+        "k_closest": 3,
+        "radius_km": 1500,
+        "engine": engine,
+    }
+
+    previous = design_matrix(left_df, right_df, **kwargs)
+    expected = design_matrix(left_df, updated_df, **kwargs)
+
+    result = update_design_matrix(
+        previous,
+        left_df,
+        updated_df,
+        inserted=pd.concat([moved_df, inserted_df]),
+        deleted=pd.concat([deleted_df, right_df.iloc[[10]]]),
+        **kwargs,
+    )
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_update_design_matrix_searches_affected_rows(monkeypatch, random_points):
+    """Tests only the left rows a removed observation was close to are searched again."""
+
+    left_df, right_df = random_points(seed=0, n_left=200, n_right=100)
+
+    previous = design_matrix(left_df, right_df, right_id="right_id", k_closest=2)
+    deleted_df = right_df.iloc[[7]]
+    n_affected = (
+        (previous[["right_id_1_closest", "right_id_2_closest"]] == "r0_7")
+        .to_numpy()
+        .any(axis=1)
+        .sum()
+    )
+
+    sizes = []
+    knn_blocked = update_module.knn_blocked
+
+    def counting_knn_blocked(engine, left_lat, **kwargs):
+        sizes.append(len(left_lat))
+        return knn_blocked(engine, left_lat=left_lat, **kwargs)
+
+    monkeypatch.setattr(update_module, "knn_blocked", counting_knn_blocked)
+
+    result = update_design_matrix(
+        previous,
+        left_df,
+        right_df.drop(index=7),
+        deleted=deleted_df,
+        right_id="right_id",
+        k_closest=2,
+    )
+
+    assert sizes == [n_affected]
+    pd.testing.assert_frame_equal(
+        result,
+        design_matrix(
+            left_df, right_df.drop(index=7), right_id="right_id", k_closest=2
+        ),
+    )
+
+
+def test_update_design_matrix_ties():
+    """Tests ties are broken by position in the updated right DataFrame."""
+
+    left_df = pd.DataFrame(
+        {"left_id": [0, 1, 2], "lat": [0.0, 1.0, 5.0], "lon": [0.0, 1.0, 5.0]}
+    )
+    # a, c and d are as close to every left row, and so are the inserted e and f
+    right_df = pd.DataFrame(
+        {
+            "right_id": ["a", "b", "c", "d"],
+            "lat": [0.0, 3.0, 0.0, 0.0],
+            "lon": [0.0, 3.0, 0.0, 0.0],
+        }
+    )
+    inserted_df = pd.DataFrame(
+        {"right_id": ["e", "f"], "lat": [0.0, 0.0], "lon": [0.0, 0.0]}
+    )
+    updated_df = pd.concat(
+        [inserted_df.iloc[[0]], right_df.drop(index=1), inserted_df.iloc[[1]]],
+        ignore_index=True,
+    )
+
+    kwargs = {"left_id": "left_id", "right_id": "right_id", "k_closest": 2}
+
+    previous = design_matrix(left_df, right_df, **kwargs)
+    expected = design_matrix(left_df, updated_df, **kwargs)
+
+    result = update_design_matrix(
+        previous,
+        left_df,
+        updated_df,
+        inserted=inserted_df,
+        deleted=right_df.iloc[[1]],
+        **kwargs,
+    )
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert result["right_id_1_closest"].tolist() == ["e", "e", "e"]
+    assert result["right_id_2_closest"].tolist() == ["a", "a", "a"]
+
+    # reordering the tied rows would change the closest observations
+    with pytest.raises(ValueError, match="order"):
+        update_design_matrix(previous, left_df, right_df.iloc[::-1], **kwargs)
+
+
+def test_update_design_matrix_errors(random_points):
+    """Tests mismatched inputs raise errors."""
+
+    left_df, right_df = random_points(seed=0, n_left=10, n_right=10)
+    previous = design_matrix(left_df, right_df, right_id="right_id", k_closest=2)
+
+    with pytest.raises(ValueError, match="rows"):
+        update_design_matrix(
+            previous, left_df.iloc[:5], right_df, right_id="right_id", k_closest=2
+        )
+
+    with pytest.raises(ValueError, match="columns"):
+        update_design_matrix(
+            previous, left_df, right_df, right_id="right_id", k_closest=3
+        )
+
+    _, inserted_df = random_points(seed=1, n_left=0, n_right=2)
+    with pytest.raises(ValueError, match="inserted"):
+        update_design_matrix(
+            previous,
+            left_df,
+            right_df,
+            inserted=inserted_df,
+            right_id="right_id",
+            k_closest=2,
+        )